@@ -4,8 +4,8 @@
 
 from unittest import TestCase
 from unittest.mock import mock_open, patch
-from biocrnpyler import ChemicalReactionNetwork, Species, Reaction, Complex
-from biocrnpyler import ProportionalHillPositive, ParameterEntry, ParameterKey
+from biocrnpyler import ChemicalReactionNetwork, Species, Reaction, Complex, WeightedSpecies
+from biocrnpyler import ProportionalHillPositive, HillPositive, ParameterEntry, ParameterKey
 import libsbml
 import warnings
 
@@ -173,6 +173,42 @@ class TestChemicalReactionNetwork(TestCase):
         self.assertFalse(r1 in new_crn.reactions)
         self.assertTrue(r1_new in new_crn.reactions)
 
+    def test_replace_species_in_place_and_shared(self):
+        c1 = Complex([self.s1, self.s_old])
+        r1 = Reaction.from_massaction([self.s1, self.s_old], [c1], k_forward=1)
+        r2 = Reaction.from_massaction([self.s2], [self.s3], k_forward=1)
+        prop_hill = ProportionalHillPositive(k=1., s1=self.s_old, K=10, d=self.s2, n=2)
+        r3 = Reaction([self.s2], [self.s2, self.s4], propensity_type=prop_hill)
+        crn = ChemicalReactionNetwork(species=[self.s1, self.s_old, c1, self.s2, self.s3, self.s4],
+                                      reactions=[r1, r2, r3], first_order_sinks={self.s_old: 1})
+        c1_new = Complex([self.s1, self.s_new])
+        r1_new = Reaction.from_massaction([self.s1, self.s_new], [c1_new], k_forward=1)
+
+        shared_crn = crn.replace_species(self.s_old, self.s_new, share_structure=True)
+        self.assertEqual(shared_crn.species, [self.s1, self.s_new, c1_new, self.s2, self.s3, self.s4])
+        self.assertEqual(shared_crn.reactions[0], r1_new)
+        self.assertEqual(shared_crn.reactions[2].propensity_type.propensity_dict['species']['s1'], self.s_new)
+        # unchanged objects are shared and self is not modified
+        self.assertIs(shared_crn.reactions[1], crn.reactions[1])
+        self.assertIs(shared_crn.species[0], crn.species[0])
+        self.assertEqual(crn.reactions[0], r1)
+        self.assertEqual(crn.reactions[2].propensity_type.propensity_dict['species']['s1'], self.s_old)
+        self.assertEqual(list(shared_crn.first_order_sinks), [self.s_new])
+
+        crn.replace_species(self.s_old, self.s_new, in_place=True)
+        self.assertEqual(crn.species, shared_crn.species)
+        self.assertEqual(crn.reactions[0], r1_new)
+        # the incidence index was updated in place
+        self.assertEqual(crn.get_reactions_consuming(self.s_new, return_indices=True), [0])
+        self.assertEqual(crn.get_reactions_modified_by(self.s_new, return_indices=True), [2])
+        self.assertEqual(crn.get_reactions_involving(self.s_old), [])
+        self.assertEqual(crn.get_all_species_containing(self.s_new), [self.s_new, c1_new])
+
+        # replacing a species by a species of the CRN does not duplicate it
+        crn.replace_species(self.s3, self.s4, in_place=True)
+        self.assertEqual(crn.species, [self.s1, self.s_new, c1_new, self.s2, self.s4])
+        self.assertEqual(crn.get_reactions_producing(self.s4, return_indices=True), [1, 2])
+
     def test_write_sbml_file(self):
         s1, s2 = Species("S1"), Species("S2")
         rx1 = Reaction.from_massaction(inputs=[s1], outputs=[s2], k_forward=0.1)
@@ -187,4 +223,264 @@ class TestChemicalReactionNetwork(TestCase):
             crn.write_sbml_file(file_name, model_id=model_id)
 
             _file.assert_called_once_with(file_name, 'w')
-            _file().write.assert_called_once_with(sbml_string)
\ No newline at end of file
+            _file().write.assert_called_once_with(sbml_string)
+
+    def test_get_conservation_laws(self):
+        A, B = Species("A"), Species("B")
+        C = Complex([A, B])
+        D = Species("D")
+        rxn1 = Reaction.from_massaction([A, B], [C], k_forward=1, k_reverse=.1)
+        rxn2 = Reaction.from_massaction([C], [C, D], k_forward=1)
+        crn = ChemicalReactionNetwork(species=[A, B, C, D], reactions=[rxn1, rxn2])
+
+        laws = crn.get_conservation_laws()
+        # A+C and B+C are conserved, D is produced
+        self.assertEqual(len(laws), 2)
+        for law in laws:
+            self.assertTrue(D not in law)
+            self.assertEqual(law[C], 1)
+        self.assertTrue({A: 1, C: 1} in laws)
+        self.assertTrue({B: 1, C: 1} in laws)
+
+        # every law is in the left null space of the stoichiometric matrix
+        species_index = crn.get_species_index()
+        for column in crn.get_stoichiometry():
+            for law in laws:
+                self.assertEqual(sum(law[s]*column.get(species_index[s], 0) for s in law), 0)
+
+        # laws can be returned as strings
+        self.assertTrue({repr(A): 1, repr(C): 1} in crn.get_conservation_laws(return_as_strings=True))
+
+    def test_conservation_laws_with_stoichiometry(self):
+        A = Species("A")
+        A2 = Complex([A, A])
+        rxn = Reaction.from_massaction([WeightedSpecies(A, 2)], [A2], k_forward=1, k_reverse=1)
+        crn = ChemicalReactionNetwork(species=[A, A2], reactions=[rxn])
+
+        # exact integer law: A + 2 A2
+        self.assertEqual(crn.get_conservation_laws(), [{A: 1, A2: 2}])
+
+        # a species without reactions is trivially conserved
+        crn.add_species(Species("E"))
+        self.assertEqual(len(crn.get_conservation_laws()), 2)
+
+    def test_prune_unreachable(self):
+        A = Species("A", initial_concentration=1)
+        B, C = Species("B"), Species("C")
+        R = Species("R")
+        AB = Complex([A, B])
+        X, Y = Species("X"), Species("Y")
+
+        rxns = [
+            Reaction.from_massaction([A], [B], k_forward=1),  # B becomes reachable
+            Reaction.from_massaction([A, B], [AB], k_forward=1),  # AB becomes reachable
+            Reaction.from_massaction([C], [X], k_forward=1, k_reverse=1),  # neither side is reachable
+            Reaction.from_massaction([A, R], [Y], k_forward=1),  # R is never produced
+            Reaction([], [Y], propensity_type=ProportionalHillPositive(k=1., s1=A, K=10, d=R, n=2))  # rate is proportional to R
+        ]
+        crn = ChemicalReactionNetwork(species=[A, B, C, R, AB, X, Y], reactions=rxns)
+        pruned = crn.prune_unreachable()
+
+        self.assertTrue(pruned is crn)
+        self.assertEqual(set(crn.species), {A, B, AB})
+        self.assertEqual(crn.reactions, rxns[:2])
+
+        # initial conditions can be overwritten, reversible reactions can fire backwards
+        crn = ChemicalReactionNetwork(species=[A, B, C, R, AB, X, Y], reactions=rxns)
+        crn.prune_unreachable(initial_condition_dict={"X": 1, A: 0})
+        self.assertEqual(set(crn.species), {X, C})
+        self.assertEqual(crn.reactions, [rxns[2]])
+
+    def test_first_order_sinks(self):
+        A, B = Species("A"), Species("B")
+        rxn = Reaction.from_massaction([A], [B], k_forward=1)
+        crn = ChemicalReactionNetwork(species=[A, B], reactions=[rxn], first_order_sinks={A: .1})
+        crn.add_first_order_sinks([(A, .2), (B, .3)])
+
+        # rates of the same species are summed in the sink vector
+        self.assertEqual(crn.first_order_sinks[A], [.1, .2])
+        self.assertEqual([round(k, 10) for k in crn.first_order_sink_vector()], [.3, .3])
+
+        # sinks break conservation laws
+        self.assertEqual(crn.get_conservation_laws(), [])
+
+        # sinks are expanded into one reaction per rate in SBML
+        document, model = crn.generate_sbml_model()
+        self.assertEqual(model.getNumReactions(), 4)
+
+    def test_add_reactions_bulk(self):
+        rx2 = Reaction.from_massaction(inputs=[self.s2, self.s3], outputs=[self.s4], k_forward=1)
+        rx3 = Reaction.from_massaction(inputs=[self.s4], outputs=[self.s1, self.s3], k_forward=1)
+        self.crn.add_reactions_bulk([rx2, rx3])
+
+        # new species are added once, in the order they first appear
+        self.assertEqual(self.crn.species, [self.s1, self.s2, self.s3, self.s4])
+        self.assertEqual(self.crn.reactions, [self.rx1, rx2, rx3])
+        self.assertIsNot(self.crn.reactions[1], rx2)
+
+        self.crn.add_reactions_bulk(rx2, copy_reactions=False)
+        self.assertIs(self.crn.reactions[-1], rx2)
+        self.assertEqual(len(self.crn.species), 4)
+
+        # component output is still type checked
+        with self.assertRaisesRegex(ValueError, 'A non-reaction object was used as a reaction!'):
+            self.crn.add_reactions_bulk([rx3, self.s1])
+
+    def test_add_reactions_dedup(self):
+        rx1_copy = Reaction.from_massaction(inputs=[self.s1], outputs=[self.s2], k_forward=0.1)
+        rx1_fast = Reaction.from_massaction(inputs=[self.s1], outputs=[self.s2], k_forward=0.2)
+        self.assertEqual(hash(rx1_copy), hash(self.rx1))
+        self.assertNotEqual(rx1_fast.canonical_key(), self.rx1.canonical_key())
+        self.assertEqual(rx1_fast.canonical_key(include_rates=False), self.rx1.canonical_key(include_rates=False))
+
+        with self.assertRaisesRegex(ValueError, 'dedup must be'):
+            self.crn.add_reactions(rx1_copy, dedup='remove')
+
+        self.crn.add_reactions([rx1_copy, rx1_fast], dedup='drop')
+        self.assertEqual(len(self.crn.reactions), 2)
+
+        with self.assertWarnsRegex(Warning, 'Duplicates have NOT been removed'):
+            self.crn.add_reactions(rx1_copy, dedup='warn')
+        self.assertEqual(len(self.crn.reactions), 3)
+
+        crn = ChemicalReactionNetwork(species=[], reactions=[self.rx1])
+        rx1_reversible = Reaction.from_massaction(inputs=[self.s1], outputs=[self.s2], k_forward=0.2, k_reverse=0.3)
+        crn.add_reactions([rx1_fast, rx1_reversible], dedup='merge_rates')
+        self.assertEqual(len(crn.reactions), 1)
+        self.assertAlmostEqual(crn.reactions[0].propensity_type.k_forward, 0.5)
+        self.assertAlmostEqual(crn.reactions[0].propensity_type.k_reverse, 0.3)
+
+        # the index of exact keys is updated after merging
+        crn.add_reactions(self.rx1, dedup='drop')
+        self.assertEqual(len(crn.reactions), 2)
+
+    def test_incidence_index(self):
+        C = Complex([self.s1, self.s3])
+        rx2 = Reaction.from_massaction(inputs=[self.s1, self.s3], outputs=[C], k_forward=1, k_reverse=1)
+        rx3 = Reaction(inputs=[], outputs=[self.s4], propensity_type=HillPositive(k=1, s1=C, K=1, n=2))
+        crn = ChemicalReactionNetwork(species=[self.s1, self.s2, self.s3, C], reactions=[self.rx1, rx2])
+
+        self.assertEqual(crn.get_reactions_consuming(self.s1, return_indices=True), [0, 1])
+        self.assertEqual(crn.get_reactions_producing(self.s1), [rx2])
+        # reversible reactions consume and produce both sides
+        self.assertEqual(crn.get_reactions_consuming(C), [rx2])
+        self.assertEqual(crn.get_all_species_containing(self.s3), [self.s3, C])
+
+        # the index is updated when species and reactions are added
+        crn.add_reactions(rx3)
+        self.assertEqual(crn.get_reactions_modified_by(C, return_indices=True), [2])
+        self.assertEqual(crn.get_reactions_involving(C, return_indices=True), [1, 2])
+        self.assertEqual(crn.get_reactions_producing(self.s4), [rx3])
+        crn.add_species(Complex([C, self.s4]))
+        self.assertEqual(len(crn.get_all_species_containing(self.s3)), 3)
+
+        # and rebuilt if the lists are replaced
+        crn.reactions = crn.reactions[1:]
+        self.assertEqual(crn.get_reactions_consuming(self.s1, return_indices=True), [0])
+        self.assertEqual(crn.get_reactions_involving(self.s2), [])
+
+    def test_merge(self):
+        A, B, C = Species("A"), Species("B"), Species("C")
+        rx_ab = Reaction.from_massaction([A], [B], k_forward=1)
+        rx_bc = Reaction.from_massaction([B], [C], k_forward=1)
+        crn1 = ChemicalReactionNetwork(species=[A, B], reactions=[rx_ab], first_order_sinks={B: .1})
+        crn2 = ChemicalReactionNetwork(species=[C, B, A], reactions=[rx_bc, rx_ab], first_order_sinks={B: .1, C: .2})
+        crn2.species[1].initial_concentration = 2
+
+        merged, index_maps = ChemicalReactionNetwork.merge(crn1, crn2, conflict_policy='max')
+        self.assertEqual(merged.species, [A, B, C])
+        self.assertEqual(merged.reactions, [rx_ab, rx_bc])
+        self.assertEqual(index_maps, [{"species": [0, 1], "reactions": [0]},
+                                      {"species": [2, 1, 0], "reactions": [1, 0]}])
+        self.assertEqual(merged.species[1].initial_concentration, 2)
+        self.assertEqual(merged.first_order_sinks, {B: [.1], C: [.2]})
+        # the sources are not modified
+        self.assertEqual(crn1.species[1].initial_concentration, 0)
+
+        merged, _ = ChemicalReactionNetwork.merge(crn1, crn2, conflict_policy='first', dedup='merge_rates')
+        self.assertEqual(merged.species[1].initial_concentration, 0)
+        self.assertEqual(merged.reactions[0].propensity_type.k_forward, 2)
+        self.assertEqual(merged.first_order_sinks[B], [.1, .1])
+
+        with self.assertRaisesRegex(ValueError, 'conflicting initial concentrations'):
+            ChemicalReactionNetwork.merge(crn1, crn2)
+
+    def test_subnetwork(self):
+        A, B, C, D, E = [Species(n) for n in "ABCDE"]
+        rxns = [Reaction.from_massaction([A], [B], k_forward=1),
+                Reaction.from_massaction([B], [C], k_forward=1),
+                Reaction.from_massaction([C], [D], k_forward=1),
+                Reaction(inputs=[], outputs=[E], propensity_type=HillPositive(k=1, s1=D, K=1, n=2))]
+        crn = ChemicalReactionNetwork(species=[A, B, C, D, E], reactions=rxns, first_order_sinks={B: 1, D: 1})
+
+        sub_crn, index_map = crn.subnetwork(B, hops=1, direction='forward')
+        self.assertEqual(sub_crn.species, [B, C])
+        self.assertEqual(sub_crn.reactions, [rxns[1]])
+        self.assertEqual(index_map, {"species": [1, 2], "reactions": [1]})
+        self.assertEqual(list(sub_crn.first_order_sinks), [B])
+
+        sub_crn, index_map = crn.subnetwork([B], hops=2, direction='both')
+        self.assertEqual(index_map, {"species": [0, 1, 2, 3], "reactions": [0, 1, 2]})
+
+        # modifiers are followed forward, and propensity species backward
+        sub_crn, index_map = crn.subnetwork(C, hops=None, direction='forward')
+        self.assertEqual(index_map["reactions"], [2, 3])
+        sub_crn, index_map = crn.subnetwork(E, hops=2, direction='backward')
+        self.assertEqual(index_map, {"species": [2, 3, 4], "reactions": [2, 3]})
+
+        self.assertEqual(crn.subnetwork(A, hops=0)[1], {"species": [0], "reactions": []})
+        with self.assertRaisesRegex(ValueError, 'not part of the CRN'):
+            crn.subnetwork(Species("F"))
+
+    def test_parameter_table(self):
+        kb = ParameterEntry("kb", 2, parameter_key=ParameterKey(mechanism="binding", part_id="P", name="kb"))
+        rx2 = Reaction.from_massaction([self.s2], [self.s3], k_forward=kb, k_reverse=.5)
+        rx3 = Reaction.from_massaction([self.s3], [self.s4], k_forward=kb)
+        crn = ChemicalReactionNetwork(species=[], reactions=[self.rx1, rx2, rx3], first_order_sinks={self.s4: kb})
+
+        # the ParameterEntry is shared by both reactions and the sink
+        table = crn.get_parameter_table()
+        self.assertEqual(table.names, ["k_forward_r0", "kb_P_binding", "k_reverse_r1"])
+        self.assertEqual(crn.parameter_vector(), [.1, 2, .5])
+        self.assertEqual(table.reaction_slots[2], {"k_forward": 1})
+        self.assertEqual(table.sink_slots[self.s4], [1])
+
+        crn.set_parameters({("binding", "P", "kb"): 3, "k_forward_r0": .2})
+        self.assertEqual(crn.parameter_vector(), [.2, 3, .5])
+        self.assertEqual(crn.reactions[0].propensity_type.k_forward, .2)
+        self.assertEqual(crn.reactions[2].propensity_type.k_forward, 3)
+        self.assertEqual(crn.first_order_sink_vector()[crn.species.index(self.s4)], 3)
+        crn.set_parameters([.3, 3, .6])
+        self.assertEqual(crn.reactions[1].propensity_type.k_reverse, .6)
+
+        with self.assertRaisesRegex(ValueError, 'Expected 3 parameter values'):
+            crn.set_parameters([1, 2])
+        with self.assertRaisesRegex(ValueError, 'not part of the parameter table'):
+            crn.set_parameters({"ku": 1})
+
+        # SBML export reads the global parameters from the table
+        document, model = crn.generate_sbml_model()
+        self.assertEqual(model.getParameter("kb_P_binding").getValue(), 3)
+
+        # the table is rebuilt when reactions are added
+        crn.add_reactions(Reaction.from_massaction([self.s4], [], k_forward=1))
+        self.assertEqual(crn.parameter_vector(), [.3, 3, .6, 1])
+
+    def test_set_parameters_shared_structure(self):
+        kb = ParameterEntry("kb", 2, parameter_key=ParameterKey(mechanism="binding", part_id="P", name="kb"))
+        rx2 = Reaction.from_massaction([self.s2], [self.s3], k_forward=kb)
+        crn = ChemicalReactionNetwork(species=[], reactions=[self.rx1, rx2], first_order_sinks={self.s3: kb})
+        new_crn = crn.replace_species(self.s1, self.s4, share_structure=True)
+        self.assertIs(new_crn.reactions[1], crn.reactions[1])
+
+        new_crn.set_parameters([5., 7.])
+        self.assertEqual(new_crn.parameter_vector(), [5., 7.])
+        self.assertEqual(new_crn.reactions[1].propensity_type.k_forward, 7.)
+        self.assertEqual(new_crn.first_order_sink_vector()[new_crn.species.index(self.s3)], 7.)
+        # the source CRN keeps its values
+        self.assertEqual(crn.parameter_vector(), [.1, 2.])
+        self.assertEqual(crn.reactions[1].propensity_type.k_forward, 2.)
+        self.assertEqual(kb.value, 2)
+        self.assertEqual(crn.first_order_sink_vector()[crn.species.index(self.s3)], 2.)
+        # the table stays valid for the copied reactions
+        self.assertIs(new_crn.get_parameter_table().reactions[1], new_crn.reactions[1])
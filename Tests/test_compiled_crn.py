@@ -0,0 +1,167 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+from unittest import TestCase
+from biocrnpyler import ChemicalReactionNetwork, Species, Reaction, Complex, HillPositive, GeneralPropensity, ParameterEntry
+from biocrnpyler import CompiledCRN, ConservationLawReduction, simulate_deterministic, select_method, spectral_radius
+import numpy as np
+import scipy.sparse
+
+
+class TestCompiledCRN(TestCase):
+
+    def setUp(self) -> None:
+        """this method gets executed before every test"""
+        self.A = Species("A", initial_concentration=2)
+        self.B = Species("B", initial_concentration=1)
+        self.C = Complex([self.A, self.B])
+        self.P = Species("P")
+        self.rxn1 = Reaction.from_massaction([self.A, self.B], [self.C], k_forward=2, k_reverse=.5)
+        hill = HillPositive(k=3, s1=self.C, K=1.5, n=2)
+        self.rxn2 = Reaction([], [self.P], propensity_type=hill)
+        self.crn = ChemicalReactionNetwork(species=[self.A, self.B, self.C, self.P], reactions=[self.rxn1, self.rxn2])
+        self.compiled = CompiledCRN(self.crn)
+
+    def test_propensities(self):
+        x = np.array([2., 3., 4., 5.])
+        v = self.compiled.propensities(x)
+        # forward, reverse and hill channels
+        self.assertEqual(self.compiled.channels, [(0, False), (0, True), (1, False)])
+        np.testing.assert_allclose(v, [2*2*3, .5*4, 3*(4/1.5)**2/(1+(4/1.5)**2)])
+
+        # stochastic propensities use falling factorials
+        crn = ChemicalReactionNetwork([self.A, self.C], [Reaction.from_massaction([self.A, self.A], [self.C], k_forward=1)])
+        self.assertEqual(CompiledCRN(crn).propensities(np.array([3., 0.]), stochastic=True)[0], 6)
+
+        # evaluation is vectorized over leading dimensions
+        X = np.stack([x, 2*x])
+        np.testing.assert_allclose(self.compiled.species_rates(X)[1], self.compiled.species_rates(2*x))
+
+    def test_conservation_law_reduction(self):
+        x0 = self.compiled.initial_state()
+        reduction = ConservationLawReduction(self.compiled, x0)
+        # A and B are eliminated (A + C and B + C are conserved)
+        self.assertEqual(reduction.n_reduced, 2)
+        y = reduction.reduce(x0)
+        np.testing.assert_allclose(reduction.reconstruct(y), x0)
+        np.testing.assert_allclose(reduction.rhs(0, y), self.compiled.rhs(0, x0)[reduction.independent])
+
+    def test_simulate_deterministic(self):
+        timepoints = np.linspace(0, 5, 20)
+        reduced = self.crn.simulate_deterministic(timepoints, return_dataframe=False, rtol=1e-8, atol=1e-10)
+        full = self.crn.simulate_deterministic(timepoints, return_dataframe=False, reduce_conservation_laws=False, rtol=1e-8, atol=1e-10)
+
+        for s in self.crn.species:
+            np.testing.assert_allclose(reduced[repr(s)], full[repr(s)], rtol=1e-5, atol=1e-7)
+        # A + C is conserved along the trajectory
+        np.testing.assert_allclose(reduced[repr(self.A)] + reduced[repr(self.C)], 2)
+
+        # initial conditions can be overwritten by repr(species)
+        result = self.crn.simulate_deterministic(timepoints, initial_condition_dict={"A": 0}, return_dataframe=False)
+        self.assertEqual(result[repr(self.C)][-1], 0)
+
+    def test_first_order_sinks(self):
+        # aggregated sinks give the same dynamics as the expanded reactions
+        crn = ChemicalReactionNetwork(species=self.crn.species, reactions=self.crn.reactions,
+                                      first_order_sinks={self.C: .3, self.P: .2})
+        expanded = ChemicalReactionNetwork(species=self.crn.species, reactions=self.crn.reactions + crn._first_order_sink_reactions())
+        compiled, compiled_expanded = CompiledCRN(crn), CompiledCRN(expanded)
+
+        x = np.array([2., 3., 4., 5.])
+        np.testing.assert_allclose(compiled.species_rates(x), compiled_expanded.species_rates(x))
+        # sinks are channels of the full stoichiometric matrix
+        self.assertEqual(compiled.n_channels, compiled_expanded.n_channels)
+        np.testing.assert_allclose(compiled.stoichiometric_matrix.dot(compiled.propensities(x)), compiled.species_rates(x))
+
+    def test_set_parameters(self):
+        x = np.array([2., 3., 4., 5.])
+        # slots: k_forward, k_reverse, then k, K, n of the Hill propensity
+        self.assertEqual(self.compiled.parameter_table.names, ["k_forward_r0", "k_reverse_r0", "k_r1", "K_r1", "n_r1"])
+        self.compiled.set_parameters({"k_forward_r0": 4, 4: 1})
+        v = self.compiled.propensities(x)
+        np.testing.assert_allclose(v, [4*2*3, .5*4, 3*(4/1.5)/(1+(4/1.5))])
+        # the CRN is unchanged
+        self.assertEqual(self.crn.reactions[0].propensity_type.k_forward, 2)
+
+    def test_jacobian(self):
+        self.crn.add_first_order_sinks({self.P: .3})
+        compiled = CompiledCRN(self.crn)
+        X = np.array([[2., 3., 4., 5.], [.5, 1., 2., .1]])
+        for stochastic in [False, True]:
+            h = 1e-6
+            numerical = np.stack([(compiled.propensities(X + h*e, stochastic) - compiled.propensities(X - h*e, stochastic)) / (2*h)
+                                  for e in np.eye(4)], axis=-1)
+            np.testing.assert_allclose(compiled.propensity_jacobian(X, stochastic), numerical, atol=1e-6)
+        np.testing.assert_allclose(compiled.jacobian(X[0]), compiled.stoichiometric_matrix.toarray().dot(numerical[0]), atol=1e-6)
+
+        # the reduced Jacobian is the derivative of the reduced right hand side
+        reduction = ConservationLawReduction(compiled, X[1])
+        y = reduction.reduce(X[1])
+        numerical = np.stack([(reduction.rhs(0, y + h*e) - reduction.rhs(0, y - h*e)) / (2*h) for e in np.eye(2)], axis=-1)
+        np.testing.assert_allclose(reduction.jacobian(y), numerical, atol=1e-6)
+
+        # the sparse Jacobians are assembled without the dense matrices
+        self.assertTrue(scipy.sparse.issparse(reduction.jacobian(y, sparse=True)))
+        np.testing.assert_allclose(reduction.jacobian(y, sparse=True).toarray(), reduction.jacobian(y))
+        formula = GeneralPropensity("k*P^2/(1 + A)", propensity_species=[self.P, self.A], propensity_parameters=[ParameterEntry("k", 2.)])
+        self.crn.add_reactions([Reaction([self.P], [self.A], propensity_type=formula)])
+        compiled = CompiledCRN(self.crn)
+        for stochastic in [False, True]:
+            J = compiled.sparse_propensity_jacobian(X[0], stochastic)
+            self.assertEqual(J.nnz, compiled.propensity_dependencies.nnz)
+            np.testing.assert_allclose(J.toarray(), compiled.propensity_jacobian(X[0], stochastic))
+        np.testing.assert_allclose(compiled.sparse_jacobian(X[1]).toarray(), compiled.jacobian(X[1]))
+        with self.assertRaisesRegex(ValueError, "single state"):
+            compiled.sparse_jacobian(X)
+
+    def test_select_method(self):
+        self.assertAlmostEqual(spectral_radius(np.diag([-1., -3., 2.])), 3)
+        chain = scipy.sparse.diags([-np.arange(1., 201.), np.full(199, .1)], [0, -1])
+        self.assertAlmostEqual(spectral_radius(chain), 200, delta=.2)
+
+        timepoints = np.linspace(0, 5, 20)
+        with self.assertLogs("biocrnpyler.simulation_deterministic", level="INFO") as logs:
+            self.assertEqual(select_method(self.crn, timepoints), ("RK45", False))
+        self.assertIn("using RK45", logs.output[0])
+
+        # fast binding and unbinding make the model stiff
+        self.compiled.set_parameters({"k_forward_r0": 1e5, "k_reverse_r0": 1e4})
+        self.assertEqual(select_method(self.compiled, timepoints), ("BDF", False))
+        auto = simulate_deterministic(self.compiled, timepoints, return_dataframe=False, rtol=1e-8, atol=1e-10)
+        lsoda = simulate_deterministic(self.compiled, timepoints, method="LSODA", return_dataframe=False, rtol=1e-8, atol=1e-10)
+        for s in self.crn.species:
+            np.testing.assert_allclose(auto[repr(s)], lsoda[repr(s)], rtol=1e-5, atol=1e-7)
+
+        # large stiff models use sparse linear algebra
+        species = [Species(f"A{i}", initial_concentration=1) for i in range(120)]
+        reactions = [Reaction.from_massaction([a], [b], k_forward=10.**(i % 5)) for i, (a, b) in enumerate(zip(species, species[1:]))]
+        crn = ChemicalReactionNetwork(species=species, reactions=reactions)
+        with self.assertLogs("biocrnpyler.simulation_deterministic", level="INFO") as logs:
+            result = simulate_deterministic(crn, timepoints, return_dataframe=False)
+        self.assertIn("using BDF with sparse linear algebra", logs.output[0])
+        self.assertAlmostEqual(sum(result[repr(s)][-1] for s in species), 120)
+
+    def test_simulate_deterministic_batch(self):
+        self.crn.add_first_order_sinks({self.P: .3})
+        compiled = CompiledCRN(self.crn)
+        parameters = compiled.parameter_matrix([{"k_forward_r0": k, "k_sink_P_0": k/10} for k in [.5, 1., 4.]])
+        self.assertEqual(parameters.shape, (3, 6))
+        np.testing.assert_allclose(parameters[:, 0], [.5, 1., 4.])
+
+        # propensities broadcast against parameter matrices
+        x = np.array([2., 3., 4., 5.])
+        v = compiled.propensities(x, parameters=parameters)
+        np.testing.assert_allclose(v[1], CompiledCRN(self.crn).propensities(x) * [.5, 1, 1, 1/3])
+
+        timepoints = np.linspace(0, 5, 6)
+        states = self.crn.simulate_deterministic_batch(timepoints, parameters, rtol=1e-8, atol=1e-10)
+        self.assertEqual(states.shape, (3, 6, 4))
+        for p in range(3):
+            compiled.set_parameters(parameters[p])
+            single = simulate_deterministic(compiled, timepoints, return_dataframe=False, rtol=1e-8, atol=1e-10)
+            for i, s in enumerate(compiled.species):
+                np.testing.assert_allclose(states[p, :, i], single[repr(s)], rtol=1e-5, atol=1e-7)
+
+        # sparse Jacobian blocks
+        sparse_states = self.crn.simulate_deterministic_batch(timepoints, parameters, sparse_threshold=0, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(sparse_states, states, rtol=1e-5, atol=1e-7)
@@ -107,6 +107,58 @@ class TestGlobalMechanism(TestCase):
 
 
 
+    def test_filter_species_cache(self):
+        s1 = Species("s1", material_type = "m1", attributes = ["a1"])
+        s2 = Species("s2", material_type = "m2", attributes = ["a2"])
+        c1 = Complex([s1, s2], name = "c1")
+
+        mech = GlobalMechanism(name = self.mech_name, mechanism_type = "dummy",
+            default_on = False, filter_dict = {"m1":True}, recursive_species_filtering = True)
+        # filter_species gives the same decisions as apply_filter
+        self.assertEqual(mech.filter_species([s1, s2, c1]), [s1, c1])
+        self.assertEqual(mech.filter_species([s1, s2, c1]), [s for s in [s1, s2, c1] if mech.apply_filter(s)])
+
+        # decisions are cached per species
+        self.assertEqual(set(mech._filter_decisions), {s1, s2, c1})
+
+        # changing the filter_dict resets the cached decisions
+        mech.filter_dict["a2"] = False
+        mech.default_on = True
+        self.assertEqual(mech.filter_species([s1, s2]), [s1])
+        self.assertEqual(set(mech._filter_decisions), {s1, s2})
+
+        # conflicting filters use the default value
+        with self.assertWarnsRegex(Warning, 'conflict with global mechanism filter'):
+            self.assertTrue(mech.apply_filter(c1))
+
+        # every modification of the filter_dict, or a new filter_dict, resets the cached decisions
+        mech.filter_dict.pop("a2")
+        self.assertEqual(mech.filter_species([s1, s2, c1]), [s1, s2, c1])
+        mech.filter_dict.update({"m2": False})
+        self.assertEqual(mech.filter_species([s1, s2]), [s1])
+        mech.filter_dict = {"s1": False}
+        self.assertEqual(mech.filter_species([s1, s2]), [s2])
+        self.assertEqual(mech.filter_dict, {"s1": False})
+
+        # unchanged settings keep the cached decisions
+        decisions = mech._filter_decisions
+        self.assertFalse(mech.apply_filter(s1))
+        self.assertIs(mech._filter_decisions, decisions)
+
+    def test_apply_global(self):
+        M = Mixture(parameters = {"kdeg":1, "kb":1, "ku":1})
+        protease = Species("P")
+        tagged_protein = Species("X", attributes = ["degtagged"])
+        untagged_protein = Species("Y")
+        dtd = Deg_Tagged_Degredation(protease)
+
+        species, reactions, sinks = dtd.apply_global([tagged_protein, untagged_protein], M)
+        self.assertEqual(species, dtd.update_species_global([tagged_protein, untagged_protein], M))
+        #reactions are compared as strings because parameters are new objects on every call
+        self.assertEqual(str(reactions), str(dtd.update_reactions_global([tagged_protein, untagged_protein], M)))
+        self.assertEqual(str(reactions), str(dtd.update_reactions(tagged_protein, M)))
+        self.assertEqual(sinks, [])
+
     def test_rna_degredation_mm(self):
 
         M = Mixture(parameters = {"kdeg":1, "kb":1, "ku":1})
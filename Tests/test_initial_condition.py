@@ -5,7 +5,61 @@ from unittest import TestCase
 from biocrnpyler import Species, Mixture, Component, ParameterDatabase
 
 
-class TestSpecies(TestCase):
-	#TODO - wait for revamp of Species because that will likely change this
-	pass
+class SpeciesComponent(Component):
+    """Minimal component whose species is Species(name)."""
+    def __init__(self, name, **keywords):
+        Component.__init__(self, name=name, **keywords)
+        self.species = Species(name)
 
+    def get_species(self):
+        return self.species
+
+
+class TestInitialCondition(TestCase):
+
+    def check_parity(self, mixture, component, species):
+        per_species = []
+        for s in species:
+            mixture.set_initial_condition(s, component)
+            per_species.append(s.initial_concentration)
+            s.initial_concentration = -1
+
+        mixture.set_initial_conditions(species, component)
+        self.assertEqual([s.initial_concentration for s in species], per_species)
+        return per_species
+
+    def test_set_initial_conditions_parity(self):
+        a, b, c, d, e, f = [Species(n) for n in "abcdef"]
+        species = [a, b, c, d, e, f]
+
+        # every level of the hierarchy, each used by a different species
+        component = SpeciesComponent("a", initial_condition_dictionary={("m", "b"): 2, "c": 3})
+        mixture = Mixture(name="m", components=[component],
+                          initial_condition_dictionary={("m", "d"): 4, "e": 5},
+                          parameters={(None, "m", "f"): 6, "g": 7})
+        component = mixture.get_component(name="a")
+        values = self.check_parity(mixture, component, species + [Species("g"), Species("h")])
+        self.assertEqual(values, [0, 2, 3, 4, 5, 6, 7, 0])
+
+        # the component species falls back to the component name in the mixture
+        for ics, parameters, expected in [({("m", "a"): 1, "a": 2}, {}, 1),
+                                          ({"a": 2}, {(None, "m", "a"): 3}, 2),
+                                          ({}, {(None, "m", "a"): 3, "a": 4}, 3),
+                                          ({}, {"a": 4}, 4)]:
+            component = SpeciesComponent("a")
+            mixture = Mixture(name="m", components=[component], initial_condition_dictionary=ics, parameters=parameters)
+            component = mixture.get_component(name="a")
+            self.assertEqual(self.check_parity(mixture, component, [component.get_species(), b])[0], expected)
+
+        # component values have precedence over the mixture
+        component = SpeciesComponent("a", initial_conc=8, initial_condition_dictionary={"b": 9})
+        mixture = Mixture(name="m", components=[component], initial_condition_dictionary={"a": 1, "b": 2})
+        component = mixture.get_component(name="a")
+        self.assertEqual(self.check_parity(mixture, component, [component.get_species(), b, c]), [8, 9, 0])
+
+        # without a component
+        mixture = Mixture(name="m", initial_condition_dictionary={"a": 1}, parameters={"b": 2})
+        self.assertEqual(self.check_parity(mixture, None, [a, b, c]), [1, 2, 0])
+
+        with self.assertRaisesRegex(ValueError, 'is not a Species'):
+            mixture.set_initial_conditions([a, "b"])
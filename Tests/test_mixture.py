@@ -2,7 +2,7 @@
 #  See LICENSE file in the project root directory for details.
 
 from unittest import TestCase
-from biocrnpyler import Mixture, Species, DNA, Reaction, ChemicalReactionNetwork, Component, SimpleTranscription, SimpleTranslation, GlobalMechanism
+from biocrnpyler import Mixture, Species, DNA, Reaction, ChemicalReactionNetwork, Component, SimpleTranscription, SimpleTranslation, GlobalMechanism, Complex
 
 
 class TestMixture(TestCase):
@@ -221,6 +221,47 @@ class TestMixture(TestCase):
         # test that the mixture has the same reactions as the manually build CRN object
         self.assertEqual(CRN.reactions, crn_from_mixture.reactions)
 
+    def test_compile_crn_prune_unreachable(self):
+        a = Species(name='a')
+        b = Species(name='b')
+        repressor = Species(name='r')
+        ab = Complex([a, repressor])
+
+        component = Component("comp")
+        component.update_species = lambda: [a, b, repressor, ab]
+        component.update_reactions = lambda: [Reaction.from_massaction(inputs=[a], outputs=[b], k_forward=0.1),
+                                              Reaction.from_massaction(inputs=[a, repressor], outputs=[ab], k_forward=0.1)]
+
+        # a starts with a nonzero concentration, the repressor is absent
+        mixture = Mixture(components=[component], initial_condition_dictionary={"a": 1})
+
+        crn = mixture.compile_crn()
+        self.assertEqual(len(crn.reactions), 2)
+
+        # the binding reaction can never fire
+        crn = mixture.compile_crn(prune_unreachable=True)
+        self.assertEqual(set(crn.species), {a, b})
+        self.assertEqual(crn.reactions, [Reaction.from_massaction(inputs=[a], outputs=[b], k_forward=0.1)])
+
+
+    def test_aggregate_dilution(self):
+        from biocrnpyler import SimpleTxTlDilutionMixture, DNAassembly
+        G = DNAassembly("G", promoter="P", rbs="R")
+        parameters = {"ktx":1, "ktl":1, "kdil":.1, "ku":1, "kb":1, "cooperativity":1}
+        M = SimpleTxTlDilutionMixture(components=[G], parameters=parameters)
+        M_aggregate = SimpleTxTlDilutionMixture(components=[G], parameters=parameters, aggregate_dilution=True)
+        crn = M.compile_crn()
+        crn_aggregate = M_aggregate.compile_crn()
+
+        # every diluted species becomes a sink instead of a reaction
+        n_sink_rates = sum(len(k) for k in crn_aggregate.first_order_sinks.values())
+        self.assertTrue(n_sink_rates > 0)
+        self.assertEqual(len(crn_aggregate.reactions) + n_sink_rates, len(crn.reactions))
+        # mRNA is diluted and degraded
+        self.assertEqual(len(crn_aggregate.first_order_sinks[Species("G", material_type="rna")]), 2)
+
+        # the SBML models have the same number of reactions
+        self.assertEqual(crn.generate_sbml_model()[1].getNumReactions(), crn_aggregate.generate_sbml_model()[1].getNumReactions())
 
     def test_compoents_in_multiple_mixtures(self):
         C = Component("comp")
@@ -0,0 +1,130 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+import libsbml
+import numpy as np
+import pytest
+
+from biocrnpyler import (ChemicalReactionNetwork, CompiledCRN,
+                         CompiledFormula, GeneralPropensity, HillNegative,
+                         HillPositive, MassAction, ParameterEntry,
+                         ProportionalHillPositive, RateLaw, Reaction, Species)
+from biocrnpyler.rate_law import rename_ast_names
+
+
+A, B, C = Species("A"), Species("B"), Species("C")
+
+
+def _crn():
+    reactions = [
+        Reaction.from_massaction([A, A, B], [C], k_forward=2.0, k_reverse=0.5),
+        Reaction([], [A], propensity_type=HillPositive(k=3., s1=C, K=2., n=2.)),
+        Reaction([B], [], propensity_type=HillNegative(k=1.5, s1=A, K=4., n=1.)),
+        Reaction([C], [A], propensity_type=ProportionalHillPositive(k=1., s1=B, K=1., n=3., d=C)),
+    ]
+    return ChemicalReactionNetwork(species=[A, B, C], reactions=reactions)
+
+
+@pytest.mark.parametrize("stochastic", [False, True])
+def test_rate_law_numpy_matches_compiled_crn(stochastic):
+    crn = _crn()
+    compiled = CompiledCRN(crn)
+    x = np.array([[3., 2., 5.], [1., 4., 0.5], [7., 1., 2.]])
+    expected = compiled.propensities(x, stochastic=stochastic)
+
+    for channel, (reaction_ind, reverse) in enumerate(compiled.channels):
+        r = crn.reactions[reaction_ind]
+        rate_law = r.propensity_type.rate_law(r, stochastic=stochastic, reverse=reverse)
+        f = rate_law.numpy_evaluator(compiled.species_index, compiled.parameter_table.reaction_slots[reaction_ind])
+        assert np.allclose(f(x, compiled.parameters), expected[:, channel])
+        # a single state gives a scalar
+        assert np.isclose(f(x[0], compiled.parameters), expected[0, channel])
+
+
+def test_rate_law_clamps_hill_regulator():
+    # an integrator can drive a regulator slightly negative: (s1/K)^n must stay finite, like in CompiledCRN
+    r = Reaction([], [A], propensity_type=HillPositive(k=3., s1=C, K=2., n=2.5))
+    compiled = CompiledCRN(ChemicalReactionNetwork(species=[A, B, C], reactions=[r]))
+    x = np.array([[1., 1., -1e-9], [1., 1., 2.]])
+    f = r.propensity_type.rate_law(r).numpy_evaluator(compiled.species_index, compiled.parameter_table.reaction_slots[0])
+    values = f(x, compiled.parameters)
+    assert np.all(np.isfinite(values))
+    assert np.allclose(values, compiled.propensities(x)[:, 0])
+    assert values[0] == 0
+
+
+def test_rate_law_pretty_print():
+    r = Reaction.from_massaction([A, A, B], [C], k_forward=1.)
+    assert r.propensity_type.rate_law(r).pretty_print() == "k_forward*A^2*B"
+    assert r.propensity_type.rate_law(r, stochastic=True).pretty_print() == "k_forward*A*(A - 1)*B"
+    assert HillPositive(k=1., s1=A, K=1., n=2.).rate_law().pretty_print() == "k*(A/K)^n/(1 + (A/K)^n)"
+    assert HillNegative(k=1., s1=A, K=1., n=2.).rate_law().pretty_print(["X"], {"k": "k0"}) == "k0/(1 + (X/K)^n)"
+
+
+def test_rate_law_mathml():
+    r = Reaction.from_massaction([A, A, B], [C], k_forward=1.)
+    rate_law = r.propensity_type.rate_law(r, stochastic=True)
+    ast = rate_law.to_mathml(["sA", "sB"], {"k_forward": "kf"})
+    assert libsbml.formulaToL3String(ast) == "kf * (sA * (sA - 1)) * sB"
+
+    # the cached template is cloned, not modified
+    ast = rate_law.to_mathml(["a", "b"], {"k_forward": "k"})
+    assert libsbml.formulaToL3String(ast) == "k * (a * (a - 1)) * b"
+    assert len(RateLaw._mathml_templates) > 0
+
+    # stochastic export of a first order reaction (previously a malformed formula)
+    r = Reaction.from_massaction([A], [B], k_forward=1.)
+    crn = ChemicalReactionNetwork(species=[A, B], reactions=[r])
+    _, model = crn.generate_sbml_model(stochastic_model=True)
+    math = model.getReaction(0).getKineticLaw().getMath()
+    assert libsbml.formulaToL3String(math) == "k_forward * A"
+
+
+def test_rename_ast_names():
+    ast = libsbml.parseL3Formula("k*A/(A + AB)")
+    rename_ast_names(ast, {"A": "species_1", "k": "k_global"})
+    assert libsbml.formulaToL3String(ast) == "k_global * species_1 / (species_1 + AB)"
+
+
+def test_massaction_rate_law_requires_reaction():
+    with pytest.raises(ValueError):
+        MassAction(k_forward=1.).rate_law()
+
+
+def test_compiled_formula():
+    formula = "k*A^2/(K + A) + piecewise(1, B > 2, 0) - ln(exp(B))"
+    compiled = CompiledFormula.compile(formula)
+    assert CompiledFormula.compile(formula) is compiled
+    assert compiled.names == ["k", "A", "K", "B"]
+    x = np.array([1., 2., 3.])
+    assert np.allclose(compiled(2., x, 1., 3.), 2*x**2/(1 + x) + 1 - 3)
+
+    for formula in ["f(A)", "time*A", "A +", "__import__('os')"]:
+        with pytest.raises(ValueError):
+            CompiledFormula(formula)
+    with pytest.raises(ValueError, match="neither a species nor a parameter"):
+        CompiledFormula.compile("k*A").bind({"A": 0}, {})
+
+
+def test_general_propensity_compiled():
+    k1 = ParameterEntry("k1", 2.)
+    reactions = [Reaction([A], [B], propensity_type=GeneralPropensity("k1*A^2/(1 + B)", [A, B], [k1])),
+                 Reaction([B], [C], propensity_type=GeneralPropensity("k1*B^2/(1 + C)", [B, C], [k1])),
+                 Reaction([C], [A], propensity_type=GeneralPropensity("k1*C^2/(1 + A)", [C, A], [ParameterEntry("k1", 3.)]))]
+    crn = ChemicalReactionNetwork(species=[A, B, C], reactions=reactions)
+    compiled = CompiledCRN(crn)
+    assert len(compiled._general_groups) == 3
+
+    x = np.array([[1., 2., 3.], [4., 5., 6.]])
+    expected = np.stack([2*x[:, 0]**2/(1 + x[:, 1]), 2*x[:, 1]**2/(1 + x[:, 2]), 3*x[:, 2]**2/(1 + x[:, 0])], axis=-1)
+    assert np.allclose(compiled.propensities(x), expected)
+
+    same_template = [Reaction([A], [B], propensity_type=GeneralPropensity("k1*A^2/(1 + B)", [A, B], [ParameterEntry("k1", k)]))
+                     for k in (1., 2., 3.)]
+    compiled = CompiledCRN(ChemicalReactionNetwork(species=[A, B], reactions=same_template))
+    # reactions sharing a formula are evaluated as one vectorized group
+    assert len(compiled._general_groups) == 1
+    assert np.allclose(compiled.propensities([2., 1.]), [2., 4., 6.])
+
+    _, model = crn.generate_sbml_model()
+    assert libsbml.formulaToL3String(model.getReaction(0).getKineticLaw().getMath()) == "k1 * A^2 / (1 + B)"
@@ -125,3 +125,16 @@ def test_old_reaction_interface_non_massaction():
     with pytest.deprecated_call():
         Reaction([G], [G, X], propensity_type="proportionalhillnegative",
                  propensity_params={"k": kex, "n": 2.0, "K": float(kb/ku), "s1": A, "d": G})
+
+
+def test_reaction_from_arrays():
+    sp1 = Species(name='test_species_a')
+    sp2 = Species(name='test_species_b')
+    mak = MassAction(k_forward=1)
+    rxn1 = Reaction.from_arrays(inputs=[sp1, sp2], outputs=[sp2], propensity_type=mak, output_coefs=[2])
+    rxn2 = Reaction(inputs=[sp1, sp2], outputs=[sp2, sp2], propensity_type=mak)
+    assert rxn1 == rxn2
+    assert rxn1.outputs[0].stoichiometry == 2
+
+    with pytest.raises(ValueError):
+        Reaction.from_arrays(inputs=[sp1, sp2], outputs=[], propensity_type=mak, input_coefs=[1])
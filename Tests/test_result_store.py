@@ -0,0 +1,78 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+import os
+import tempfile
+from unittest import TestCase
+from biocrnpyler import ChemicalReactionNetwork, Species, Reaction
+from biocrnpyler import CompiledCRN, CLEIntegrator, ResultStore, simulate_ensemble
+import numpy as np
+
+
+class TestResultStore(TestCase):
+
+    def setUp(self) -> None:
+        """this method gets executed before every test"""
+        self.A = Species("A", initial_concentration=50)
+        self.B = Species("B")
+        reactions = [Reaction.from_massaction([self.A], [self.B], k_forward=1., k_reverse=.5)]
+        self.crn = ChemicalReactionNetwork(species=[self.A, self.B], reactions=reactions)
+        self.compiled = CompiledCRN(self.crn)
+        self.timepoints = np.linspace(0, 4, 5)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "ensemble")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_simulate_ensemble(self):
+        store = self.crn.simulate_ensemble(self.path, self.timepoints, 250, chunk_size=100, seed=0)
+        self.assertEqual(store.n_replicates, 250)
+        self.assertEqual(store.n_chunks, 3)
+        self.assertEqual(store.chunk(2).shape, (5, 2, 50))
+        self.assertEqual(store.species, ["A", "B"])
+        self.assertEqual(store.fingerprint, self.compiled.fingerprint)
+        np.testing.assert_array_equal(store.parameters, [1., .5])
+        self.assertEqual(store.metadata["engine"], "tau_leaping")
+
+        A = store.column(self.A)
+        self.assertEqual(A.shape, (5, 250))
+        np.testing.assert_array_equal(A + store.column("B"), 50)
+        np.testing.assert_array_equal(store.column(self.A, replicates=[5, 120, 249]), A[:, [5, 120, 249]])
+        np.testing.assert_allclose(store.mean([self.A])[:, 0], A.mean(axis=1))
+        # the mean approaches the equilibrium A = 50 / 3
+        self.assertAlmostEqual(store.mean()[-1, 0], 50/3, delta=1)
+
+        trajectory = store.to_dataframe(replicate=120, return_dataframe=False)
+        np.testing.assert_array_equal(trajectory["time"], self.timepoints)
+        np.testing.assert_array_equal(trajectory["B"], A[0, 120] - A[:, 120])
+
+        # a reopened store gives the same data, and is read-only
+        reopened = ResultStore(self.path)
+        np.testing.assert_array_equal(reopened.column("A"), A)
+        with self.assertRaisesRegex(ValueError, "read-only"):
+            reopened.new_chunk(10)
+        with self.assertRaisesRegex(ValueError, "already contains"):
+            ResultStore.create(self.path, self.compiled, self.timepoints)
+        with self.assertRaisesRegex(ValueError, "not part of the ResultStore"):
+            store.column("C")
+
+    def test_incremental_chunks(self):
+        store = ResultStore.create(self.path, self.compiled, self.timepoints)
+        with self.assertRaisesRegex(ValueError, "no trajectories"):
+            store.mean()
+        # the CLE writes its snapshots directly into the memory-mapped chunk
+        chunk = store.new_chunk(20)
+        integrator = CLEIntegrator(self.compiled, rng=np.random.default_rng(0))
+        integrator.run(np.tile(self.compiled.initial_state(), (20, 1)), self.timepoints, out=chunk.transpose(0, 2, 1))
+        chunk.flush()
+        store.append(np.zeros((3, 5, 2)))
+        with self.assertRaisesRegex(ValueError, "states must have the shape"):
+            store.append(np.zeros((3, 2, 5)))
+
+        reopened = ResultStore(self.path)
+        self.assertEqual(reopened.n_replicates, 23)
+        np.testing.assert_allclose(reopened.column("A")[0, :20], 50)
+        self.assertAlmostEqual(reopened.column("B")[-1, :20].mean(), 100/3, delta=5)
+        np.testing.assert_array_equal(reopened.column("A")[:, 20:], 0)
+        self.assertEqual([c.shape for c in reopened.iter_chunks([self.B])], [(5, 1, 20), (5, 1, 3)])
@@ -0,0 +1,63 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+from unittest import TestCase
+from biocrnpyler import ChemicalReactionNetwork, Species, Reaction, Complex, HillNegative
+from biocrnpyler import FiniteStateProjection, simulate_fsp
+import numpy as np
+from scipy.stats import poisson
+
+
+class TestFiniteStateProjection(TestCase):
+
+    def setUp(self) -> None:
+        """this method gets executed before every test"""
+        self.A = Species("A")
+        # immigration and death: the distribution is Poisson with mean 10 (1 - exp(-t))
+        self.crn = ChemicalReactionNetwork(species=[self.A],
+                                           reactions=[Reaction.from_massaction([], [self.A], k_forward=10.),
+                                                      Reaction.from_massaction([self.A], [], k_forward=1.)])
+
+    def test_poisson(self):
+        timepoints = [0, 1, 20]
+        solution = self.crn.simulate_fsp(timepoints, bounds={self.A: 50})
+        self.assertEqual(solution.fsp.n_states, 51)
+        np.testing.assert_allclose(solution.mean(self.A), 10*(1 - np.exp(-np.array(timepoints))), atol=1e-6)
+        np.testing.assert_allclose(solution.marginal("A")[-1], poisson.pmf(np.arange(51), 10), atol=1e-8)
+        self.assertLess(solution.error[-1], 1e-10)
+        np.testing.assert_allclose(solution.probabilities.sum(axis=1) + solution.error, 1)
+
+        # a tight projection loses probability into the sink
+        solution = simulate_fsp(self.crn, timepoints, bounds={"A": 10})
+        self.assertGreater(solution.error[-1], .3)
+
+    def test_infeasible_transitions(self):
+        # the degradation of A does not vanish at A = 0: the transitions to A = -1 are infeasible, not truncation errors
+        A, R = Species("A", initial_concentration=5), Species("R")
+        reactions = [Reaction([A], [], propensity_type=HillNegative(k=1., s1=R, K=1., n=1.))]
+        crn = ChemicalReactionNetwork(species=[A, R], reactions=reactions)
+        solution = crn.simulate_fsp([0, 2, 20], bounds={A: 5, R: 0})
+        self.assertEqual(solution.fsp.n_states, 6)
+        np.testing.assert_allclose(solution.error, 0, atol=1e-12)
+        self.assertAlmostEqual(solution.marginal(A)[-1, 0], 1 - poisson.cdf(4, 20), places=6)
+
+    def test_promoter(self):
+        G, R = Species("G", initial_concentration=1), Species("R")
+        GR = Complex([G, R])
+        reactions = [Reaction.from_massaction([], [R], k_forward=5.),
+                     Reaction.from_massaction([R], [], k_forward=.5),
+                     Reaction.from_massaction([G, R], [GR], k_forward=.1, k_reverse=1.)]
+        crn = ChemicalReactionNetwork(species=[G, R, GR], reactions=reactions)
+        solution = crn.simulate_fsp(np.linspace(0, 10, 3), default_bound=60)
+        # the promoter is free or bound
+        np.testing.assert_allclose(solution.marginal(G)[:, :2].sum(axis=1) + solution.error, 1)
+        np.testing.assert_allclose(solution.marginal(G)[:, 1] + solution.marginal(GR)[:, 1], 1, atol=1e-8)
+        self.assertTrue(0 < solution.marginal(GR)[-1, 1] < 1)
+
+    def test_errors(self):
+        with self.assertRaisesRegex(ValueError, "not part of the CRN"):
+            FiniteStateProjection(self.crn, bounds={"B": 3})
+        with self.assertRaisesRegex(ValueError, "initial state exceeds"):
+            FiniteStateProjection(self.crn, bounds={"A": 3}, initial_condition_dict={"A": 4})
+        with self.assertRaisesRegex(ValueError, "max_states"):
+            FiniteStateProjection(self.crn, max_states=10)
@@ -0,0 +1,50 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+from unittest import TestCase
+from biocrnpyler import ChemicalReactionNetwork, Species, Reaction, HillPositive
+from biocrnpyler import CompiledCRN, LinearNoiseApproximation
+import numpy as np
+
+
+class TestLinearNoiseApproximation(TestCase):
+
+    def setUp(self) -> None:
+        """this method gets executed before every test"""
+        self.A = Species("A")
+        self.B = Species("B")
+        # production, degradation and dimerization of A
+        reactions = [Reaction.from_massaction([], [self.A], k_forward=10.),
+                     Reaction.from_massaction([self.A], [], k_forward=1.),
+                     Reaction.from_massaction([self.A, self.A], [self.B], k_forward=.05),
+                     Reaction.from_massaction([self.B], [], k_forward=.5)]
+        self.crn = ChemicalReactionNetwork(species=[self.A, self.B], reactions=reactions)
+        self.timepoints = np.linspace(0, 10, 3)
+
+    def test_linear_network(self):
+        # immigration and death is Poisson: the mean equals the variance
+        crn = ChemicalReactionNetwork(species=[self.A], reactions=self.crn.reactions[:2])
+        for moment_closure in [False, True]:
+            solution = crn.simulate_lna(self.timepoints, moment_closure=moment_closure, rtol=1e-8, atol=1e-10)
+            expected = 10*(1 - np.exp(-self.timepoints))
+            np.testing.assert_allclose(solution.mean[:, 0], expected, rtol=1e-5)
+            np.testing.assert_allclose(solution.variance(self.A), expected, rtol=1e-5)
+
+    def test_against_fsp(self):
+        exact = self.crn.simulate_fsp(self.timepoints, default_bound=40)
+        mean = exact.mean(self.A)
+        variance = exact.probabilities.dot(exact.fsp.states[:, 0]**2) - mean**2
+
+        lna = self.crn.simulate_lna(self.timepoints, rtol=1e-8, atol=1e-10)
+        closure = self.crn.simulate_lna(self.timepoints, moment_closure=True, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(lna.mean[1:, 0], mean[1:], rtol=.01)
+        np.testing.assert_allclose(lna.variance("A")[1:], variance[1:], rtol=.05)
+        # the closure corrects the mean for the fluctuations of the bimolecular reaction
+        self.assertLess(np.abs(closure.mean[-1, 0] - mean[-1]), np.abs(lna.mean[-1, 0] - mean[-1]))
+        np.testing.assert_allclose(lna.covariance[-1], lna.covariance[-1].T)
+
+    def test_moment_closure_requires_mass_action(self):
+        crn = ChemicalReactionNetwork(species=[self.A], reactions=[Reaction([], [self.A], propensity_type=HillPositive(k=1., s1=self.A, K=1., n=2.))])
+        LinearNoiseApproximation(CompiledCRN(crn))
+        with self.assertRaisesRegex(ValueError, "mass action"):
+            LinearNoiseApproximation(CompiledCRN(crn), moment_closure=True)
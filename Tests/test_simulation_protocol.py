@@ -0,0 +1,75 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+from unittest import TestCase
+from biocrnpyler import ChemicalReactionNetwork, Species, Reaction
+from biocrnpyler import CompiledCRN, Protocol, AddSpecies, Dilute, SetParameters, simulate_protocol
+import numpy as np
+
+
+class TestProtocol(TestCase):
+
+    def setUp(self) -> None:
+        """this method gets executed before every test"""
+        self.I = Species("I")
+        self.P = Species("P")
+        # the inducer I drives the production of P
+        reactions = [Reaction.from_massaction([self.I], [self.I, self.P], k_forward=1.),
+                     Reaction.from_massaction([self.P], [], k_forward=1.)]
+        self.crn = ChemicalReactionNetwork(species=[self.I, self.P], reactions=reactions)
+        self.timepoints = np.linspace(0, 8, 17)
+
+    def expected(self, t):
+        """P(t) with inducer 1 added at t = 2, a 1:2 dilution at t = 4 and 4 times faster production from t = 6."""
+        P = np.where(t >= 2, 1 - np.exp(-(t - 2)), 0)
+        P4 = (1 - np.exp(-2)) / 2
+        P = np.where(t >= 4, .5 + (P4 - .5) * np.exp(-(t - 4)), P)
+        P6 = .5 + (P4 - .5) * np.exp(-2)
+        return np.where(t >= 6, 2 + (P6 - 2) * np.exp(-(t - 6)), P)
+
+    def protocol(self):
+        return Protocol().add_species(2, {self.I: 1.}).dilute(4, .5).set_parameters(6, {"k_forward_r0": 4.})
+
+    def test_deterministic(self):
+        compiled = CompiledCRN(self.crn)
+        result = self.crn.simulate_protocol(self.protocol(), self.timepoints, return_dataframe=False, rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(result["P"], self.expected(self.timepoints), atol=1e-7)
+        np.testing.assert_allclose(result["I"], np.where(self.timepoints >= 2, np.where(self.timepoints >= 4, .5, 1), 0))
+
+        # the same events as a list, with a compiled CRN whose parameters are restored afterwards
+        events = [SetParameters(6, {"k_forward_r0": 4.}), AddSpecies(2, {"I": 1.}), Dilute(4, .5)]
+        result = simulate_protocol(compiled, events, self.timepoints, return_dataframe=False, rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(result["P"], self.expected(self.timepoints), atol=1e-7)
+        np.testing.assert_array_equal(compiled.parameters, [1., 1.])
+
+        # events between timepoints
+        result = simulate_protocol(self.crn, [SetParameters(0, {"k_forward_r0": 2.}), AddSpecies(.25, {"I": 1.})], [0, 1],
+                                   return_dataframe=False, method="LSODA", rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(result["P"][-1], 2 * (1 - np.exp(-.75)), rtol=1e-7)
+
+    def test_stochastic(self):
+        protocol = Protocol().add_species(2, {"I": 100}).dilute(4, .5, species=[self.P]).set_parameters(6, {"k_forward_r0": 4.})
+        deterministic = protocol.simulate(self.crn, self.timepoints, return_dataframe=False)
+        for engine in ["tau_leaping", "hybrid", "cle"]:
+            results = protocol.simulate(self.crn, self.timepoints, engine=engine, n_replicates=20, seed=0, return_dataframe=False)
+            self.assertEqual(len(results), 20)
+            for r in results:
+                np.testing.assert_array_equal(r["I"], np.where(self.timepoints >= 2, 100, 0))
+                self.assertTrue(np.all(r["P"][self.timepoints < 2] == 0))
+            final = np.mean([r["P"][-1] for r in results])
+            self.assertAlmostEqual(final / deterministic["P"][-1], 1, delta=.05)
+            if engine != "cle":
+                for r in results:
+                    np.testing.assert_array_equal(r["P"], np.round(r["P"]))
+
+    def test_errors(self):
+        with self.assertRaisesRegex(ValueError, "before the first timepoint"):
+            Protocol([AddSpecies(-1, {"I": 1})]).simulate(self.crn, self.timepoints)
+        with self.assertRaisesRegex(ValueError, "not part of the CRN"):
+            Protocol([AddSpecies(1, {"X": 1})]).simulate(self.crn, self.timepoints)
+        with self.assertRaisesRegex(ValueError, "Unknown simulation engine"):
+            Protocol().simulate(self.crn, self.timepoints, engine="ssa")
+        with self.assertRaisesRegex(ValueError, "dilution factor"):
+            Dilute(1, 2.)
+        with self.assertRaisesRegex(TypeError, "ProtocolEvents"):
+            Protocol([(1, "I", 1)])
@@ -0,0 +1,76 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+from unittest import TestCase
+from biocrnpyler import ChemicalReactionNetwork, Species, Reaction, Complex, HillPositive
+from biocrnpyler import CompiledCRN, forward_sensitivities, adjoint_gradient
+import numpy as np
+
+
+class TestSensitivities(TestCase):
+
+    def setUp(self) -> None:
+        """this method gets executed before every test"""
+        self.G = Species("G", initial_concentration=1)
+        self.R = Species("R")
+        self.P = Species("P")
+        GR = Complex([self.G, self.R])
+        reactions = [Reaction.from_massaction([self.G], [self.G, self.R], k_forward=2.),
+                     Reaction.from_massaction([self.G, self.R], [GR], k_forward=.5, k_reverse=1.),
+                     Reaction([self.R], [self.R, self.P], propensity_type=HillPositive(k=3., K=2., n=2., s1=self.R)),
+                     Reaction.from_massaction([self.P], [], k_forward=.3)]
+        self.crn = ChemicalReactionNetwork(species=[self.G, self.R, self.P, GR], reactions=reactions)
+        self.compiled = CompiledCRN(self.crn)
+        self.timepoints = np.linspace(0, 5, 11)
+        self.tolerances = dict(rtol=1e-10, atol=1e-12)
+
+    def finite_differences(self, function, h=1e-6):
+        """Central differences of function(compiled) with respect to every parameter (relative step h)."""
+        base = self.compiled.parameters.copy()
+        derivatives = []
+        for k in range(len(base)):
+            values = []
+            for sign in [1, -1]:
+                p = base.copy()
+                p[k] += sign * h * base[k]
+                self.compiled.set_parameters(p)
+                values.append(function(self.compiled))
+            derivatives.append((values[0] - values[1]) / (2 * h * base[k]))
+        self.compiled.set_parameters(base)
+        return np.stack(derivatives, axis=-1)
+
+    def trajectory(self, compiled):
+        return forward_sensitivities(compiled, self.timepoints, parameters=[], **self.tolerances).states
+
+    def test_propensity_parameter_jacobian(self):
+        x = np.array([[1., 2., 3., .5], [.2, 4., 1., 1.]])
+        expected = self.finite_differences(lambda c: c.propensities(x))
+        np.testing.assert_allclose(self.compiled.propensity_parameter_jacobian(x), expected, rtol=1e-6, atol=1e-8)
+
+    def test_forward_sensitivities(self):
+        solution = self.crn.forward_sensitivities(self.timepoints, **self.tolerances)
+        self.assertEqual(solution.sensitivities.shape, (11, 4, len(self.compiled.parameters)))
+        np.testing.assert_allclose(solution.sensitivities, self.finite_differences(self.trajectory, h=1e-3),
+                                   rtol=1e-4, atol=1e-5)
+        np.testing.assert_array_equal(solution.sensitivities[0], 0)
+
+        # a subset of the parameters, by name
+        name = self.compiled.parameter_table.names[2]
+        subset = forward_sensitivities(self.compiled, self.timepoints, parameters=[name], **self.tolerances)
+        self.assertEqual(subset.parameter_names, [name])
+        np.testing.assert_allclose(subset.sensitivities[..., 0], solution.sensitivities[..., 2], rtol=1e-6, atol=1e-9)
+
+    def test_adjoint_gradient(self):
+        data = np.ones((11, 4))
+
+        def loss(states):
+            return np.sum((states - data)**2)
+
+        gradient, states = self.crn.adjoint_gradient(self.timepoints, lambda states: 2 * (states - data), **self.tolerances)
+        np.testing.assert_allclose(gradient, self.finite_differences(lambda c: loss(self.trajectory(c)), h=1e-3),
+                                   rtol=1e-4, atol=1e-5)
+
+        # the adjoint gradient agrees with the forward sensitivities
+        solution = forward_sensitivities(self.compiled, self.timepoints, **self.tolerances)
+        np.testing.assert_allclose(states, solution.states, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(gradient, np.einsum("tn,tnq->q", 2 * (states - data), solution.sensitivities), rtol=1e-5)
@@ -0,0 +1,71 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+from unittest import TestCase
+from biocrnpyler import ChemicalReactionNetwork, Species, Reaction, Complex, HillNegative
+from biocrnpyler import CompiledCRN, SteadyStateSolver, find_steady_state, steady_state_sweep
+import numpy as np
+
+
+class TestSteadyState(TestCase):
+
+    def setUp(self) -> None:
+        """this method gets executed before every test"""
+        self.A = Species("A", initial_concentration=2)
+        self.B = Species("B", initial_concentration=1)
+        self.C = Complex([self.A, self.B])
+        self.R = Species("R", initial_concentration=1)
+        self.P = Species("P")
+        # reversible binding with conserved totals and a repressed protein
+        reactions = [Reaction.from_massaction([self.A, self.B], [self.C], k_forward=2., k_reverse=1.),
+                     Reaction([], [self.P], propensity_type=HillNegative(k=10., K=2., n=2., s1=self.R)),
+                     Reaction.from_massaction([self.P], [], k_forward=.5)]
+        self.crn = ChemicalReactionNetwork(species=[self.A, self.B, self.C, self.R, self.P], reactions=reactions)
+
+    def expected(self, R=1., A=2., B=1.):
+        # 2 (A - c)(B - c) = c and P = 10 / (1 + (R/2)^2) / 0.5
+        c = ((2*A + 2*B + 1) - np.sqrt((2*A + 2*B + 1)**2 - 16*A*B)) / 4
+        return np.array([A - c, B - c, c, R, 20 / (1 + (R / 2)**2)])
+
+    def test_find_steady_state(self):
+        result = self.crn.find_steady_state()
+        np.testing.assert_allclose([result[repr(s)] for s in self.crn.species], self.expected(), rtol=1e-8)
+
+        result = find_steady_state(self.crn, initial_condition_dict={"R": 4}, parameters={"k_forward_r2": 1.})
+        np.testing.assert_allclose([result[repr(s)] for s in self.crn.species], self.expected(R=4) * [1, 1, 1, 1, .5], rtol=1e-8)
+
+        # agrees with a long time integration
+        trajectory = self.crn.simulate_deterministic([0, 100], return_dataframe=False, rtol=1e-10, atol=1e-12)
+        for s in self.crn.species:
+            self.assertAlmostEqual(self.crn.find_steady_state()[repr(s)], trajectory[repr(s)][-1], places=6)
+
+    def test_continuation(self):
+        solver = SteadyStateSolver(self.crn, max_newton_iterations=0)
+        x = solver.solve(solver.compiled.initial_state())
+        np.testing.assert_allclose(x, self.expected(), rtol=1e-6)
+        self.assertEqual(solver.statistics, {"newton": 0, "continuation": 1})
+
+        # without the conservation law reduction the Jacobian is singular and continuation is used
+        solver = SteadyStateSolver(self.crn, reduce_conservation_laws=False)
+        np.testing.assert_allclose(solver.solve(solver.compiled.initial_state()), self.expected(), rtol=1e-6)
+        self.assertEqual(solver.statistics["continuation"], 1)
+
+    def test_sweep(self):
+        compiled = CompiledCRN(self.crn)
+        R = np.logspace(-2, 2, 41)
+        x0 = np.tile(compiled.initial_state(), (len(R), 1))
+        x0[:, 3] = R
+        solver = SteadyStateSolver(compiled)
+        states = solver.sweep(initial_conditions=x0)
+        np.testing.assert_allclose(states, np.array([self.expected(R=r) for r in R]), rtol=1e-8)
+        self.assertEqual(solver.statistics["newton"], len(R))
+
+        k = np.linspace(1, 3, 5)
+        parameters = compiled.parameter_matrix([{"k_forward_r0": value} for value in k])
+        states = steady_state_sweep(compiled, parameters=parameters)
+        self.assertEqual(states.shape, (5, 5))
+        np.testing.assert_allclose(states[:, 0] * states[:, 1] * k, states[:, 2], rtol=1e-7)
+        np.testing.assert_allclose(states[:, 0] + states[:, 2], 2)
+
+        with self.assertRaisesRegex(ValueError, "parameters must have"):
+            steady_state_sweep(compiled, parameters=np.ones((2, 3)))
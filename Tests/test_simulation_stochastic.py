@@ -0,0 +1,182 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+import os
+import tempfile
+import warnings
+from unittest import TestCase
+from biocrnpyler import ChemicalReactionNetwork, Species, Reaction
+from biocrnpyler import CompiledCRN, TauLeapingStepper, HybridStepper, CLEIntegrator, simulate_tau_leaping, simulate_cle
+import numpy as np
+
+
+class TestTauLeaping(TestCase):
+
+    def setUp(self) -> None:
+        """this method gets executed before every test"""
+        self.G = Species("G", initial_concentration=2)
+        self.A = Species("A", initial_concentration=0)
+        self.D = Species("D", initial_concentration=5)
+        # low copy gene, abundant product which dimerizes reversibly
+        reactions = [Reaction.from_massaction([self.G], [self.G, self.A], k_forward=100.),
+                     Reaction.from_massaction([self.A], [], k_forward=1.),
+                     Reaction.from_massaction([self.A, self.A], [self.D], k_forward=.001, k_reverse=.1)]
+        self.crn = ChemicalReactionNetwork(species=[self.G, self.A, self.D], reactions=reactions)
+        self.timepoints = np.linspace(0, 5, 6)
+
+    def test_mean_matches_deterministic(self):
+        results = self.crn.simulate_tau_leaping(self.timepoints, n_replicates=200, seed=0, return_dataframe=False)
+        self.assertEqual(len(results), 200)
+        deterministic = self.crn.simulate_deterministic(self.timepoints, return_dataframe=False)
+        for s in ["A", "D"]:
+            mean = np.mean([r[s] for r in results], axis=0)
+            np.testing.assert_allclose(mean, deterministic[s], rtol=.05, atol=1)
+
+        for r in results:
+            # copy numbers stay non-negative integers and G is never consumed
+            for s in ["G", "A", "D"]:
+                self.assertTrue(np.all(r[s] >= 0))
+                np.testing.assert_array_equal(r[s], np.round(r[s]))
+            np.testing.assert_array_equal(r["G"], 2)
+
+    def test_seed(self):
+        result1 = simulate_tau_leaping(self.crn, self.timepoints, seed=3, return_dataframe=False)
+        result2 = simulate_tau_leaping(CompiledCRN(self.crn), self.timepoints, seed=3, return_dataframe=False)
+        np.testing.assert_array_equal(result1["A"], result2["A"])
+        np.testing.assert_array_equal(result1["time"], self.timepoints)
+
+    def test_low_copy_numbers(self):
+        # every channel is critical with a handful of molecules, so the replicates use SSA steps
+        A, B = Species("A", initial_concentration=5), Species("B")
+        crn = ChemicalReactionNetwork(species=[A, B], reactions=[Reaction.from_massaction([A], [B], k_forward=1., k_reverse=.5)])
+        compiled = CompiledCRN(crn)
+        stepper = TauLeapingStepper(compiled, rng=np.random.default_rng(1))
+        x = np.array([[5., 0.], [500., 500.]])
+        a = stepper.propensities(x)
+        np.testing.assert_array_equal(stepper.critical(x, a), [[True, False], [False, False]])
+
+        states = stepper.run(np.tile(compiled.initial_state(), (20, 1)), np.linspace(0, 3, 4))
+        np.testing.assert_array_equal(states.sum(axis=2), 5)
+        # with no reactants left, nothing happens
+        states = stepper.run(np.zeros((2, 2)), np.linspace(0, 3, 4))
+        np.testing.assert_array_equal(states, 0)
+
+
+class TestHybrid(TestCase):
+
+    def setUp(self) -> None:
+        """this method gets executed before every test"""
+        self.G = Species("G", initial_concentration=1)
+        self.G_on = Species("G_on")
+        self.P = Species("P")
+        # a single promoter switching on and off drives a large protein pool
+        reactions = [Reaction.from_massaction([self.G], [self.G_on], k_forward=.5, k_reverse=.5),
+                     Reaction.from_massaction([self.G_on], [self.G_on, self.P], k_forward=1000.),
+                     Reaction.from_massaction([self.P], [], k_forward=1.)]
+        self.crn = ChemicalReactionNetwork(species=[self.G, self.G_on, self.P], reactions=reactions)
+
+    def test_partition(self):
+        stepper = HybridStepper(CompiledCRN(self.crn))
+        x = np.array([[0., 1., 5000.], [1., 0., 5000.], [0., 1., 5.]])
+        fast = stepper.partition(x, stepper.propensities(x))
+        # channels: promoter on, promoter off, production, degradation
+        np.testing.assert_array_equal(fast, [[False, False, True, True],
+                                             [False, False, False, True],
+                                             [False, False, False, False]])
+
+    def test_simulate_hybrid(self):
+        timepoints = np.linspace(0, 8, 5)
+        results = self.crn.simulate_hybrid(timepoints, n_replicates=100, seed=0, return_dataframe=False)
+        final = np.array([r["P"][-1] for r in results])
+        for r in results:
+            # the promoter state stays discrete
+            np.testing.assert_array_equal(r["G"] + r["G_on"], 1)
+            self.assertTrue(set(r["G"]) <= {0, 1})
+
+        deterministic = self.crn.simulate_deterministic(timepoints, return_dataframe=False)
+        self.assertAlmostEqual(final.mean() / deterministic["P"][-1], 1, delta=.2)
+        # promoter switching keeps the protein distribution broad
+        self.assertGreater(final.std(), 100)
+
+    def test_fast_binding(self):
+        # fast, stiff binding and unbinding: the step size adapts to the fast propensities
+        A, B, C = Species("A", initial_concentration=500), Species("B", initial_concentration=500), Species("C")
+        crn = ChemicalReactionNetwork(species=[A, B, C], reactions=[Reaction.from_massaction([A, B], [C], k_forward=1., k_reverse=50.)])
+        timepoints = np.linspace(0, 1, 3)
+        deterministic = crn.simulate_deterministic(timepoints, return_dataframe=False)
+        results = crn.simulate_hybrid(timepoints, n_replicates=10, seed=0, return_dataframe=False)
+        for r in results:
+            self.assertTrue(np.all(np.isfinite(r["C"])))
+            np.testing.assert_allclose(r["C"][1:], deterministic["C"][1:], rtol=.01)
+            np.testing.assert_allclose(r["A"] + r["C"], 500)
+
+
+class TestCLE(TestCase):
+
+    def setUp(self) -> None:
+        """this method gets executed before every test"""
+        # immigration and death: the stationary distribution is Poisson(100)
+        self.A = Species("A", initial_concentration=100)
+        reactions = [Reaction.from_massaction([], [self.A], k_forward=100.),
+                     Reaction.from_massaction([self.A], [], k_forward=1.)]
+        self.crn = ChemicalReactionNetwork(species=[self.A], reactions=reactions)
+        self.timepoints = np.linspace(0, 4, 5)
+
+    def test_stationary_moments(self):
+        for method in CLEIntegrator.methods:
+            results = self.crn.simulate_cle(self.timepoints, n_replicates=2000, method=method, seed=0, return_dataframe=False)
+            final = np.array([r["A"][-1] for r in results])
+            self.assertAlmostEqual(final.mean(), 100, delta=2)
+            self.assertAlmostEqual(final.var(), 100, delta=15)
+
+        with self.assertRaisesRegex(ValueError, "Unknown CLE method"):
+            CLEIntegrator(CompiledCRN(self.crn), method="rk4")
+
+    def test_fast_binding(self):
+        # fast, stiff binding and unbinding: the steps are shortened by the step selection instead of diverging
+        A, B, C = Species("A", initial_concentration=500), Species("B", initial_concentration=500), Species("C")
+        crn = ChemicalReactionNetwork(species=[A, B, C], reactions=[Reaction.from_massaction([A, B], [C], k_forward=1., k_reverse=50.)])
+        timepoints = np.linspace(0, .5, 3)
+        deterministic = crn.simulate_deterministic(timepoints, return_dataframe=False)
+        for method in CLEIntegrator.methods:
+            results = crn.simulate_cle(timepoints, n_replicates=50, method=method, seed=0, return_dataframe=False)
+            final = np.array([r["C"][-1] for r in results])
+            self.assertTrue(np.all(np.isfinite(final)))
+            self.assertAlmostEqual(final.mean(), deterministic["C"][-1], delta=3)
+
+        # the overflow is only reported by the RuntimeError, without numpy warnings
+        for method in CLEIntegrator.methods:
+            integrator = CLEIntegrator(CompiledCRN(crn), method=method)
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")
+                with self.assertRaisesRegex(RuntimeError, "non-finite states"):
+                    integrator.step(np.array([[1e200, 1e200, 0.]]), .01)
+
+    def test_milstein_directional_derivatives(self):
+        # the channels are shifted in groups which do not change each other's propensities
+        G, A, D = Species("G"), Species("A"), Species("D")
+        reactions = [Reaction.from_massaction([G], [G, A], k_forward=100.),
+                     Reaction.from_massaction([A], [], k_forward=1.),
+                     Reaction.from_massaction([A, A], [D], k_forward=.001, k_reverse=.1)]
+        compiled = CompiledCRN(ChemicalReactionNetwork(species=[G, A, D], reactions=reactions))
+        integrator = CLEIntegrator(compiled, method="milstein")
+        self.assertEqual(sum(len(channels) for channels, _ in integrator._shift_groups), compiled.n_channels)
+        self.assertLess(len(integrator._shift_groups), compiled.n_channels)
+
+        x = np.array([[2., 50., 10.], [1., 20., 30.]])
+        a = integrator.propensities(x)
+        S = compiled.stoichiometric_matrix.toarray()
+        expected = np.stack([(integrator.propensities(x + 1e-4 * S[:, j])[:, j] - a[:, j]) / 1e-4 for j in range(compiled.n_channels)], axis=1)
+        np.testing.assert_allclose(integrator._directional_derivatives(x, a), expected)
+
+    def test_out(self):
+        with tempfile.TemporaryDirectory() as directory:
+            out = np.lib.format.open_memmap(os.path.join(directory, "cle.npy"), mode="w+", dtype=float, shape=(5, 10, 1))
+            result = simulate_cle(self.crn, self.timepoints, n_replicates=10, seed=0, out=out)
+            self.assertIs(result, out)
+            np.testing.assert_array_equal(out[0], 100)
+            self.assertTrue(np.all(out[1:] >= 0))
+            del result, out
+
+        with self.assertRaisesRegex(ValueError, "out must have the shape"):
+            simulate_cle(self.crn, self.timepoints, n_replicates=10, out=np.zeros((5, 1)))
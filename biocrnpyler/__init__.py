@@ -2,6 +2,7 @@
 # RMM, 11 Aug 2018
 
 from .chemical_reaction_network import *
+from .compiled_crn import *
 from .component import *
 # Core components
 from .components_basic import *
@@ -30,9 +31,18 @@ from .parameter import *
 from .plotting import *
 from .polymer import *
 from .propensities import *
+from .rate_law import *
 from .reaction import *
+from .result_store import *
 
 from .sbmlutil import *
+from .simulation_deterministic import *
+from .simulation_fsp import *
+from .simulation_lna import *
+from .simulation_protocol import *
+from .simulation_sensitivity import *
+from .simulation_steady_state import *
+from .simulation_stochastic import *
 from .species import *
 from .utils import *
 
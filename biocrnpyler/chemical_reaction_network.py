@@ -2,18 +2,121 @@
 #  Copyright (c) 2020, Build-A-Cell. All rights reserved.
 #  See LICENSE file in the project root directory for details.
 
+import bisect
 import copy
+import itertools
+import math
 import warnings
+from fractions import Fraction
 from typing import Dict, List, Tuple, Union
 from warnings import warn
 
 import libsbml
 
+from .propensities import HillPositive
 from .reaction import Reaction
-from .sbmlutil import add_all_reactions, add_all_species, create_sbml_model
+from .parameter import ParameterTable
+from .sbmlutil import (_create_global_parameter, add_all_reactions,
+                       add_all_species, create_sbml_model)
+from .result_store import simulate_ensemble
+from .simulation_deterministic import (simulate_deterministic,
+                                       simulate_deterministic_batch)
+from .simulation_fsp import simulate_fsp
+from .simulation_lna import simulate_lna
+from .simulation_protocol import simulate_protocol
+from .simulation_sensitivity import adjoint_gradient, forward_sensitivities
+from .simulation_steady_state import find_steady_state, steady_state_sweep
+from .simulation_stochastic import (simulate_cle, simulate_hybrid,
+                                    simulate_tau_leaping)
 from .species import Species
 
 
+class _IncidenceIndex(object):
+    """Append-only incidence index of the species and reactions lists of a ChemicalReactionNetwork.
+
+    position[s] is the position of s in the species list. All other maps go from a Species to
+    a list of positions (in increasing order):
+        containing[s]: species in the CRN which contain s (s itself included), via get_species(recursive=True)
+        consuming[s]: reactions with s as an input, or as an output if the reaction is reversible
+        producing[s]: reactions with s as an output, or as an input if the reaction is reversible
+        modifying[s]: reactions whose propensity has s as a species (e.g. s1 and d of Hill propensities)
+    """
+    def __init__(self, species: List[Species], reactions: List[Reaction]):
+        self.species = species
+        self.reactions = reactions
+        self.n_species = 0
+        self.n_reactions = 0
+        self.position = {}
+        self.containing = {}
+        self.consuming = {}
+        self.producing = {}
+        self.modifying = {}
+
+    def is_valid_for(self, species: List[Species], reactions: List[Reaction]) -> bool:
+        """The index stays valid as long as the lists are only appended to."""
+        return self.species is species and self.reactions is reactions \
+            and self.n_species <= len(species) and self.n_reactions <= len(reactions)
+
+    def update(self):
+        """Indexes the species and reactions appended since the last update."""
+        for position in range(self.n_species, len(self.species)):
+            self.add_species(position)
+        self.n_species = len(self.species)
+
+        for position in range(self.n_reactions, len(self.reactions)):
+            self.add_reaction(position)
+        self.n_reactions = len(self.reactions)
+
+    @staticmethod
+    def _add(incidence: Dict[Species, List[int]], s: Species, position: int):
+        positions = incidence.setdefault(s, [])
+        if len(positions) == 0 or positions[-1] < position:
+            positions.append(position)
+        else:
+            bisect.insort(positions, position)
+
+    @staticmethod
+    def _remove(incidence: Dict[Species, List[int]], s: Species, position: int):
+        positions = incidence[s]
+        del positions[bisect.bisect_left(positions, position)]
+        if len(positions) == 0:
+            del incidence[s]
+
+    def _species_roles(self, position: int):
+        return [(self.containing, set(self.species[position].get_species(recursive=True)))]
+
+    def _reaction_roles(self, position: int):
+        r = self.reactions[position]
+        inputs = set(w.species for w in r.inputs)
+        outputs = set(w.species for w in r.outputs)
+        if r.is_reversible:
+            inputs, outputs = inputs | outputs, outputs | inputs
+        return [(self.consuming, inputs), (self.producing, outputs), (self.modifying, set(r.propensity_type.species))]
+
+    def add_species(self, position: int):
+        self.position.setdefault(self.species[position], position)
+        for incidence, species in self._species_roles(position):
+            for s in species:
+                self._add(incidence, s, position)
+
+    def remove_species(self, position: int):
+        if self.position.get(self.species[position]) == position:
+            del self.position[self.species[position]]
+        for incidence, species in self._species_roles(position):
+            for s in species:
+                self._remove(incidence, s, position)
+
+    def add_reaction(self, position: int):
+        for incidence, species in self._reaction_roles(position):
+            for s in species:
+                self._add(incidence, s, position)
+
+    def remove_reaction(self, position: int):
+        for incidence, species in self._reaction_roles(position):
+            for s in species:
+                self._remove(incidence, s, position)
+
+
 class ChemicalReactionNetwork(object):
     """A chemical reaction network is a container of species and reactions
     chemical reaction networks can be compiled into SBML.
@@ -27,12 +130,25 @@ class ChemicalReactionNetwork(object):
     .. math::
     k \Prod_{inputs i} (S_i)!/(S_i - a_i)!
     where a_i is the spectrometric coefficient of species i
+
+    first order sinks:
+    an aggregated representation of many reactions S_i --> 0 with mass action
+    rate k_i (e.g. dilution). first_order_sinks[S_i] is the list of rates k_i.
+    In-package simulators evaluate all sinks as a single vector term and they
+    are expanded into one reaction per rate when an SBML model is generated.
     """
-    def __init__(self, species: List[Species], reactions: List[Reaction], show_warnings=False):
+    def __init__(self, species: List[Species], reactions: List[Reaction], show_warnings=False, first_order_sinks=None):
         self.species = []
         self.reactions = []
+        self.first_order_sinks = {}
+        # {include_rates: (reaction list, number of indexed reactions, {canonical key: position})}
+        self._reaction_key_indices = {}
+        self._incidence = None
+        self._parameter_table = None
         self.add_species(species)
         self.add_reactions(reactions)
+        if first_order_sinks is not None:
+            self.add_first_order_sinks(first_order_sinks)
 
         ChemicalReactionNetwork.check_crn_validity(self.reactions, self.species, show_warnings=show_warnings)
 
@@ -54,13 +170,27 @@ class ChemicalReactionNetwork(object):
                 pass
                 #Code will go here for testing s.parent and s.position
 
-    def add_reactions(self, reactions: Union[Reaction,List[Reaction]], show_warnings=True) -> None:
+        if self._incidence is not None:
+            self.get_incidence_index()
+
+    def add_reactions(self, reactions: Union[Reaction,List[Reaction]], show_warnings=True, dedup: str = None) -> None:
         """Adds a reaction or a list of reactions to the CRN object
 
+        Duplicates are found with Reaction.canonical_key in O(1) per reaction:
+            dedup=None: all reactions are added
+            dedup='warn': all reactions are added with a warning for every duplicate
+            dedup='drop': reactions which are already in the CRN (same canonical key) are not added
+            dedup='merge_rates': reactions which only differ from a reaction in the CRN in their rate
+                parameters (e.g. k_forward and k_reverse of MassAction) are merged into it by summing the rates
+
         :param reactions: Reaction instance or list of Reaction instances
         :param show_warnings: whether to show warning when duplicated reactions/species was found
+        :param dedup: None, 'warn', 'drop' or 'merge_rates'
         :return: None
         """
+        if dedup not in [None, 'warn', 'drop', 'merge_rates']:
+            raise ValueError(f"dedup must be None, 'warn', 'drop' or 'merge_rates'. Received {dedup}.")
+
         if not isinstance(reactions, list):
             reactions = [reactions]
 
@@ -68,13 +198,175 @@ class ChemicalReactionNetwork(object):
             if not isinstance(r, Reaction): # check reactions and Reactions
                 raise ValueError("A non-reaction object was used as a reaction!")
 
+            self._add_reaction(r, dedup, show_warnings=show_warnings)
+
+            #TODO synchronize Species in the CRN
+
+        if self._incidence is not None:
+            self.get_incidence_index()
+
+    def _add_reaction(self, r: Reaction, dedup: str, show_warnings=True, add_species=True) -> int:
+        """Adds a copy of r using the dedup mode of add_reactions.
+
+        :param add_species: if False, the species of r must already be part of the CRN
+        :return: the position of r (or the reaction it was dropped for or merged into) in self.reactions
+        """
+        if dedup is not None:
+            include_rates = dedup != 'merge_rates' or len(r.propensity_type._rate_parameters) == 0
+            key_index = self._reaction_key_index(include_rates)
+            key = r.canonical_key(include_rates)
+            if key in key_index:
+                position = key_index[key]
+                if dedup == 'warn' or (dedup == 'merge_rates' and include_rates):
+                    warn(f"Reaction {r} is already part of the CRN as {self.reactions[position]}. Duplicates have NOT been removed.")
+                elif dedup == 'drop':
+                    return position
+                else:
+                    existing = self.reactions[position]
+                    self.reactions[position] = Reaction(inputs=existing.inputs, outputs=existing.outputs,
+                                                        propensity_type=existing.propensity_type.merge_rates(r.propensity_type))
+                    # the merged reaction has new rates, so the index of exact keys is out of date
+                    self._reaction_key_indices.pop(True, None)
+                    return position
+
+        if add_species:
             # add all the Species in the reaction to the CRN
             reaction_species = list(set([w.species for w in r.inputs + r.outputs]))
             self.add_species(reaction_species, show_warnings=show_warnings)
 
-            self.reactions.append(copy.deepcopy(r)) #copy the Reaction and add it to the CRN
+        self.reactions.append(copy.deepcopy(r)) #copy the Reaction and add it to the CRN
+        return len(self.reactions) - 1
 
-            #TODO synchronize Species in the CRN
+    def _reaction_key_index(self, include_rates: bool) -> Dict[tuple, int]:
+        """Returns {Reaction.canonical_key(include_rates): position of the first such reaction in self.reactions}.
+
+        The index is built once and then only extended by the reactions appended since the last call.
+        It is rebuilt if self.reactions was replaced or shortened.
+        """
+        reactions, n_indexed, key_index = self._reaction_key_indices.get(include_rates, (None, 0, None))
+        if reactions is not self.reactions or n_indexed > len(self.reactions):
+            n_indexed, key_index = 0, {}
+        for position in range(n_indexed, len(self.reactions)):
+            key_index.setdefault(self.reactions[position].canonical_key(include_rates), position)
+        self._reaction_key_indices[include_rates] = (self.reactions, len(self.reactions), key_index)
+        return key_index
+
+    def add_reactions_bulk(self, reactions: List[Reaction], copy_reactions: bool = True) -> None:
+        """Adds a list of trusted Reactions to the CRN.
+
+        Faster than add_reactions for large lists: the reactions are only type checked (not deduplicated),
+        new species are found with a hash set and added in the order they first appear, and
+        the reactions are copied with a single deepcopy (so the copies share Species objects).
+
+        :param reactions: list of Reaction instances
+        :param copy_reactions: if False, the Reaction objects are added without copying them
+        :return: None
+        """
+        if not isinstance(reactions, list):
+            reactions = [reactions]
+
+        known_species = set(self.species)
+        new_species = []
+        for r in reactions:
+            if not isinstance(r, Reaction):
+                raise ValueError("A non-reaction object was used as a reaction!")
+            for w in itertools.chain(r.inputs, r.outputs):
+                if w.species not in known_species:
+                    known_species.add(w.species)
+                    new_species.append(w.species)
+
+        self.species.extend(copy.deepcopy(new_species))
+        self.reactions.extend(copy.deepcopy(reactions) if copy_reactions else reactions)
+
+        if self._incidence is not None:
+            self.get_incidence_index()
+
+    def get_incidence_index(self) -> _IncidenceIndex:
+        """Returns the species/reaction incidence index of the CRN.
+
+        The index is built on the first call and then updated incrementally: add_species and add_reactions
+        index only the new species and reactions. It is rebuilt if self.species or self.reactions was replaced
+        or shortened. Reactions must not be edited in place (other than their rates).
+        """
+        if self._incidence is None or not self._incidence.is_valid_for(self.species, self.reactions):
+            self._incidence = _IncidenceIndex(self.species, self.reactions)
+        self._incidence.update()
+        return self._incidence
+
+    def _query_incidence(self, incidence: Dict[Species, List[int]], species: Species, return_indices: bool):
+        if not isinstance(species, Species):
+            raise ValueError('species argument must be an instance of Species!')
+        positions = incidence.get(species, [])
+        if return_indices:
+            return list(positions)
+        return [self.reactions[i] for i in positions]
+
+    def get_reactions_consuming(self, species: Species, return_indices: bool = False) -> List[Reaction]:
+        """Returns the reactions which consume species: as an input or, for reversible reactions, as an output.
+
+        :param species: Species
+        :param return_indices: if True, positions in self.reactions are returned instead of Reactions
+        """
+        return self._query_incidence(self.get_incidence_index().consuming, species, return_indices)
+
+    def get_reactions_producing(self, species: Species, return_indices: bool = False) -> List[Reaction]:
+        """Returns the reactions which produce species: as an output or, for reversible reactions, as an input.
+
+        :param species: Species
+        :param return_indices: if True, positions in self.reactions are returned instead of Reactions
+        """
+        return self._query_incidence(self.get_incidence_index().producing, species, return_indices)
+
+    def get_reactions_modified_by(self, species: Species, return_indices: bool = False) -> List[Reaction]:
+        """Returns the reactions whose propensity depends on species other than through mass action,
+        e.g. the regulator s1 and the species d of Hill propensities.
+
+        :param species: Species
+        :param return_indices: if True, positions in self.reactions are returned instead of Reactions
+        """
+        return self._query_incidence(self.get_incidence_index().modifying, species, return_indices)
+
+    def get_reactions_involving(self, species: Species, return_indices: bool = False) -> List[Reaction]:
+        """Returns the reactions which consume, produce or are modified by species (in the order of self.reactions).
+
+        :param species: Species
+        :param return_indices: if True, positions in self.reactions are returned instead of Reactions
+        """
+        index = self.get_incidence_index()
+        positions = sorted(set(itertools.chain(*[incidence.get(species, []) for incidence in
+                                                 [index.consuming, index.producing, index.modifying]])))
+        return self._query_incidence({species: positions}, species, return_indices)
+
+    def add_first_order_sinks(self, sinks) -> None:
+        """Adds first order sinks S --> 0 @ rate k * [S] to the CRN.
+
+        Sinks for the same species are kept as separate rates and summed by the simulators.
+
+        :param sinks: list of (Species, rate) tuples or dictionary {Species: rate}.
+                      Rates are numbers or Parameters.
+        :return: None
+        """
+        if isinstance(sinks, dict):
+            sinks = list(sinks.items())
+
+        for s, rate in sinks:
+            if not isinstance(s, Species):
+                raise ValueError("A non-species object was used as a species!")
+            self.add_species(s)
+            self.first_order_sinks.setdefault(s, []).append(rate)
+
+    def first_order_sink_vector(self) -> List[float]:
+        """Returns the total first order sink rate of each species in self.species."""
+        rates = [0.0] * len(self.species)
+        species_index = self.get_species_index()
+        for s, sink_rates in self.first_order_sinks.items():
+            rates[species_index[s]] = sum(float(getattr(k, "value", k)) for k in sink_rates)
+        return rates
+
+    def _first_order_sink_reactions(self) -> List[Reaction]:
+        """Expands the first order sinks into one mass action Reaction per rate."""
+        return [Reaction.from_massaction(inputs=[s], outputs=[], k_forward=k)
+                for s, sink_rates in self.first_order_sinks.items() for k in sink_rates]
 
     @staticmethod
     def check_crn_validity(reactions: List[Reaction], species: List[Species], show_warnings=True) -> Tuple[List[Reaction],List[Species]]:
@@ -125,6 +417,8 @@ class ChemicalReactionNetwork(object):
         for r in self.reactions:
             txt += "\t" + repr(r) + "\n"
         txt += "]"
+        if self.first_order_sinks:
+            txt += "\nFirst Order Sinks = " + ", ".join(repr(s) for s in self.first_order_sinks)
         return txt
 
     def pretty_print(self, show_rates = True, show_material = True, show_attributes = True, show_initial_condition = True, **kwargs):
@@ -147,6 +441,15 @@ class ChemicalReactionNetwork(object):
             r = self.reactions[rind]
             txt += f"{rind}. " + r.pretty_print(show_rates = show_rates, show_material = show_material, show_attributes = show_attributes, **kwargs) + "\n"
         txt += "]"
+
+        if self.first_order_sinks:
+            txt += f"\n\nFirst Order Sinks ({len(self.first_order_sinks)}) = [\n"
+            for s, sink_rates in self.first_order_sinks.items():
+                txt += s.pretty_print(show_material = show_material, show_attributes = show_attributes, **kwargs) + " --> "
+                if show_rates:
+                    txt += " k = " + " + ".join(str(getattr(k, "value", k)) for k in sink_rates)
+                txt += "\n"
+            txt += "]"
         return txt
 
     def initial_condition_vector(self, init_cond_dict: Union[Dict[str, float], Dict[Species, float]]):
@@ -160,22 +463,271 @@ class ChemicalReactionNetwork(object):
         """Returns all species (complexes and otherwise) containing a given species
            (or string).
         """
-        return_list = []
         if not isinstance(species, Species):
             raise ValueError('species argument must be an instance of Species!')
 
-        for s in self.species:
-            if species in s.get_species(recursive = True):
-                if return_as_strings:
-                    return_list.append(repr(s))
-                else:
-                    return_list.append(s)
+        return_list = [self.species[i] for i in self.get_incidence_index().containing.get(species, [])]
+        if return_as_strings:
+            return_list = [repr(s) for s in return_list]
         return return_list
 
-    def replace_species(self, species: Species, new_species: Species):
+    def get_parameter_table(self) -> ParameterTable:
+        """Returns the deduplicated parameter table of the reactions and first order sinks of the CRN.
+
+        Reactions which use the same ParameterEntry (same name, part_id and mechanism) share a slot.
+        The table is rebuilt when reactions or sink rates were added, removed or replaced.
+        """
+        sink_rates = self.first_order_sinks
+        if self._parameter_table is None or not self._parameter_table.is_valid_for(self.reactions, sink_rates):
+            self._parameter_table = ParameterTable(self.reactions, sink_rates)
+        return self._parameter_table
+
+    def parameter_vector(self) -> List[float]:
+        """Returns the values of the parameter table (see get_parameter_table)."""
+        return self.get_parameter_table().vector()
+
+    def set_parameters(self, parameters) -> None:
+        """Sets parameter values without recompiling the CRN.
+
+        The values are written into every propensity and first order sink using the parameter. Reactions
+        whose parameters change are replaced by copies, so CRNs sharing them are not affected.
+
+        :param parameters: a vector with a value for every slot of the parameter table, or a dictionary
+                           {slot, parameter name (e.g. "kb_part_mechanism") or ParameterKey: value}
+        """
+        self.get_parameter_table().set_values(parameters, self.reactions)
+
+    def get_species_index(self) -> Dict[Species, int]:
+        """Returns a dictionary mapping each Species in the CRN to its position in self.species."""
+        return {s: i for i, s in enumerate(self.species)}
+
+    def get_stoichiometry(self) -> List[Dict[int, int]]:
+        """Returns the net stoichiometry of each reaction as a sparse column.
+
+        Column j is a dictionary {species index: net change} for self.reactions[j]
+        (outputs minus inputs). Species with zero net change are omitted.
+        Reverse reactions are not listed separately because their column is
+        the negative of the forward column. One column {species index: -1} is
+        appended for every species with a first order sink.
+        """
+        species_index = self.get_species_index()
+        columns = []
+        for r in self.reactions:
+            column = {}
+            for w in r.inputs:
+                i = species_index[w.species]
+                column[i] = column.get(i, 0) - w.stoichiometry
+            for w in r.outputs:
+                i = species_index[w.species]
+                column[i] = column.get(i, 0) + w.stoichiometry
+            columns.append({i: v for i, v in column.items() if v != 0})
+        for s in self.first_order_sinks:
+            columns.append({species_index[s]: -1})
+        return columns
+
+    def get_conservation_laws(self, return_as_strings = False) -> List[Dict[Species, int]]:
+        """Returns a basis of the conservation laws (conserved moieties) of the CRN.
+
+        Each conservation law is a dictionary {Species: integer coefficient} such that
+        sum_i coefficient_i * [Species_i] is constant under every reaction in the CRN.
+        The laws are a basis of the left null space of the stoichiometric matrix and are
+        computed with exact integer arithmetic. Species which do not take part in any
+        reaction are returned as trivial conservation laws {Species: 1}.
+
+        The first species in each law is its dependent species: it only appears in that
+        law, so it can be eliminated from an ODE system and reconstructed afterwards
+        (see CompiledCRN and ConservationLawReduction).
+
+        :param return_as_strings: if True, the keys are repr(Species) instead of Species
+        :return: list of dictionaries
+        """
+        laws = []
+        for dependent, law in self._conservation_law_basis():
+            ordered = [dependent] + [i for i in sorted(law) if i != dependent]
+            if return_as_strings:
+                laws.append({repr(self.species[i]): law[i] for i in ordered})
+            else:
+                laws.append({self.species[i]: law[i] for i in ordered})
+        return laws
+
+    def _conservation_law_basis(self) -> List[Tuple[int, Dict[int, int]]]:
+        """Returns the conservation laws as (dependent species index, {species index: coefficient}) tuples."""
+        return ChemicalReactionNetwork._integer_left_null_space(self.get_stoichiometry(), len(self.species))
+
+    @staticmethod
+    def _integer_left_null_space(columns: List[Dict[int, int]], n_species: int) -> List[Tuple[int, Dict[int, int]]]:
+        """Computes an integer basis of the left null space of a sparse stoichiometric matrix.
+
+        The rows of the transposed stoichiometric matrix are brought into reduced row echelon
+        form one at a time with exact Fraction arithmetic. Only nonzero entries are stored and
+        col_rows tracks which pivot rows contain each column, so eliminations only touch rows
+        that actually share species.
+
+        :param columns: sparse columns {species index: net change}, one per reaction
+        :param n_species: number of species (rows of the stoichiometric matrix)
+        :return: list of (dependent species index, {species index: coefficient}). The dependent
+                 species has a positive coefficient and appears in no other returned law.
+        """
+        pivots = {}  # pivot column -> reduced row (pivot entry is 1)
+        col_rows = {}  # column -> set of pivot columns whose row has a nonzero entry in that column
+
+        for column in columns:
+            row = {i: Fraction(v) for i, v in column.items() if v != 0}
+            # Eliminate existing pivots. Pivot rows are zero in all other pivot columns,
+            # so this never re-introduces a pivot column into row.
+            for p in [c for c in row if c in pivots]:
+                coefficient = row.get(p)
+                if coefficient:
+                    for c, v in pivots[p].items():
+                        new_v = row.get(c, 0) - coefficient * v
+                        if new_v == 0:
+                            row.pop(c, None)
+                        else:
+                            row[c] = new_v
+            if not row:
+                continue
+
+            pivot = max(row)
+            scale = row[pivot]
+            row = {c: v / scale for c, v in row.items()}
+
+            # keep the echelon form reduced: remove the new pivot column from the other pivot rows
+            for p in list(col_rows.get(pivot, ())):
+                prow = pivots[p]
+                coefficient = prow[pivot]
+                for c, v in row.items():
+                    new_v = prow.get(c, 0) - coefficient * v
+                    if new_v == 0:
+                        prow.pop(c, None)
+                        col_rows[c].discard(p)
+                    else:
+                        if c not in prow:
+                            col_rows.setdefault(c, set()).add(p)
+                        prow[c] = new_v
+            col_rows.pop(pivot, None)
+
+            pivots[pivot] = row
+            for c in row:
+                if c != pivot:
+                    col_rows.setdefault(c, set()).add(pivot)
+
+        laws = []
+        for free in range(n_species):
+            if free in pivots:
+                continue
+            law = {free: Fraction(1)}
+            for p in col_rows.get(free, ()):
+                law[p] = -pivots[p][free]
+
+            # scale to the smallest integer vector
+            denominator = 1
+            for v in law.values():
+                denominator = denominator * v.denominator // math.gcd(denominator, v.denominator)
+            integer_law = {i: int(v * denominator) for i, v in law.items()}
+            divisor = 0
+            for v in integer_law.values():
+                divisor = math.gcd(divisor, v)
+            laws.append((free, {i: v // divisor for i, v in integer_law.items()}))
+
+        return laws
+
+    def prune_unreachable(self, initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None):
+        """Removes the species and reactions which can never be produced or fire.
+
+        Starting from the species with a nonzero initial concentration, reachability is
+        propagated to a fixed point: a reaction (or the reverse direction of a reversible
+        reaction) fires once all of its required species are reachable and then makes its
+        products reachable. The required species are the reaction inputs plus the propensity
+        species which multiply the rate (s1 of HillPositive, d of the proportional Hill
+        propensities). Every species and reaction is visited a constant number of times.
+
+        Species which are not reachable but appear in the propensity of a kept reaction
+        (for example an absent repressor of a HillNegative propensity) are kept.
+
+        Acts in place.
+
+        :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+        :return: self
+        """
+        if initial_condition_dict is None:
+            initial_condition_dict = {}
+
+        def initial_value(s):
+            if s in initial_condition_dict:
+                return initial_condition_dict[s]
+            return initial_condition_dict.get(repr(s), s.initial_concentration)
+
+        species_index = self.get_species_index()
+
+        # one channel per reaction direction: (reaction index, required species, produced species)
+        channels = []
+        for reaction_ind, r in enumerate(self.reactions):
+            extra_required = []
+            propensity_species = r.propensity_type.propensity_dict['species']
+            if isinstance(r.propensity_type, HillPositive):
+                extra_required.append(propensity_species['s1'])
+            if propensity_species.get('d', None) is not None:
+                extra_required.append(propensity_species['d'])
+
+            inputs = [w.species for w in r.inputs]
+            outputs = [w.species for w in r.outputs]
+            channels.append((reaction_ind, inputs + extra_required, outputs))
+            if r.is_reversible:
+                channels.append((reaction_ind, outputs + extra_required, inputs))
+
+        missing = []  # number of unreached required species of each channel
+        waiting = {}  # species index -> channels waiting for it
+        for channel_ind, (_, required, _) in enumerate(channels):
+            required_indices = set(species_index[s] for s in required if s in species_index)
+            missing.append(len(required_indices))
+            for i in required_indices:
+                waiting.setdefault(i, []).append(channel_ind)
+
+        reached = [initial_value(s) != 0 for s in self.species]
+        frontier = [i for i, is_reached in enumerate(reached) if is_reached]
+        fired = [False] * len(channels)
+        ready = [c for c, count in enumerate(missing) if count == 0]
+
+        while frontier or ready:
+            while frontier:
+                i = frontier.pop()
+                for channel_ind in waiting.get(i, ()):
+                    missing[channel_ind] -= 1
+                    if missing[channel_ind] == 0:
+                        ready.append(channel_ind)
+            while ready:
+                channel_ind = ready.pop()
+                fired[channel_ind] = True
+                for s in channels[channel_ind][2]:
+                    i = species_index[s]
+                    if not reached[i]:
+                        reached[i] = True
+                        frontier.append(i)
+
+        kept_reactions = set(channels[c][0] for c in range(len(channels)) if fired[c])
+        keep_species = reached
+        for reaction_ind in kept_reactions:
+            for s in self.reactions[reaction_ind].species:
+                if s in species_index:
+                    keep_species[species_index[s]] = True
+
+        self.reactions = [r for reaction_ind, r in enumerate(self.reactions) if reaction_ind in kept_reactions]
+        self.species = [s for i, s in enumerate(self.species) if keep_species[i]]
+        self.first_order_sinks = {s: k for s, k in self.first_order_sinks.items() if keep_species[species_index[s]]}
+        return self
+
+    def replace_species(self, species: Species, new_species: Species, in_place: bool = False, share_structure: bool = False):
         """Replaces species with new_species in the entire CRN.
 
-        Does not act in place: returns a new CRN.
+        Only the species containing species and the reactions involving those are rebuilt;
+        they are found with the incidence index (see get_incidence_index).
+
+        :param species: species to be replaced
+        :param new_species: the new species the old species is replaced with
+        :param in_place: if True, self is modified (and its incidence index updated) and returned
+        :param share_structure: if True (and in_place is False), the returned CRN shares all unchanged Species
+                                and Reactions with self instead of being a full copy
+        :return: ChemicalReactionNetwork
         """
 
         if not isinstance(species, Species):
@@ -184,17 +736,200 @@ class ChemicalReactionNetwork(object):
         if not isinstance(new_species, Species):
             raise ValueError('species argument must be an instance of Species!')
 
-        new_species_list = []
-        for s in self.species:
-            new_s = s.replace_species(species, new_species)
-            new_species_list.append(new_s)
+        index = self.get_incidence_index()
+        affected_species = index.containing.get(species, [])
+        new_species_dict = {i: self.species[i].replace_species(species, new_species) for i in affected_species}
+        affected_reactions = sorted(set(position for i in affected_species
+                                        for incidence in [index.consuming, index.producing, index.modifying]
+                                        for position in incidence.get(self.species[i], [])))
+        new_reaction_dict = {j: self.reactions[j].replace_species(species, new_species) for j in affected_reactions}
 
-        new_reaction_list = []
-        for r in self.reactions:
-            new_r = r.replace_species(species, new_species)
-            new_reaction_list.append(new_r)
+        replaced = {self.species[i]: s for i, s in new_species_dict.items()}
+        new_sinks = {}
+        for s, sink_rates in self.first_order_sinks.items():
+            new_sinks.setdefault(replaced.get(s, s), []).extend(sink_rates)
+
+        if not in_place and not share_structure:
+            new_species_list = [new_species_dict.get(i, s) for i, s in enumerate(self.species)]
+            new_reaction_list = [new_reaction_dict.get(j, r) for j, r in enumerate(self.reactions)]
+            new_sink_list = [(s, k) for s, sink_rates in new_sinks.items() for k in sink_rates]
+            return ChemicalReactionNetwork(new_species_list, new_reaction_list, first_order_sinks = new_sink_list)
+
+        # only the new objects are copied, as add_species and add_reactions would do
+        new_species_dict = copy.deepcopy(new_species_dict)
+        new_reaction_dict = copy.deepcopy(new_reaction_dict)
+        if in_place:
+            crn = self
+            for i, s in new_species_dict.items():
+                index.remove_species(i)
+                crn.species[i] = s
+                index.add_species(i)
+            for j, r in new_reaction_dict.items():
+                index.remove_reaction(j)
+                crn.reactions[j] = r
+                index.add_reaction(j)
+            crn._reaction_key_indices = {}
+        else:
+            crn = ChemicalReactionNetwork._from_lists([new_species_dict.get(i, s) for i, s in enumerate(self.species)],
+                                                      [new_reaction_dict.get(j, r) for j, r in enumerate(self.reactions)], {})
+        crn.first_order_sinks = new_sinks
+
+        # new_species may already have been part of the CRN
+        if len(set(crn.species)) < len(crn.species):
+            unique_species = set()
+            crn.species = [s for s in crn.species if not (s in unique_species or unique_species.add(s))]
+        return crn
+
+    @classmethod
+    def merge(cls, *crns, conflict_policy: str = 'error', dedup: str = 'drop'):
+        """Merges CRNs into a new CRN, e.g. to assemble a model from separately compiled Mixtures.
+
+        Species are merged by equality and reactions by Reaction.canonical_key, in time linear in the total size.
+        Species which are part of several CRNs with different initial concentrations are reconciled by conflict_policy:
+            'error': raise a ValueError
+            'first' / 'last': use the initial concentration of the first / last CRN containing the species
+            'max': use the largest initial concentration (e.g. when modules leave species they share at 0)
+        First order sinks of a species are added once per CRN, except that with dedup='drop' sink rates
+        which an earlier CRN already has for the species are dropped.
+
+        :param crns: ChemicalReactionNetworks
+        :param conflict_policy: 'error', 'first', 'last' or 'max'
+        :param dedup: None, 'warn', 'drop' or 'merge_rates' (see add_reactions)
+        :return: (merged CRN, index_maps) where index_maps[k]["species"][i] and index_maps[k]["reactions"][j]
+                 are the positions of crns[k].species[i] and crns[k].reactions[j] in the merged CRN
+        """
+        if conflict_policy not in ['error', 'first', 'last', 'max']:
+            raise ValueError(f"conflict_policy must be 'error', 'first', 'last' or 'max'. Received {conflict_policy}.")
+        if dedup not in [None, 'warn', 'drop', 'merge_rates']:
+            raise ValueError(f"dedup must be None, 'warn', 'drop' or 'merge_rates'. Received {dedup}.")
+
+        merged = cls._from_lists([], [], {})
+        species_position = {}
+        index_maps = []
+        for crn in crns:
+            if not isinstance(crn, ChemicalReactionNetwork):
+                raise TypeError(f"Only ChemicalReactionNetworks can be merged. Received {type(crn)}.")
+
+            species_map = []
+            for s in crn.species:
+                if s not in species_position:
+                    species_position[s] = len(merged.species)
+                    merged.species.append(copy.deepcopy(s))
+                else:
+                    merged_s = merged.species[species_position[s]]
+                    if merged_s.initial_concentration != s.initial_concentration:
+                        if conflict_policy == 'error':
+                            raise ValueError(f"Species {s} has the conflicting initial concentrations {merged_s.initial_concentration} "
+                                             f"and {s.initial_concentration}.")
+                        elif conflict_policy == 'last' or (conflict_policy == 'max' and
+                                                           s.initial_concentration > merged_s.initial_concentration):
+                            merged_s.initial_concentration = s.initial_concentration
+                species_map.append(species_position[s])
+
+            reaction_map = []
+            for r in crn.reactions:
+                for w in r.inputs + r.outputs:
+                    if w.species not in species_position:
+                        species_position[w.species] = len(merged.species)
+                        merged.species.append(copy.deepcopy(w.species))
+                reaction_map.append(merged._add_reaction(r, dedup, add_species=False))
+
+            for s, sink_rates in crn.first_order_sinks.items():
+                existing_rates = [getattr(k, "value", k) for k in merged.first_order_sinks.get(s, [])]
+                for k in sink_rates:
+                    if dedup == 'drop' and getattr(k, "value", k) in existing_rates:
+                        existing_rates.remove(getattr(k, "value", k))
+                    else:
+                        merged.first_order_sinks.setdefault(s, []).append(k)
+
+            index_maps.append({"species": species_map, "reactions": reaction_map})
+
+        return merged, index_maps
+
+    def subnetwork(self, seeds: Union[Species, List[Species]], hops: int = 1, direction: str = 'both'):
+        """Extracts the reactions within a number of hops of the seed species, with all their species.
 
-        return ChemicalReactionNetwork(new_species_list, new_reaction_list)
+        A breadth first search over the species-reaction incidence graph (see get_incidence_index), so the
+        time is proportional to the size of the extracted subnetwork. Every hop goes from a species to the reactions:
+            'forward': consuming or modified by it, and on to their products
+            'backward': producing it, and on to their reactants and propensity species
+            'both': involving it, and on to all their species
+        Reversible reactions are followed in both directions.
+
+        :param seeds: Species or list of Species of the CRN
+        :param hops: number of reaction steps from the seeds (None for no limit)
+        :param direction: 'forward', 'backward' or 'both'
+        :return: (subnetwork, index_map) where index_map["species"][i] and index_map["reactions"][j] are the
+                 positions of subnetwork.species[i] and subnetwork.reactions[j] in self
+        """
+        if direction not in ['forward', 'backward', 'both']:
+            raise ValueError(f"direction must be 'forward', 'backward' or 'both'. Received {direction}.")
+        if isinstance(seeds, Species):
+            seeds = [seeds]
+
+        index = self.get_incidence_index()
+        for s in seeds:
+            if s not in index.position:
+                raise ValueError(f"Seed species {s} is not part of the CRN.")
+
+        visited = set(seeds)
+        frontier = list(visited)
+        reaction_positions = set()
+        hop = 0
+        while len(frontier) > 0 and (hops is None or hop < hops):
+            next_frontier = []
+            for s in frontier:
+                candidates = []
+                if direction in ['forward', 'both']:
+                    candidates += index.consuming.get(s, []) + index.modifying.get(s, [])
+                if direction in ['backward', 'both']:
+                    candidates += index.producing.get(s, [])
+                for j in candidates:
+                    if j in reaction_positions:
+                        continue
+                    reaction_positions.add(j)
+                    r = self.reactions[j]
+                    reactants = [w.species for w in r.inputs]
+                    products = [w.species for w in r.outputs]
+                    if r.is_reversible:
+                        reactants, products = reactants + products, products + reactants
+                    if direction == 'forward':
+                        neighbours = products
+                    elif direction == 'backward':
+                        neighbours = reactants + r.propensity_type.species
+                    else:
+                        neighbours = r.species
+                    for n in neighbours:
+                        if n not in visited:
+                            visited.add(n)
+                            next_frontier.append(n)
+            frontier = next_frontier
+            hop += 1
+
+        # the subnetwork holds all species of its reactions
+        included = set(visited)
+        for j in reaction_positions:
+            included.update(self.reactions[j].species)
+        species_map = sorted(index.position[s] for s in included if s in index.position)
+        reaction_map = sorted(reaction_positions)
+
+        species_list = [self.species[i] for i in species_map]
+        sinks = {s: list(rates) for s, rates in self.first_order_sinks.items() if s in included}
+        sub_crn = ChemicalReactionNetwork._from_lists(copy.deepcopy(species_list),
+                                                      copy.deepcopy([self.reactions[j] for j in reaction_map]), sinks)
+        return sub_crn, {"species": species_map, "reactions": reaction_map}
+
+    @classmethod
+    def _from_lists(cls, species: List[Species], reactions: List[Reaction], first_order_sinks: Dict[Species, List]):
+        """Creates a CRN which uses the given (trusted) lists and objects without copying or checking them."""
+        crn = cls.__new__(cls)
+        crn.species = species
+        crn.reactions = reactions
+        crn.first_order_sinks = first_order_sinks
+        crn._reaction_key_indices = {}
+        crn._incidence = None
+        crn._parameter_table = None
+        return crn
 
     def generate_sbml_model(self, stochastic_model=False, show_warnings = False, **keywords):
         """Creates an new SBML model and populates with the species and
@@ -211,7 +946,15 @@ class ChemicalReactionNetwork(object):
         
         add_all_species(model=model, species=self.species)
 
-        add_all_reactions(model=model, reactions=self.reactions, stochastic_model=stochastic_model, **keywords)
+        # global parameters are created from the parameter table before the reactions refer to them
+        table = self.get_parameter_table()
+        for name, value, is_global in zip(table.names, table.values, table.is_global):
+            if is_global:
+                _create_global_parameter(model, name, value)
+
+        # SBML has no aggregated sink term: first order sinks are written as one reaction per rate
+        reactions = self.reactions + self._first_order_sink_reactions()
+        add_all_reactions(model=model, reactions=reactions, stochastic=stochastic_model, **keywords)
 
         if document.getNumErrors():
             warn('SBML model generated has errors. Use document.getErrorLog() to print all errors.')
@@ -289,6 +1032,114 @@ class ChemicalReactionNetwork(object):
         else:
             return result
 
+    def simulate_deterministic(self, timepoints, initial_condition_dict = None,
+                               reduce_conservation_laws = True, return_dataframe = True, **kwargs):
+        """Simulate the deterministic (ODE) model of the CRN in-process with scipy.
+
+        Conservation laws are detected with get_conservation_laws() and their dependent species
+        are eliminated from the integrated system unless reduce_conservation_laws = False.
+        See simulation_deterministic.simulate_deterministic for all keywords.
+        """
+        return simulate_deterministic(self, timepoints, initial_condition_dict = initial_condition_dict,
+                                      reduce_conservation_laws = reduce_conservation_laws,
+                                      return_dataframe = return_dataframe, **kwargs)
+
+    def simulate_deterministic_batch(self, timepoints, parameters, initial_conditions = None, **kwargs):
+        """Simulate the ODE model of the CRN for a matrix of parameter vectors with one solver call.
+
+        See simulation_deterministic.simulate_deterministic_batch for all keywords.
+        """
+        return simulate_deterministic_batch(self, timepoints, parameters, initial_conditions = initial_conditions, **kwargs)
+
+    def simulate_protocol(self, protocol, timepoints, initial_condition_dict = None, engine = "deterministic", **kwargs):
+        """Simulate a multi-phase experiment (scheduled additions, resets, dilutions and parameter changes)
+        in-process, compiling the CRN once.
+
+        See simulation_protocol.Protocol.simulate for all keywords.
+        """
+        return simulate_protocol(self, protocol, timepoints, initial_condition_dict = initial_condition_dict,
+                                 engine = engine, **kwargs)
+
+    def simulate_ensemble(self, path, timepoints, n_replicates, engine = "tau_leaping", **kwargs):
+        """Simulate a large stochastic ensemble in-process, writing the trajectories chunk by chunk
+        into a memory-mapped ResultStore in the directory path.
+
+        See result_store.simulate_ensemble for all keywords.
+        """
+        return simulate_ensemble(self, path, timepoints, n_replicates, engine = engine, **kwargs)
+
+    def simulate_tau_leaping(self, timepoints, initial_condition_dict = None, n_replicates = 1,
+                             return_dataframe = True, **kwargs):
+        """Simulate the stochastic model of the CRN in-process with adaptive explicit tau-leaping.
+
+        See simulation_stochastic.simulate_tau_leaping for all keywords.
+        """
+        return simulate_tau_leaping(self, timepoints, initial_condition_dict = initial_condition_dict,
+                                    n_replicates = n_replicates, return_dataframe = return_dataframe, **kwargs)
+
+    def simulate_fsp(self, timepoints, bounds = None, initial_condition_dict = None, **kwargs):
+        """Compute the copy number distribution of the CRN with the Finite State Projection of the CME.
+
+        See simulation_fsp.simulate_fsp for all keywords.
+        """
+        return simulate_fsp(self, timepoints, bounds = bounds, initial_condition_dict = initial_condition_dict, **kwargs)
+
+    def simulate_lna(self, timepoints, initial_condition_dict = None, **kwargs):
+        """Compute the mean and covariance of the species with the linear noise approximation.
+
+        See simulation_lna.simulate_lna for all keywords.
+        """
+        return simulate_lna(self, timepoints, initial_condition_dict = initial_condition_dict, **kwargs)
+
+    def forward_sensitivities(self, timepoints, parameters = None, initial_condition_dict = None, **kwargs):
+        """Integrate the ODE model together with the sensitivities dx/dp of the species to a few parameters.
+
+        See simulation_sensitivity.forward_sensitivities for all keywords.
+        """
+        return forward_sensitivities(self, timepoints, parameters = parameters,
+                                     initial_condition_dict = initial_condition_dict, **kwargs)
+
+    def adjoint_gradient(self, timepoints, loss_gradient, parameters = None, initial_condition_dict = None, **kwargs):
+        """Compute the gradient of a loss of the trajectory with respect to many parameters with the adjoint method.
+
+        See simulation_sensitivity.adjoint_gradient for all keywords.
+        """
+        return adjoint_gradient(self, timepoints, loss_gradient, parameters = parameters,
+                                initial_condition_dict = initial_condition_dict, **kwargs)
+
+    def find_steady_state(self, initial_condition_dict = None, parameters = None, **kwargs):
+        """Find the steady state of the ODE model reached from the initial condition, without time integration.
+
+        See simulation_steady_state.find_steady_state for all keywords.
+        """
+        return find_steady_state(self, initial_condition_dict = initial_condition_dict, parameters = parameters, **kwargs)
+
+    def steady_state_sweep(self, parameters = None, initial_conditions = None, **kwargs):
+        """Compute the steady states along a sweep of parameters and/or initial conditions.
+
+        See simulation_steady_state.steady_state_sweep for all keywords.
+        """
+        return steady_state_sweep(self, parameters = parameters, initial_conditions = initial_conditions, **kwargs)
+
+    def simulate_cle(self, timepoints, initial_condition_dict = None, n_replicates = 1,
+                     return_dataframe = True, **kwargs):
+        """Simulate the chemical Langevin equation of the CRN in-process for many replicates at once.
+
+        See simulation_stochastic.simulate_cle for all keywords.
+        """
+        return simulate_cle(self, timepoints, initial_condition_dict = initial_condition_dict,
+                            n_replicates = n_replicates, return_dataframe = return_dataframe, **kwargs)
+
+    def simulate_hybrid(self, timepoints, initial_condition_dict = None, n_replicates = 1,
+                        return_dataframe = True, **kwargs):
+        """Simulate the CRN in-process with slow, low copy reactions as stochastic events and fast,
+        high copy reactions as ODEs.
+
+        See simulation_stochastic.simulate_hybrid for all keywords.
+        """
+        return simulate_hybrid(self, timepoints, initial_condition_dict = initial_condition_dict,
+                               n_replicates = n_replicates, return_dataframe = return_dataframe, **kwargs)
+
     def runsim_roadrunner(self, timepoints, filename, species_to_plot = None):
         """To simulate using roadrunner.
         Arguments:
@@ -0,0 +1,627 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+import hashlib
+from typing import Dict, List, Union
+from warnings import warn
+
+from .propensities import GeneralPropensity, Hill, HillPositive, MassAction
+from .rate_law import CompiledFormula
+from .species import Species
+
+HAVE_NUMPY = False
+try:
+    import numpy as np
+    import scipy.sparse
+
+    HAVE_NUMPY = True
+except ModuleNotFoundError:
+    pass
+
+
+class CompiledCRN(object):
+    """A numerical representation of a ChemicalReactionNetwork used by the in-package simulators.
+
+    Species are indexed in the order of crn.species. Every Reaction is split into
+    one or two reaction channels: the forward reaction and, for reversible reactions,
+    the reverse reaction. Propensities are evaluated for all channels of the same
+    type at once with NumPy, for states of shape (n_species,) or (..., n_species).
+
+    First order sinks (ChemicalReactionNetwork.first_order_sinks) are appended as
+    one channel per species after the reaction channels (with channels[j] = (None, False)).
+    The deterministic right hand side evaluates them as a single vector term.
+
+    Rates are read from the parameter table of the CRN (ChemicalReactionNetwork.get_parameter_table)
+    into self.parameters. set_parameters changes them without recompiling.
+
+    Requires numpy and scipy.
+    """
+    def __init__(self, crn):
+        if not HAVE_NUMPY:
+            raise ModuleNotFoundError("CompiledCRN requires numpy and scipy. Please install them (pip install biocrnpyler[all]).")
+
+        self.crn = crn
+        self.species = list(crn.species)
+        self.species_index = crn.get_species_index()
+        self.n_species = len(self.species)
+        self.parameter_table = crn.get_parameter_table()
+        self.parameters = np.array(self.parameter_table.values, dtype=float)
+
+        # channels[j] = (index of the Reaction in crn.reactions, True if it is the reverse reaction)
+        self.channels = []
+        stoich_rows, stoich_cols, stoich_vals = [], [], []
+        mass_action = []
+        hill = []
+        general = {}
+        # other propensities are evaluated channel by channel with their RateLaw: (channel, deterministic, stochastic)
+        self._rate_law_channels = []
+        # (channel, species index) for every species a propensity depends on
+        dependencies = []
+
+        for reaction_ind, r in enumerate(crn.reactions):
+            directions = [False, True] if r.is_reversible else [False]
+            for reverse in directions:
+                channel = len(self.channels)
+                self.channels.append((reaction_ind, reverse))
+                reactants, products = (r.outputs, r.inputs) if reverse else (r.inputs, r.outputs)
+
+                for w in reactants:
+                    stoich_rows.append(self._index(w.species))
+                    stoich_cols.append(channel)
+                    stoich_vals.append(-w.stoichiometry)
+                for w in products:
+                    stoich_rows.append(self._index(w.species))
+                    stoich_cols.append(channel)
+                    stoich_vals.append(w.stoichiometry)
+
+                propensity = r.propensity_type
+                slots = self.parameter_table.reaction_slots[reaction_ind]
+                if isinstance(propensity, MassAction):
+                    k = slots['k_reverse' if reverse else 'k_forward']
+                    mass_action.append((channel, k, [(self._index(w.species), w.stoichiometry) for w in reactants]))
+                    dependencies += [(channel, self._index(w.species)) for w in reactants]
+                elif isinstance(propensity, Hill):
+                    species = propensity.propensity_dict['species']
+                    d = species.get('d', None)
+                    hill.append((channel, slots['k'], slots['K'], slots['n'],
+                                 self._index(species['s1']),
+                                 self.n_species if d is None else self._index(d),
+                                 isinstance(propensity, HillPositive)))
+                    dependencies += [(channel, self._index(s)) for s in [species['s1'], d] if s is not None]
+                elif isinstance(propensity, GeneralPropensity):
+                    # channels with the same formula (and the same species/parameter roles) are evaluated together
+                    compiled = CompiledFormula.compile(propensity.propensity_function)
+                    arguments = compiled.bind({name: self._index(s) for name, s in propensity.propensity_dict['species'].items()}, slots)
+                    key = (propensity.propensity_function, tuple(is_species for is_species, _ in arguments))
+                    general.setdefault(key, (compiled, []))[1].append((channel, [i for _, i in arguments]))
+                    dependencies += [(channel, i) for is_species, i in arguments if is_species]
+                else:
+                    try:
+                        rate_laws = [propensity.rate_law(r, stochastic=stochastic, reverse=reverse) for stochastic in (False, True)]
+                    except NotImplementedError:
+                        raise NotImplementedError(f"CompiledCRN does not support propensity type {propensity.name} in reaction {r}.")
+                    self._rate_law_channels.append((channel, *[rate_law.numpy_evaluator(self.species_index, slots) for rate_law in rate_laws]))
+                    dependencies += [(channel, self._index(s)) for rate_law in rate_laws for s in rate_law.species]
+
+        self.n_reaction_channels = len(self.channels)
+        # scipy.sparse sums duplicate entries, so species on both sides get their net change
+        self._reaction_stoichiometry = scipy.sparse.csr_matrix((stoich_vals, (stoich_rows, stoich_cols)),
+                                                               shape=(self.n_species, self.n_reaction_channels), dtype=float)
+
+        # every sink rate adds parameters[_sink_rate_slots[m]] to the sink rate of species _sink_rate_species[m]
+        sink_rates = [(self._index(s), slot) for s, slots in self.parameter_table.sink_slots.items() for slot in slots]
+        self._sink_rate_species = np.array([i for i, _ in sink_rates], dtype=int)
+        self._sink_rate_slots = np.array([slot for _, slot in sink_rates], dtype=int)
+        self._sink_species = np.unique(self._sink_rate_species)
+        self._sink_rate_matrix = np.zeros((len(sink_rates), self.n_species))
+        self._sink_rate_matrix[np.arange(len(sink_rates)), self._sink_rate_species] = 1
+        for i in self._sink_species:
+            stoich_rows.append(i)
+            stoich_cols.append(len(self.channels))
+            stoich_vals.append(-1)
+            dependencies.append((len(self.channels), i))
+            self.channels.append((None, False))
+
+        self.n_channels = len(self.channels)
+        self.stoichiometric_matrix = scipy.sparse.csr_matrix((stoich_vals, (stoich_rows, stoich_cols)),
+                                                             shape=(self.n_species, self.n_channels), dtype=float)
+        # sparsity pattern of the propensity Jacobian (n_channels x n_species)
+        self.propensity_dependencies = scipy.sparse.csr_matrix(
+            (np.ones(len(dependencies), dtype=bool), ([c for c, _ in dependencies], [i for _, i in dependencies])),
+            shape=(self.n_channels, self.n_species))
+
+        # Mass action channels: the reactant slots of channel j are
+        # x_ext[_ma_index[j, :]] - _ma_offset[j, :], where x_ext is the state with a trailing 1.
+        # A reactant with stoichiometry n occupies n slots with offsets 0..n-1, so the product of
+        # the slots is x^n (deterministic, offsets ignored) or x(x-1)...(x-n+1) (stochastic).
+        max_order = max([sum(n for _, n in reactants) for _, _, reactants in mass_action] + [1])
+        self._ma_channels = np.array([c for c, _, _ in mass_action], dtype=int)
+        self._ma_k_slots = np.array([k for _, k, _ in mass_action], dtype=int)
+        self._ma_index = np.full((len(mass_action), max_order), self.n_species, dtype=int)
+        self._ma_offset = np.zeros((len(mass_action), max_order))
+        for row, (_, _, reactants) in enumerate(mass_action):
+            slot = 0
+            for i, n in reactants:
+                for offset in range(n):
+                    self._ma_index[row, slot] = i
+                    self._ma_offset[row, slot] = offset
+                    slot += 1
+
+        # GeneralPropensity channels: one group per formula, with an index array (into the state or the
+        # parameter vector) per name of the formula
+        self._general_groups = []
+        for (_, roles), (compiled, group) in general.items():
+            indices = np.array([i for _, i in group], dtype=int).reshape(len(group), len(roles))
+            self._general_groups.append((np.array([c for c, _ in group], dtype=int), compiled,
+                                         [(is_species, indices[:, a]) for a, is_species in enumerate(roles)]))
+
+        # Hill channels: k * d * ((s1/K)^n if positive else 1) / (1 + (s1/K)^n), with d = 1 when absent
+        self._hill_channels = np.array([h[0] for h in hill], dtype=int)
+        self._hill_slots = np.array([h[1:4] for h in hill], dtype=int).reshape(len(hill), 3)
+        self._hill_s1 = np.array([h[4] for h in hill], dtype=int)
+        self._hill_d = np.array([h[5] for h in hill], dtype=int)
+        self._hill_positive = np.array([h[6] for h in hill], dtype=bool)
+
+        # GeneralPropensity and RateLaw channels are differentiated by finite differences. Species which no
+        # such channel depends on jointly are perturbed together: _numerical_groups holds, for every perturbation,
+        # (perturbed species, channels and species of the Jacobian entries it gives)
+        numerical = np.zeros(self.n_channels, dtype=bool)
+        numerical[[c for c, _, _ in self._rate_law_channels]] = True
+        numerical[[c for channels, _, _ in self._general_groups for c in channels]] = True
+        entries = self.propensity_dependencies.tocoo()
+        on_numerical = numerical[entries.row]
+        entries = scipy.sparse.coo_matrix((entries.data[on_numerical], (entries.row[on_numerical], entries.col[on_numerical])),
+                                          shape=entries.shape)
+        pattern = entries.tocsc()
+        groups = []  # [species, channels] with disjoint channel sets of the species
+        for i in range(self.n_species):
+            channels = set(pattern.indices[pattern.indptr[i]:pattern.indptr[i+1]].tolist())
+            if len(channels) == 0:
+                continue
+            for group in groups:
+                if group[1].isdisjoint(channels):
+                    group[0].append(i)
+                    group[1] |= channels
+                    break
+            else:
+                groups.append([[i], channels])
+        self._numerical_groups = []
+        for species, _ in groups:
+            in_group = np.isin(entries.col, species)
+            self._numerical_groups.append((np.array(species, dtype=int), entries.row[in_group], entries.col[in_group]))
+
+        self._update_parameters()
+
+    def _update_parameters(self):
+        """Gathers the rate arrays used by the propensities from self.parameters."""
+        self._rates = self._rate_arrays(self.parameters)
+        _, self._ma_k, self._hill_k, self._hill_K, self._hill_n, self.sink_rate_vector, self._sink_rates = self._rates
+
+    def _rate_arrays(self, parameters):
+        """The rate arrays of parameter vectors of shape (..., n_parameters).
+
+        :return: (parameters, mass action k, Hill k, Hill K, Hill n, sink rate vector, sink rates),
+                 each with the leading dimensions of parameters
+        """
+        parameters = np.asarray(parameters, dtype=float)
+        sink_rate_vector = parameters[..., self._sink_rate_slots].dot(self._sink_rate_matrix)
+        return (parameters, parameters[..., self._ma_k_slots], parameters[..., self._hill_slots[:, 0]],
+                parameters[..., self._hill_slots[:, 1]], parameters[..., self._hill_slots[:, 2]],
+                sink_rate_vector, sink_rate_vector[..., self._sink_species])
+
+    def _get_rates(self, parameters):
+        return self._rates if parameters is None else self._rate_arrays(parameters)
+
+    def set_parameters(self, parameters):
+        """Changes the rates used by this CompiledCRN without recompiling (the CRN itself is not changed).
+
+        :param parameters: a vector with a value for every slot of the parameter table, or a dictionary
+                           {slot, parameter name or ParameterKey: value}
+        """
+        self.parameters = np.array(self.parameter_table.resolve(parameters, self.parameters), dtype=float)
+        self._update_parameters()
+
+    def parameter_matrix(self, parameter_sets):
+        """Builds a (P x n_parameters) matrix of parameter vectors, e.g. for simulate_deterministic_batch.
+
+        :param parameter_sets: list of P dictionaries {slot, parameter name or ParameterKey: value}
+                               (see ParameterTable.resolve); unspecified parameters keep the values of self.parameters
+        :return: numpy array of shape (P, n_parameters)
+        """
+        return np.array([self.parameter_table.resolve(parameters, self.parameters) for parameters in parameter_sets], dtype=float)
+
+    @property
+    def fingerprint(self) -> str:
+        """A hash of the structure of the CRN: species, reactions, propensity types and parameter names.
+
+        Parameter values are not part of the fingerprint, so it identifies the model of a parameter sweep.
+        """
+        h = hashlib.sha256()
+        for s in self.species:
+            h.update(repr(s).encode() + b"\0")
+        for r in self.crn.reactions:
+            h.update(f"{r!r}|{type(r.propensity_type).__name__}".encode() + b"\0")
+        for name in self.parameter_table.names:
+            h.update(name.encode() + b"\0")
+        return h.hexdigest()
+
+    def _index(self, species: Species) -> int:
+        if species not in self.species_index:
+            raise ValueError(f"Species {species} is used in a reaction but is not part of the CRN species list.")
+        return self.species_index[species]
+
+    def initial_state(self, initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None):
+        """Returns the initial state vector.
+
+        Species.initial_concentration is used unless the species (or repr(species))
+        is a key of initial_condition_dict.
+        """
+        x0 = np.array([float(s.initial_concentration) for s in self.species])
+        if initial_condition_dict is not None:
+            for key, value in initial_condition_dict.items():
+                if isinstance(key, Species):
+                    if key in self.species_index:
+                        x0[self.species_index[key]] = value
+                    else:
+                        warn(f"Species {key} in initial_condition_dict is not part of the CRN.")
+                else:
+                    matches = [i for i, s in enumerate(self.species) if repr(s) == key]
+                    if len(matches) == 0:
+                        warn(f"Species {key} in initial_condition_dict is not part of the CRN.")
+                    for i in matches:
+                        x0[i] = value
+        return x0
+
+    def propensities(self, x, stochastic: bool = False, parameters=None):
+        """Evaluates the propensity (rate) of every reaction channel.
+
+        :param x: state array of shape (..., n_species)
+        :param stochastic: if True, mass action propensities use falling factorials of copy numbers
+        :param parameters: parameter vectors of shape (..., n_parameters), broadcast against the states
+                           (default: self.parameters)
+        :return: array of shape (..., n_channels)
+        """
+        x = np.asarray(x, dtype=float)
+        rates = self._get_rates(parameters)
+        v = self._reaction_propensities(x, stochastic, rates)
+        if len(self._sink_species) > 0:
+            v = np.concatenate([v, rates[6] * x[..., self._sink_species]], axis=-1)
+        return v
+
+    def _reaction_propensities(self, x, stochastic, rates=None):
+        """Propensities of the reaction channels only (without first order sinks)."""
+        parameters, ma_k, hill_k, hill_K, hill_n, _, _ = self._rates if rates is None else rates
+        if parameters.ndim > 1:
+            x = np.broadcast_to(x, np.broadcast_shapes(x.shape[:-1], parameters.shape[:-1]) + x.shape[-1:])
+        x_ext = np.concatenate([x, np.ones(x.shape[:-1] + (1,))], axis=-1)
+        v = np.zeros(x.shape[:-1] + (self.n_reaction_channels,))
+
+        if len(self._ma_channels) > 0:
+            terms = x_ext[..., self._ma_index]
+            if stochastic:
+                terms = terms - self._ma_offset
+            v[..., self._ma_channels] = ma_k * np.prod(terms, axis=-1)
+
+        if len(self._hill_channels) > 0:
+            ratio = (np.maximum(x_ext[..., self._hill_s1], 0) / hill_K) ** hill_n
+            numerator = np.where(self._hill_positive, ratio, 1.0)
+            v[..., self._hill_channels] = hill_k * x_ext[..., self._hill_d] * numerator / (1 + ratio)
+
+        self._numerical_propensities(v, x, stochastic, parameters)
+        return v
+
+    def _numerical_propensities(self, v, x, stochastic, parameters):
+        """Writes the propensities of the GeneralPropensity and RateLaw channels into v."""
+        for channels, compiled, arguments in self._general_groups:
+            values = [x[..., indices] if is_species else parameters[..., indices] for is_species, indices in arguments]
+            v[..., channels] = compiled(*values)
+
+        for channel, deterministic, stochastic_evaluator in self._rate_law_channels:
+            v[..., channel] = (stochastic_evaluator if stochastic else deterministic)(x, parameters)
+
+    def propensity_jacobian(self, x, stochastic: bool = False, parameters=None):
+        """Derivatives of the propensities with respect to the species: dv_j/dx_i.
+
+        Mass action, Hill and sink channels are differentiated analytically; other propensities
+        (GeneralPropensity and other RateLaws) by central finite differences.
+
+        :param x: state array of shape (..., n_species)
+        :param stochastic: differentiate the stochastic (falling factorial) mass action propensities
+        :param parameters: parameter vectors of shape (..., n_parameters) (default: self.parameters)
+        :return: array of shape (..., n_channels, n_species)
+        """
+        rates = self._get_rates(parameters)
+        _, ma_k, hill_k, hill_K, hill_n, _, sink_rates = rates
+        x = np.asarray(x, dtype=float)
+        if rates[0].ndim > 1:
+            x = np.broadcast_to(x, np.broadcast_shapes(x.shape[:-1], rates[0].shape[:-1]) + x.shape[-1:])
+        x_ext = np.concatenate([x, np.ones(x.shape[:-1] + (1,))], axis=-1)
+        # the extra last column collects the derivatives with respect to the constant 1 of x_ext and is dropped
+        jac = np.zeros(x.shape[:-1] + (self.n_channels, self.n_species + 1))
+
+        if len(self._ma_channels) > 0:
+            terms = x_ext[..., self._ma_index]
+            if stochastic:
+                terms = terms - self._ma_offset
+            for slot in range(terms.shape[-1]):
+                others = terms.copy()
+                others[..., slot] = 1
+                jac[..., self._ma_channels, self._ma_index[:, slot]] += ma_k * np.prod(others, axis=-1)
+
+        if len(self._hill_channels) > 0:
+            s1 = np.maximum(x_ext[..., self._hill_s1], 0)
+            ratio = (s1 / hill_K) ** hill_n
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dratio = np.nan_to_num(hill_n / hill_K * (s1 / hill_K) ** (hill_n - 1))
+            d = x_ext[..., self._hill_d]
+            numerator = np.where(self._hill_positive, ratio, 1.0)
+            # d/dratio of ratio/(1+ratio) and of 1/(1+ratio)
+            sign = np.where(self._hill_positive, 1.0, -1.0)
+            jac[..., self._hill_channels, self._hill_s1] += hill_k * d * sign * dratio / (1 + ratio)**2
+            jac[..., self._hill_channels, self._hill_d] += hill_k * numerator / (1 + ratio)
+
+        numerical = [c for c, _, _ in self._rate_law_channels]
+        numerical += [c for channels, _, _ in self._general_groups for c in channels]
+        if len(numerical) > 0:
+            h = 1e-6 * np.maximum(np.abs(x), 1)
+            for i in range(self.n_species):
+                dx = np.zeros_like(x)
+                dx[..., i] = h[..., i]
+                dv = self._reaction_propensities(x + dx, stochastic, rates) - self._reaction_propensities(x - dx, stochastic, rates)
+                jac[..., numerical, i] = dv[..., numerical] / (2 * h[..., i:i+1])
+
+        sink_channels = np.arange(self.n_reaction_channels, self.n_channels)
+        jac[..., sink_channels, self._sink_species] = sink_rates
+        return jac[..., :self.n_species]
+
+    def propensity_parameter_jacobian(self, x, stochastic: bool = False, parameters=None):
+        """Derivatives of the propensities with respect to the parameters: dv_j/dp_k for every slot k of the parameter table.
+
+        Mass action, Hill and sink channels are differentiated analytically; other propensities
+        (GeneralPropensity and other RateLaws) by central finite differences in their own parameters.
+
+        :param x: state array of shape (..., n_species)
+        :param stochastic: differentiate the stochastic (falling factorial) mass action propensities
+        :param parameters: parameter vectors of shape (..., n_parameters) (default: self.parameters)
+        :return: array of shape (..., n_channels, n_parameters)
+        """
+        rates = self._get_rates(parameters)
+        parameters, ma_k, hill_k, hill_K, hill_n, _, _ = rates
+        x = np.asarray(x, dtype=float)
+        if parameters.ndim > 1:
+            x = np.broadcast_to(x, np.broadcast_shapes(x.shape[:-1], parameters.shape[:-1]) + x.shape[-1:])
+        x_ext = np.concatenate([x, np.ones(x.shape[:-1] + (1,))], axis=-1)
+        jac = np.zeros(x.shape[:-1] + (self.n_channels, parameters.shape[-1]))
+
+        if len(self._ma_channels) > 0:
+            terms = x_ext[..., self._ma_index]
+            if stochastic:
+                terms = terms - self._ma_offset
+            jac[..., self._ma_channels, self._ma_k_slots] += np.prod(terms, axis=-1)
+
+        if len(self._hill_channels) > 0:
+            s1 = np.maximum(x_ext[..., self._hill_s1], 0)
+            ratio = (s1 / hill_K) ** hill_n
+            d = x_ext[..., self._hill_d]
+            numerator = np.where(self._hill_positive, ratio, 1.0)
+            dv_dratio = hill_k * d * np.where(self._hill_positive, 1.0, -1.0) / (1 + ratio)**2
+            with np.errstate(divide='ignore', invalid='ignore'):
+                log_ratio = np.where(s1 > 0, np.log(np.where(s1 > 0, s1, 1) / hill_K), 0)
+            jac[..., self._hill_channels, self._hill_slots[:, 0]] += d * numerator / (1 + ratio)
+            jac[..., self._hill_channels, self._hill_slots[:, 1]] += dv_dratio * (-hill_n * ratio / hill_K)
+            jac[..., self._hill_channels, self._hill_slots[:, 2]] += dv_dratio * ratio * log_ratio
+
+        numerical = [c for c, _, _ in self._rate_law_channels]
+        numerical += [c for channels, _, _ in self._general_groups for c in channels]
+        if len(numerical) > 0:
+            slots = sorted({slot for c in numerical for slot in self.parameter_table.reaction_slots[self.channels[c][0]].values()})
+            for k in slots:
+                h = 1e-6 * np.maximum(np.abs(parameters[..., k:k+1]), 1)
+                dp = np.zeros(parameters.shape[-1])
+                dp[k] = 1
+                plus, minus = self._rate_arrays(parameters + h * dp), self._rate_arrays(parameters - h * dp)
+                dv = self._reaction_propensities(x, stochastic, plus) - self._reaction_propensities(x, stochastic, minus)
+                jac[..., numerical, k] = dv[..., numerical] / (2 * h)
+
+        if len(self._sink_rate_slots) > 0:
+            sink_channels = self.n_reaction_channels + np.searchsorted(self._sink_species, self._sink_rate_species)
+            jac[..., sink_channels, self._sink_rate_slots] += x[..., self._sink_rate_species]
+        return jac
+
+    def sparse_propensity_jacobian(self, x, stochastic: bool = False, parameters=None):
+        """The derivatives dv_j/dx_i of the propensities of a single state, as a sparse matrix.
+
+        The entries are assembled in COO format from the mass action, Hill and sink index arrays, without
+        forming the dense (n_channels x n_species) matrix. Other propensities are differentiated by central
+        finite differences, perturbing the species in the groups of self._numerical_groups.
+
+        :param x: state array of shape (n_species,)
+        :param stochastic: differentiate the stochastic (falling factorial) mass action propensities
+        :param parameters: parameter vector of shape (n_parameters,) (default: self.parameters)
+        :return: scipy.sparse.csr_matrix of shape (n_channels, n_species)
+        """
+        rates = self._get_rates(parameters)
+        parameters, ma_k, hill_k, hill_K, hill_n, _, sink_rates = rates
+        x = np.asarray(x, dtype=float)
+        if x.ndim != 1 or parameters.ndim != 1:
+            raise ValueError("sparse_propensity_jacobian takes a single state and parameter vector, use propensity_jacobian for arrays of states.")
+        x_ext = np.append(x, 1.0)
+        rows, cols, vals = [], [], []
+
+        if len(self._ma_channels) > 0:
+            terms = x_ext[self._ma_index]
+            if stochastic:
+                terms = terms - self._ma_offset
+            for slot in range(terms.shape[-1]):
+                others = terms.copy()
+                others[:, slot] = 1
+                rows.append(self._ma_channels)
+                cols.append(self._ma_index[:, slot])
+                vals.append(ma_k * np.prod(others, axis=-1))
+
+        if len(self._hill_channels) > 0:
+            s1 = np.maximum(x_ext[self._hill_s1], 0)
+            ratio = (s1 / hill_K) ** hill_n
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dratio = np.nan_to_num(hill_n / hill_K * (s1 / hill_K) ** (hill_n - 1))
+            d = x_ext[self._hill_d]
+            numerator = np.where(self._hill_positive, ratio, 1.0)
+            sign = np.where(self._hill_positive, 1.0, -1.0)
+            rows += [self._hill_channels, self._hill_channels]
+            cols += [self._hill_s1, self._hill_d]
+            vals += [hill_k * d * sign * dratio / (1 + ratio)**2, hill_k * numerator / (1 + ratio)]
+
+        h = 1e-6 * np.maximum(np.abs(x), 1)
+        v_plus, v_minus = np.zeros(self.n_reaction_channels), np.zeros(self.n_reaction_channels)
+        for species, channels, entry_species in self._numerical_groups:
+            dx = np.zeros_like(x)
+            dx[species] = h[species]
+            self._numerical_propensities(v_plus, x + dx, stochastic, parameters)
+            self._numerical_propensities(v_minus, x - dx, stochastic, parameters)
+            rows.append(channels)
+            cols.append(entry_species)
+            vals.append((v_plus[channels] - v_minus[channels]) / (2 * h[entry_species]))
+
+        rows.append(np.arange(self.n_reaction_channels, self.n_channels))
+        cols.append(self._sink_species)
+        vals.append(sink_rates)
+
+        rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+        # the column n_species is the constant 1 of x_ext (e.g. Hill channels without d)
+        inside = cols < self.n_species
+        return scipy.sparse.csr_matrix((vals[inside], (rows[inside], cols[inside])), shape=(self.n_channels, self.n_species))
+
+    def jacobian(self, x, stochastic: bool = False, parameters=None):
+        """The Jacobian d(species_rates)/dx, of shape (..., n_species, n_species)."""
+        return np.matmul(self.stoichiometric_matrix.toarray(), self.propensity_jacobian(x, stochastic, parameters))
+
+    def sparse_jacobian(self, x, stochastic: bool = False, parameters=None):
+        """The Jacobian d(species_rates)/dx of a single state (n_species,), as a scipy.sparse.csr_matrix
+        (see sparse_propensity_jacobian)."""
+        return (self.stoichiometric_matrix @ self.sparse_propensity_jacobian(x, stochastic, parameters)).tocsr()
+
+    def species_rates(self, x, stochastic: bool = False, parameters=None):
+        """Returns dx/dt = S v(x) for states of shape (n_species,) or (..., n_species).
+
+        First order sinks are added as the vector term -sink_rate_vector * x.
+
+        :param parameters: parameter vectors of shape (..., n_parameters), broadcast against the states
+                           (default: self.parameters)
+        """
+        x = np.asarray(x, dtype=float)
+        rates = self._get_rates(parameters)
+        v = self._reaction_propensities(x, stochastic, rates)
+        if v.ndim == 1:
+            dx = self._reaction_stoichiometry.dot(v)
+        else:
+            flat = v.reshape(-1, self.n_reaction_channels)
+            dx = (self._reaction_stoichiometry.dot(flat.T)).T.reshape(v.shape[:-1] + (self.n_species,))
+        if len(self._sink_species) > 0:
+            dx = dx - rates[5] * x
+        return dx
+
+    def rhs(self, t, x):
+        """The deterministic right hand side f(t, x), in the form used by scipy.integrate."""
+        return self.species_rates(x)
+
+    def format_result(self, timepoints, states, return_dataframe: bool = True):
+        """Formats a (time x species) trajectory as a pandas DataFrame or a dictionary of arrays.
+
+        Columns are named by repr(species) with an extra "time" column.
+        """
+        result = {"time": np.asarray(timepoints)}
+        for i, s in enumerate(self.species):
+            result[repr(s)] = states[:, i]
+
+        if return_dataframe:
+            try:
+                import pandas
+                return pandas.DataFrame(result)
+            except ModuleNotFoundError:
+                warn("pandas was not found, returning a dictionary of arrays instead of a DataFrame.")
+        return result
+
+
+class ConservationLawReduction(object):
+    """Eliminates the dependent species of the conservation laws of a CompiledCRN.
+
+    For every conservation law sum_i L_i x_i = T, one dependent species is removed
+    from the state. The reduced state y holds the independent species only and the
+    full state is reconstructed as x_dep = (T - sum_{i independent} L_i x_i) / L_dep.
+    The reduced Jacobian is non-singular in the conserved directions, which helps
+    implicit ODE solvers.
+    """
+    def __init__(self, compiled_crn: CompiledCRN, x0):
+        self.compiled_crn = compiled_crn
+        n = compiled_crn.n_species
+        basis = compiled_crn.crn._conservation_law_basis()
+
+        self.conservation_laws = [law for _, law in basis]
+        self.dependent = np.array([dependent for dependent, _ in basis], dtype=int)
+        dependent_set = set(self.dependent.tolist())
+        self.independent = np.array([i for i in range(n) if i not in dependent_set], dtype=int)
+
+        position = {i: p for p, i in enumerate(self.independent.tolist())}
+        rows, cols, vals = [], [], []
+        self._dependent_coefficients = np.ones(len(basis))
+        for k, (dependent, law) in enumerate(basis):
+            self._dependent_coefficients[k] = law[dependent]
+            for i, coefficient in law.items():
+                if i != dependent:
+                    rows.append(k)
+                    cols.append(position[i])
+                    vals.append(coefficient)
+        self._law_matrix = scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(len(basis), len(self.independent)), dtype=float)
+        # dx_dep/dy (n_dependent x n_reduced)
+        self._dependent_derivatives = (-scipy.sparse.diags(1 / self._dependent_coefficients) @ self._law_matrix).tocsr()
+
+        self.totals = self.conserved_totals(x0)
+
+    @property
+    def n_reduced(self) -> int:
+        return len(self.independent)
+
+    def conserved_totals(self, x):
+        """Returns the value of every conservation law for a full state x of shape (n_species,)."""
+        x = np.asarray(x, dtype=float)
+        return self._law_matrix.dot(x[self.independent]) + self._dependent_coefficients * x[self.dependent]
+
+    def reduce(self, x):
+        """Projects full states (..., n_species) onto the independent species."""
+        return np.asarray(x)[..., self.independent]
+
+    def reconstruct(self, y):
+        """Rebuilds full states (..., n_species) from reduced states (..., n_reduced)."""
+        y = np.asarray(y, dtype=float)
+        x = np.empty(y.shape[:-1] + (self.compiled_crn.n_species,))
+        x[..., self.independent] = y
+        if len(self.dependent) > 0:
+            flat = y.reshape(-1, self.n_reduced)
+            dependent = (self.totals - self._law_matrix.dot(flat.T).T) / self._dependent_coefficients
+            x[..., self.dependent] = dependent.reshape(y.shape[:-1] + (len(self.dependent),))
+        return x
+
+    def rhs(self, t, y):
+        """The reduced deterministic right hand side, in the form used by scipy.integrate."""
+        return self.compiled_crn.species_rates(self.reconstruct(y))[..., self.independent]
+
+    def jacobian(self, y, parameters=None, sparse: bool = False):
+        """The Jacobian of the reduced right hand side, of shape (..., n_reduced, n_reduced).
+
+        The dependent species are affine in y: dx_dep/dy = -L_indep / L_dep for every conservation law.
+
+        :param sparse: return a scipy.sparse.csr_matrix for a single reduced state (see CompiledCRN.sparse_jacobian)
+        """
+        if sparse:
+            J_independent = self.compiled_crn.sparse_jacobian(self.reconstruct(y), parameters=parameters)[self.independent]
+            reduced = J_independent[:, self.independent]
+            if len(self.dependent) > 0:
+                reduced = reduced + J_independent[:, self.dependent] @ self._dependent_derivatives
+            return reduced.tocsr()
+
+        J = self.compiled_crn.jacobian(self.reconstruct(y), parameters=parameters)
+        J_independent = J[..., self.independent, :]
+        reduced = J_independent[..., self.independent]
+        if len(self.dependent) > 0:
+            reduced = reduced + np.matmul(J_independent[..., self.dependent], self._dependent_derivatives.toarray())
+        return reduced
@@ -9,7 +9,7 @@ from warnings import warn
 
 from .global_mechanism import GlobalMechanism
 from .mechanism import Mechanism
-from .parameter import Parameter, ParameterDatabase
+from .parameter import Parameter, ParameterDatabase, ParameterKey
 from .species import Species
 
 
@@ -309,7 +309,7 @@ class Component(object):
             elif self.mixture is not None and (self.mixture.name, self.name) in self.initial_condition_dictionary:
                 return self.initial_condition_dictionary[(self.mixture.name, self.name)]
             elif self.name in self.initial_condition_dictionary:
-                return self.initial_condition_dictionary[(self.mixture.name, self.name)]
+                return self.initial_condition_dictionary[self.name]
         # Then try above in self.parameter_database
         elif self.mixture is not None and self.parameter_database.find_parameter(None, self.mixture.name, repr(s)) is not None:
             return self.parameter_database.find_parameter(None, self.mixture.name, repr(s)).value
@@ -323,5 +323,46 @@ class Component(object):
         else:
             return None
 
+    def get_initial_conditions(self, species_list: List[Species]) -> List:
+        """Batched version of get_initial_condition with the same parameter hierarchy.
+
+        repr(s) is computed once per species, self.get_species() once per call, and the
+        parameter database is indexed directly instead of going through find_parameter.
+
+        :param species_list: list of Species
+        :return: list of initial conditions (None where no initial condition was found)
+        """
+        initial_conditions = self.initial_condition_dictionary
+        parameters = self.parameter_database.parameters
+        mixture_name = self.mixture.name if self.mixture is not None else None
+        component_species = self.get_species()
+
+        # 3-5: the initial condition of self.get_species() does not depend on s
+        if self.initial_concentration is not None:
+            component_value = self.initial_concentration
+        elif self.mixture is not None and (mixture_name, self.name) in initial_conditions:
+            component_value = initial_conditions[(mixture_name, self.name)]
+        elif self.name in initial_conditions:
+            component_value = initial_conditions[self.name]
+        else:
+            component_value = None
+
+        values = []
+        for s in species_list:
+            key = repr(s)
+            if self.mixture is not None and (mixture_name, key) in initial_conditions:
+                values.append(initial_conditions[(mixture_name, key)])
+            elif key in initial_conditions:
+                values.append(initial_conditions[key])
+            elif s == component_species:
+                values.append(component_value)
+            elif self.mixture is not None and ParameterKey(None, mixture_name, key) in parameters:
+                values.append(parameters[ParameterKey(None, mixture_name, key)].value)
+            elif ParameterKey(None, None, key) in parameters:
+                values.append(parameters[ParameterKey(None, None, key)].value)
+            else:
+                values.append(None)
+        return values
+
     def __repr__(self):
         return type(self).__name__ + ": " + self.name
@@ -2,11 +2,12 @@
 #  Copyright (c) 2020, Build-A-Cell. All rights reserved.
 #  See LICENSE file in the project root directory for details.
 
-from typing import Dict, List
+from typing import Dict, List, Tuple, Union
 from warnings import warn
 
 from .mechanism import Mechanism
 from .mechanisms_enzyme import MichaelisMenten
+from .parameter import Parameter
 from .reaction import Reaction
 from .species import ComplexSpecies, OrderedPolymerSpecies, Species
 
@@ -35,6 +36,43 @@ may have to be carefully user defined in the subclasses of Mixture in order to e
 """
 
 
+class _FilterDict(dict):
+    """The filter_dict of a GlobalMechanism, counting its modifications in version."""
+    version = 0
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.version += 1
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        dict.clear(self)
+        self.version += 1
+
+    def pop(self, *args):
+        self.version += 1
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.version += 1
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        self.version += 1
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.version += 1
+
+
 class GlobalMechanism(Mechanism):
     """Global mechanisms are a lot like mechanisms. They are called only by mixtures
     on a list of all species have been generated by components. Global mechanisms
@@ -77,55 +115,114 @@ class GlobalMechanism(Mechanism):
         If True: the filter based upon all subspecies.type and name recursively going through
         all ComplexSpecies. If False: the filter dict will act only on the ComplexSpecies. By default, this is False.
         """
-        if filter_dict is None:
-            self.filter_dict = {}
-        else:
-            self.filter_dict = filter_dict
-
+        self.filter_dict = filter_dict
         self.default_on = default_on
         self.recursive_species_filtering = recursive_species_filtering
         Mechanism.__init__(self, name=name, mechanism_type=mechanism_type)
 
+    @property
+    def filter_dict(self) -> Dict:
+        return self._filter_dict
+
+    @filter_dict.setter
+    def filter_dict(self, filter_dict: Dict):
+        # a copy which counts its modifications, so the filter caches are checked without comparing dictionaries
+        self._filter_dict = _FilterDict({} if filter_dict is None else filter_dict)
+        self._filter_settings = None
+
     def apply_filter(self, s: Species):
         """applies the filter dictionary to determine if a global mechanism acts on a species.
 
         :param s: Species
         :return:
         """
+        self._check_filter_cache()
+        return self._filter_decision(s)
+
+    def filter_species(self, species_list: List[Species]) -> List[Species]:
+        """Returns the species in species_list the GlobalMechanism acts on.
+
+        Decisions are cached per Species and per (material_type, attributes, name) of
+        each subspecies, so the filter_dict is not matched again for species seen in
+        previous calls (e.g. previous calls to Mixture.compile_crn). The mechanism itself
+        (update_species, update_reactions, ...) still acts on every selected species.
+        The caches are reset whenever filter_dict, default_on or recursive_species_filtering change.
+
+        :param species_list: list of Species
+        :return: list of Species
+        """
+        self._check_filter_cache()
+        return [s for s in species_list if self._filter_decision(s)]
+
+    def _check_filter_cache(self):
+        """Resets the cached filter decisions if the filter settings have changed."""
+        settings = (self._filter_dict.version, self.default_on, self.recursive_species_filtering)
+        if self._filter_settings != settings:
+            self._filter_settings = settings
+            # (material_type, attributes, name) -> set of filter_dict values which match it
+            self._filter_table = {}
+            # Species -> bool
+            self._filter_decisions = {}
+
+    def _filter_decision(self, s: Species) -> bool:
+        if s in self._filter_decisions:
+            return self._filter_decisions[s]
+
         fd = self.filter_dict
-        use_mechanism = None
-        species_list = s.get_species(recursive=self.recursive_species_filtering)
-        for subs in species_list:
-            for a in subs.attributes+[subs.material_type, subs.name]:
-                if a in fd:
-                    if use_mechanism is None:
-                        use_mechanism = fd[a]
-                    elif use_mechanism != fd[a]:
-                        warn(f"species {repr(s)} has multiple attributes(or material type) which conflict with global mechanism filter {repr(self)}. Using default value {self.default_on}.")
-                        use_mechanism = self.default_on
-
-        if use_mechanism is None:
+        matched = set()
+        for subs in s.get_species(recursive=self.recursive_species_filtering):
+            key = (subs.material_type, tuple(subs.attributes), subs.name)
+            if key not in self._filter_table:
+                self._filter_table[key] = frozenset(fd[a] for a in subs.attributes+[subs.material_type, subs.name] if a in fd)
+            matched |= self._filter_table[key]
+
+        if len(matched) == 1:
+            use_mechanism = matched.pop()
+        else:
+            if len(matched) > 1:
+                warn(f"species {repr(s)} has multiple attributes(or material type) which conflict with global mechanism filter {repr(self)}. Using default value {self.default_on}.")
             use_mechanism = self.default_on
+
+        self._filter_decisions[s] = use_mechanism
         return use_mechanism
 
     def update_species_global(self, species_list: List[Species], mixture):
         new_species = []
-        for s in species_list:
-            use_mechanism = self.apply_filter(s)
-            if use_mechanism:
-                new_species += self.update_species(s, mixture)
+        for s in self.filter_species(species_list):
+            new_species += self.update_species(s, mixture)
         return new_species
 
     def update_reactions_global(self, species_list: List[Species], mixture):
-        fd = self.filter_dict
         new_reactions = []
-        for s in species_list:
-            use_mechanism = self.apply_filter(s)
-            if use_mechanism:
-                new_reactions += self.update_reactions(s, mixture)
+        for s in self.filter_species(species_list):
+            new_reactions += self.update_reactions(s, mixture)
 
         return new_reactions
 
+    def apply_global(self, species_list: List[Species], mixture) -> Tuple[List[Species], List[Reaction], List[Tuple[Species, Union[float, Parameter]]]]:
+        """Filters species_list once and returns the species, reactions and first order sinks produced by the GlobalMechanism.
+
+        Equivalent to (update_species_global(...), update_reactions_global(...), update_first_order_sinks_global(...)).
+        """
+        selected = self.filter_species(species_list)
+        new_species = []
+        new_reactions = []
+        new_sinks = []
+        for s in selected:
+            new_species += self.update_species(s, mixture)
+        for s in selected:
+            new_reactions += self.update_reactions(s, mixture)
+        for s in selected:
+            new_sinks += self.update_first_order_sinks(s, mixture)
+        return new_species, new_reactions, new_sinks
+
+    def update_first_order_sinks_global(self, species_list: List[Species], mixture) -> List[Tuple[Species, Union[float, Parameter]]]:
+        """Returns the first order sinks produced by the GlobalMechanism for the filtered species_list."""
+        new_sinks = []
+        for s in self.filter_species(species_list):
+            new_sinks += self.update_first_order_sinks(s, mixture)
+        return new_sinks
+
     def get_parameter(self, species, param_name, mixture):
         param = mixture.get_parameter(mechanism = self, part_id = repr(species), param_name = param_name)
         if param is None:
@@ -153,13 +250,30 @@ class GlobalMechanism(Mechanism):
         """
         return []
 
+    def update_first_order_sinks(self, s, mixture):
+        """Global mechanisms may return first order sinks S --> 0 instead of Reactions.
+
+        The sinks are added to ChemicalReactionNetwork.first_order_sinks.
+
+        :param s: Species instance
+        :param mixture:
+        :return: list of (Species, rate) tuples
+        """
+        return []
+
 
 class Dilution(GlobalMechanism):
-    """A global mechanism to represent dilution."""
+    """A global mechanism to represent dilution.
+
+    By default every diluted species gets a reaction S --> 0. If aggregate = True,
+    dilution is added to ChemicalReactionNetwork.first_order_sinks instead, which
+    simulators evaluate as a single vector term.
+    """
 
     def __init__(self, name = "global_degredation_via_dilution",
                  mechanism_type = "dilution", filter_dict=None,
-                 default_on = True, recursive_species_filtering = True):
+                 default_on = True, recursive_species_filtering = True, aggregate = False):
+        self.aggregate = aggregate
         GlobalMechanism.__init__(self, name = name,
                                  mechanism_type = mechanism_type,
                                  default_on = default_on,
@@ -167,10 +281,18 @@ class Dilution(GlobalMechanism):
                                  recursive_species_filtering = recursive_species_filtering)
 
     def update_reactions(self, s: Species, mixture):
+        if self.aggregate:
+            return []
         k_dil = self.get_parameter(s, "kdil", mixture)
         rxn = Reaction.from_massaction(inputs=[s], outputs=[], k_forward=k_dil)
         return [rxn]
 
+    def update_first_order_sinks(self, s: Species, mixture):
+        if not self.aggregate:
+            return []
+        k_dil = self.get_parameter(s, "kdil", mixture)
+        return [(s, k_dil)]
+
 
 class AnitDilutionConstiutiveCreation(GlobalMechanism):
     """Global Mechanism to Constitutively Create Certain Species at the rate of dilution.
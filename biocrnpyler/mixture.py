@@ -10,7 +10,7 @@ from .chemical_reaction_network import ChemicalReactionNetwork
 from .component import Component
 from .global_mechanism import GlobalMechanism
 from .mechanism import Mechanism
-from .parameter import ParameterDatabase
+from .parameter import ParameterDatabase, ParameterKey
 from .reaction import Reaction
 from .species import Species
 
@@ -339,10 +339,10 @@ class Mixture(object):
                 init_conc = self.initial_condition_dictionary[repr(s)]
             #4
             elif component is not None and component.get_species() == s and (self.name, component.name) in self.initial_condition_dictionary:
-                return self.initial_condition_dictionary[(self.name, component.name)]
+                init_conc = self.initial_condition_dictionary[(self.name, component.name)]
             #5
             elif component is not None and component.get_species() == s and component.name in self.initial_condition_dictionary:
-                return self.initial_condition_dictionary[component.name]
+                init_conc = self.initial_condition_dictionary[component.name]
             #6
             elif self.parameter_database.find_parameter(None, self.name, repr(s)) is not None:
                 init_conc = self.parameter_database.find_parameter(None, self.name, repr(s)).value
@@ -351,16 +351,81 @@ class Mixture(object):
                 init_conc = self.parameter_database.find_parameter(None, None, repr(s)).value
             #8
             elif component is not None and component.get_species() == s and (None, self.name, component.name) in self.parameter_database:
-                return self.parameter_database.find_parameter(None, self.name, component.name).value
+                init_conc = self.parameter_database.find_parameter(None, self.name, component.name).value
             #9
             elif component is not None and component.get_species() == s and component.name in self.parameter_database:
-                return self.parameter_database.find_parameter(None, None, component.name).value
+                init_conc = self.parameter_database.find_parameter(None, None, component.name).value
             #10
             else:
                 init_conc = 0
 
         s.initial_concentration = init_conc
 
+    def set_initial_conditions(self, species_list: List[Species], component=None):
+        """Batched version of set_initial_condition with the same parameter hierarchy.
+
+        The component lookups are done once for the whole list (Component.get_initial_conditions),
+        repr(s) is computed once per species and the parameter database is indexed directly.
+
+        :param species_list: list of Species
+        :param component: the Component the species came from (or None)
+        """
+        for s in species_list:
+            if not isinstance(s, Species):
+                raise ValueError(f"{s} is not a Species! Can only set initial concentration of a Species.")
+
+        #1
+        if component is not None:
+            component_values = component.get_initial_conditions(species_list)
+            component_species = component.get_species()
+        else:
+            component_values = [None]*len(species_list)
+            component_species = None
+
+        initial_conditions = self.initial_condition_dictionary
+        parameters = self.parameter_database.parameters
+
+        #4-5 and 8-9 only depend on the component: (found, value)
+        name_condition = (False, None)
+        name_parameter = (False, None)
+        if component is not None:
+            if (self.name, component.name) in initial_conditions:
+                name_condition = (True, initial_conditions[(self.name, component.name)])
+            elif component.name in initial_conditions:
+                name_condition = (True, initial_conditions[component.name])
+            if ParameterKey(None, self.name, component.name) in parameters:
+                name_parameter = (True, parameters[ParameterKey(None, self.name, component.name)].value)
+            elif ParameterKey(None, None, component.name) in parameters:
+                name_parameter = (True, parameters[ParameterKey(None, None, component.name)].value)
+
+        for s, init_conc in zip(species_list, component_values):
+            if init_conc is None:
+                key = repr(s)
+                is_component_species = component is not None and component_species == s
+                #2
+                if (self.name, key) in initial_conditions:
+                    init_conc = initial_conditions[(self.name, key)]
+                #3
+                elif key in initial_conditions:
+                    init_conc = initial_conditions[key]
+                #4-5
+                elif is_component_species and name_condition[0]:
+                    init_conc = name_condition[1]
+                #6
+                elif ParameterKey(None, self.name, key) in parameters:
+                    init_conc = parameters[ParameterKey(None, self.name, key)].value
+                #7
+                elif ParameterKey(None, None, key) in parameters:
+                    init_conc = parameters[ParameterKey(None, None, key)].value
+                #8-9
+                elif is_component_species and name_parameter[0]:
+                    init_conc = name_parameter[1]
+                #10
+                else:
+                    init_conc = 0
+
+            s.initial_concentration = init_conc
+
     def add_species_to_crn(self, new_species, component):
 
         if self.crn is None:
@@ -369,34 +434,41 @@ class Mixture(object):
         if isinstance(new_species, Species):
             new_species = [new_species]
 
+        species_list = []
         for s in new_species:
             if isinstance(s, Species):
-                self.set_initial_condition(s, component)
-                self.crn.add_species(s)
+                species_list.append(s)
             elif isinstance(s, list) and(all(isinstance(ss, Species) for ss in s) or len(s) == 0):
-                for ss in s: 
-                    self.set_initial_condition(ss, component)
-                self.crn.add_species(s)
+                species_list.extend(s)
             elif s is not None:
                 raise ValueError(f"Invalid Species Returned in {component}.update_species(): {s}.")
 
+        self.set_initial_conditions(species_list, component)
+        self.crn.add_species(species_list)
+
     def apply_global_mechanisms(self, species) -> (List[Species], List[Reaction]):
         # update with global mechanisms
 
         global_mech_species = []
         global_mech_reactions = []
+        global_mech_sinks = []
         if self.global_mechanisms:
             for mech in self.global_mechanisms:
-                # Update Global Mechanisms
-                global_mech_species += self.global_mechanisms[mech].update_species_global(species, self)
-                global_mech_reactions += self.global_mechanisms[mech].update_reactions_global(species, self)
+                # Update Global Mechanisms. Each species is filtered once per mechanism.
+                new_species, new_reactions, new_sinks = self.global_mechanisms[mech].apply_global(species, self)
+                global_mech_species += new_species
+                global_mech_reactions += new_reactions
+                global_mech_sinks += new_sinks
 
         self.add_species_to_crn(global_mech_species, component = None)
-        self.crn.add_reactions(global_mech_reactions)
+        self.crn.add_reactions_bulk(global_mech_reactions)
+        self.crn.add_first_order_sinks(global_mech_sinks)
 
-    def compile_crn(self) -> ChemicalReactionNetwork:
+    def compile_crn(self, prune_unreachable = False) -> ChemicalReactionNetwork:
         """Creates a chemical reaction network from the species and reactions associated with a mixture object.
 
+        :param prune_unreachable: if True, species and reactions which can never be produced or fire given
+                                  the initial conditions are removed (see ChemicalReactionNetwork.prune_unreachable)
         :return: ChemicalReactionNetwork
         """
         resetwarnings()#Reset warnings - better to toggle them off manually.
@@ -417,12 +489,15 @@ class Mixture(object):
 
         #Append Reactions from each Component
         for component in self.components:
-            self.crn.add_reactions(component.update_reactions())
+            self.crn.add_reactions_bulk(component.update_reactions())
 
         #global mechanisms are applied last and only to all the species
         #the reactions and species are added to the CRN
         self.apply_global_mechanisms(self.crn.species)
 
+        if prune_unreachable:
+            self.crn.prune_unreachable()
+
         return self.crn
 
     def __str__(self):
@@ -22,10 +22,12 @@ class ExpressionDilutionMixture(Mixture):
     Here transcription and Translation are lumped into one reaction: expression.
     A global mechanism is used to dilute all non-dna species
     """
-    def __init__(self, name="", **kwargs):
+    def __init__(self, name="", aggregate_dilution=False, **kwargs):
         """Initializes an ExpressionDilutionMixture instance.
 
         :param name: name of the mixture
+        :param aggregate_dilution: if True, dilution is compiled into ChemicalReactionNetwork.first_order_sinks
+                                   instead of one reaction per species
         :param kwargs: keywords passed into the parent Class (Mixture)
         """
         Mixture.__init__(self, name=name, **kwargs)
@@ -45,15 +47,16 @@ class ExpressionDilutionMixture(Mixture):
         self.add_mechanisms(default_mechanisms)
 
         # Create global mechanism for dilution
-        dilution_mechanism = Dilution(name="dilution", filter_dict={"dna": False}, default_on=True)
+        dilution_mechanism = Dilution(name="dilution", filter_dict={"dna": False}, default_on=True, aggregate=aggregate_dilution)
         global_mechanisms = {"dilution": dilution_mechanism}
         self.add_mechanisms(global_mechanisms)
 
-    def compile_crn(self) -> ChemicalReactionNetwork:
+    def compile_crn(self, **keywords) -> ChemicalReactionNetwork:
         """Overwriting compile_crn to replace transcripts with proteins for all DNA_assemblies.
 
         Overwriting compile_crn to turn off transcription in all DNAassemblies
 
+        :param keywords: passed into Mixture.compile_crn
         :return: compiled CRN instance
         """
         for component in self.components:
@@ -66,7 +69,7 @@ class ExpressionDilutionMixture(Mixture):
                     component.update_transcript(False)
 
         # Call the superclass function
-        return Mixture.compile_crn(self)
+        return Mixture.compile_crn(self, **keywords)
 
 class SimpleTxTlDilutionMixture(Mixture):
     """Mixture with continuous dilution for non-DNA species.
@@ -74,10 +77,12 @@ class SimpleTxTlDilutionMixture(Mixture):
     Transcription and Translation are both modeled as catalytic with no cellular machinery.
     mRNA is also degraded via a separate reaction to represent endonucleases
     """
-    def __init__(self, name="", **keywords):
+    def __init__(self, name="", aggregate_dilution=False, **keywords):
         """Initializes a SimpleTxTlDilutionMixture instance.
 
         :param name: name of the mixture
+        :param aggregate_dilution: if True, dilution and mRNA degradation are compiled into
+                                   ChemicalReactionNetwork.first_order_sinks instead of one reaction per species
         :param kwargs: keywords passed into the parent Class (Mixture)
         """
         # Always call the superclass __init__ with **keywords
@@ -101,8 +106,8 @@ class SimpleTxTlDilutionMixture(Mixture):
         # By Default Species are diluted S-->0 Unless:
         # They are of type 'dna'
         # They have the attribute 'machinery'
-        dilution_mechanism = Dilution(filter_dict={"dna": False}, default_on=True)
-        deg_mrna = Dilution(name="rna_degredation", filter_dict={"rna": True}, default_on=False)
+        dilution_mechanism = Dilution(filter_dict={"dna": False}, default_on=True, aggregate=aggregate_dilution)
+        deg_mrna = Dilution(name="rna_degredation", filter_dict={"rna": True}, default_on=False, aggregate=aggregate_dilution)
 
         global_mechanisms = {"dilution": dilution_mechanism, "rna_degredation": deg_mrna}
         self.add_mechanisms(global_mechanisms)
@@ -116,13 +121,15 @@ class TxTlDilutionMixture(Mixture):
     Unlike TxTlExtract, has global dilution for non-DNA and non-Machinery
     This model does not include any energy
     """
-    def __init__(self, name="", rnap="RNAP", ribosome="Ribo", rnaase="RNAase", **kwargs):
+    def __init__(self, name="", rnap="RNAP", ribosome="Ribo", rnaase="RNAase", aggregate_dilution=False, **kwargs):
         """Initializes a TxTlDilutionMixture instance.
 
         :param name: name of the mixture
         :param rnap: name of the RNA polymerase, default: RNAP
         :param ribosome: name of the ribosome, default: Ribo
         :param rnaase: name of the Ribonuclease, default: RNAase
+        :param aggregate_dilution: if True, dilution is compiled into ChemicalReactionNetwork.first_order_sinks
+                                   instead of one reaction per species
         :param kwargs: keywords passed into the parent Class (Mixture)
         """
         Mixture.__init__(self, name=name, **kwargs)
@@ -160,7 +167,7 @@ class TxTlDilutionMixture(Mixture):
         mech_bind = One_Step_Binding()
 
         #Create Global Dilution Mechanisms
-        dilution_mechanism = Dilution(filter_dict = {"dna":False, "machinery":False}, default_on = True)
+        dilution_mechanism = Dilution(filter_dict = {"dna":False, "machinery":False}, default_on = True, aggregate = aggregate_dilution)
         mech_rna_deg = Degredation_mRNA_MM(nuclease = self.rnaase.get_species())
 
         default_mechanisms = {
@@ -44,9 +44,10 @@ class ExpressionExtract(Mixture):
 
         self.add_mechanisms(default_mechanisms)
 
-    def compile_crn(self) -> ChemicalReactionNetwork:
+    def compile_crn(self, **keywords) -> ChemicalReactionNetwork:
         """Overwriting compile_crn to turn off transcription in all DNAassemblies
 
+        :param keywords: passed into Mixture.compile_crn
         :return: compiled CRN instance
         """
         for component in self.components:
@@ -59,7 +60,7 @@ class ExpressionExtract(Mixture):
                     component.update_transcript(False)
 
         # Call the superclass function
-        return Mixture.compile_crn(self)
+        return Mixture.compile_crn(self, **keywords)
 
 
 class SimpleTxTlExtract(Mixture):
@@ -47,6 +47,7 @@ The initial condition of any Species (or Component) will also be looked up as a
     # Then defaults to 0
 """
 
+import copy
 import csv
 import numbers
 import re
@@ -540,3 +541,168 @@ class ParameterDatabase(object):
             return_param = ModelParameter(found_entry.parameter_name,found_entry.value, (mech_name, part_id, param_name), found_key,
                 parameter_key = found_entry.parameter_key, parameter_info = found_entry.parameter_info)
             return return_param
+
+
+class ParameterTable(object):
+    """A deduplicated table of the numerical parameters of a list of reactions and first order sinks.
+
+    Every ParameterEntry is stored in one slot per global name parameter_name_partid_mechanism
+    (the name of the global parameter in SBML), shared by all reactions using it.
+    Numbers are local to a reaction (or sink) and get a slot of their own, named
+    parameter_name_r<reaction index> (or k_sink_<species>_<i>).
+
+    names[slot], values[slot], is_global[slot]: the slots
+    reaction_slots[j]: {parameter name in the propensity_dict of reactions[j]: slot}
+    sink_slots[species]: [slot of each first order sink rate of species]
+    references[slot]: [("reaction", j, parameter name) or ("sink", species, i)] using the slot
+
+    Use ChemicalReactionNetwork.get_parameter_table() to get the table of a CRN.
+    """
+    def __init__(self, reactions: List, first_order_sinks: Dict = None):
+        self.reactions = list(reactions)
+        self.first_order_sinks = {} if first_order_sinks is None else first_order_sinks
+        self._sink_lists = [(s, rates, len(rates)) for s, rates in self.first_order_sinks.items()]
+        # reactions and sink Parameters copied by set_values
+        self._owned_reactions = set()
+        self._owned_sinks = set()
+
+        self.names = []
+        self.values = []
+        self.is_global = []
+        self.references = []
+        self._slot_by_name = {}
+        self._slot_by_key = {}
+
+        self.reaction_slots = []
+        for j, r in enumerate(self.reactions):
+            slots = {}
+            for name, p in r.propensity_type.propensity_dict['parameters'].items():
+                if p is not None:
+                    slots[name] = self._add(p, f"{name}_r{j}", ("reaction", j, name))
+            self.reaction_slots.append(slots)
+
+        self.sink_slots = {}
+        for s, rates in self.first_order_sinks.items():
+            self.sink_slots[s] = [self._add(k, f"k_sink_{s}_{i}", ("sink", s, i)) for i, k in enumerate(rates)]
+
+    @staticmethod
+    def global_name(p: ParameterEntry) -> str:
+        """The name of the global parameter of p in SBML."""
+        part_id = "" if p.parameter_key.part_id is None else p.parameter_key.part_id
+        mechanism = "" if p.parameter_key.mechanism is None else p.parameter_key.mechanism
+        return p.parameter_name+"_"+part_id+"_"+mechanism
+
+    def _add(self, p, local_name: str, reference) -> int:
+        if isinstance(p, ParameterEntry):
+            name = self.global_name(p)
+            if name in self._slot_by_name:
+                # the first value is used, as in SBML export
+                slot = self._slot_by_name[name]
+                self.references[slot].append(reference)
+                return slot
+        elif isinstance(p, numbers.Real):
+            name = local_name
+        else:
+            raise TypeError(f"Invalid parameter {p}. Only numbers or ParameterEntries accepted.")
+
+        slot = len(self.names)
+        self.names.append(name)
+        self.values.append(float(p.value if isinstance(p, Parameter) else p))
+        self.is_global.append(isinstance(p, ParameterEntry))
+        self.references.append([reference])
+        self._slot_by_name[name] = slot
+        if isinstance(p, ParameterEntry):
+            self._slot_by_key.setdefault(p.parameter_key, slot)
+        return slot
+
+    def __len__(self):
+        return len(self.names)
+
+    def is_valid_for(self, reactions: List, first_order_sinks: Dict) -> bool:
+        """The table stays valid as long as the same Reaction objects and sink lists are used."""
+        sinks = list(first_order_sinks.items())
+        return len(reactions) == len(self.reactions) and all(r is s for r, s in zip(reactions, self.reactions)) \
+            and first_order_sinks is self.first_order_sinks and len(sinks) == len(self._sink_lists) \
+            and all(s is s0 and rates is rates0 and len(rates) == n0 for (s, rates), (s0, rates0, n0) in zip(sinks, self._sink_lists))
+
+    def slot(self, key) -> int:
+        """Finds the slot of a parameter by slot number, name, or ParameterKey (mechanism, part_id, name)."""
+        if isinstance(key, numbers.Integral):
+            if not 0 <= key < len(self.names):
+                raise ValueError(f"Parameter slot {key} is out of range for a table of {len(self.names)} parameters.")
+            return int(key)
+        elif isinstance(key, str) and key in self._slot_by_name:
+            return self._slot_by_name[key]
+        elif isinstance(key, tuple) and len(key) == len(ParameterKey._fields) and ParameterKey(*key) in self._slot_by_key:
+            return self._slot_by_key[ParameterKey(*key)]
+        raise ValueError(f"Parameter {key} is not part of the parameter table.")
+
+    def vector(self) -> List[float]:
+        return list(self.values)
+
+    def resolve(self, parameters, values: List[float] = None) -> List[float]:
+        """Returns the parameter vector after applying parameters to values.
+
+        :param parameters: a full vector of values, or a dictionary {slot, name or ParameterKey: value}
+        :param values: the current parameter vector (default: the values of the table)
+        """
+        if isinstance(parameters, dict):
+            values = list(self.values if values is None else values)
+            for key, value in parameters.items():
+                values[self.slot(key)] = float(value)
+        else:
+            values = [float(v) for v in parameters]
+            if len(values) != len(self.names):
+                raise ValueError(f"Expected {len(self.names)} parameter values, received {len(values)}.")
+        return values
+
+    def set_values(self, parameters, reactions: List = None) -> None:
+        """Sets parameter values and writes them into the propensities and first order sinks which use them.
+
+        Reactions, propensities and Parameters can be shared with other CRNs (e.g. replace_species with
+        share_structure=True), so they are copied before the first write. ParameterEntries keep their
+        names and get the new value.
+
+        :param parameters: a full vector of values, or a dictionary {slot, name or ParameterKey: value}
+        :param reactions: the reaction list the table was built from, which receives the copied reactions
+        """
+        values = self.resolve(parameters)
+        for slot, value in enumerate(values):
+            if value == self.values[slot]:
+                continue
+            self.values[slot] = value
+            for reference in self.references[slot]:
+                if reference[0] == "reaction":
+                    _, j, name = reference
+                    propensity = self._own_reaction(j, reactions).propensity_type
+                    p = propensity.propensity_dict['parameters'][name]
+                    if isinstance(p, Parameter):
+                        p.value = value
+                    elif isinstance(getattr(type(propensity), name, None), property):
+                        setattr(propensity, name, value)
+                    else:
+                        propensity.propensity_dict['parameters'][name] = value
+                else:
+                    _, s, i = reference
+                    rates = self.first_order_sinks[s]
+                    if isinstance(rates[i], Parameter):
+                        if (s, i) not in self._owned_sinks:
+                            rates[i] = copy.copy(rates[i])
+                            self._owned_sinks.add((s, i))
+                        rates[i].value = value
+                    else:
+                        rates[i] = value
+
+    def _own_reaction(self, j: int, reactions: List = None):
+        """Replaces reactions[j] by a copy with its own propensity and Parameters, once per table."""
+        if j not in self._owned_reactions:
+            reaction = copy.copy(self.reactions[j])
+            propensity = reaction.propensity_type
+            # the species stay shared, only the parameters are copied
+            memo = {id(s): s for s in propensity.propensity_dict['species'].values()}
+            reaction.propensity_type = copy.deepcopy(propensity, memo)
+            if reactions is not None and reactions[j] is self.reactions[j]:
+                reactions[j] = reaction
+            self.reactions[j] = reaction
+            self._owned_reactions.add(j)
+        return self.reactions[j]
@@ -6,33 +6,40 @@ import numbers
 from collections import defaultdict
 from typing import List, Set, Union
 
-import libsbml
-
 from .parameter import ModelParameter, Parameter, ParameterEntry
+from .rate_law import (FallingFactorial, FormulaExpression, Number,
+                       ParameterSlot, Power, Product, Quotient, RateLaw,
+                       SpeciesSlot, Sum)
 from .sbmlutil import (_create_global_parameter, _create_local_parameter,
                        getSpeciesByName)
 from .species import Species
 
 
 class Propensity(object):
+    # registry of all (direct and indirect) subclasses of Propensity, filled by __init_subclass__
+    _registry = set()
+    # parameters the propensity is linear in: reactions that only differ in these can be merged by summing them
+    _rate_parameters = ()
+
     def __init__(self):
         self.propensity_dict = {'species': {}, 'parameters': {}}
         self.name = None
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        Propensity._registry.add(cls)
+
     @staticmethod
     def is_valid_propensity(propensity_type) -> bool:
         """checks whether the given propensity_type is valid propensity.
 
-        It recursively checks all subclasses of Propensity until it finds the
-        propensity type. Otherwise raise a Type error
+        A propensity is valid if it is an instance of a (registered) subclass of Propensity.
+        Every subclass registers itself when it is defined, so this is a single set lookup.
 
         :param propensity_type: Propensity
         :returns bool
         """
-        for propensity in Propensity.get_available_propensities():
-            if isinstance(propensity_type, propensity):
-                return True
-        return False
+        return type(propensity_type) in Propensity._registry
 
     @staticmethod
     def _all_subclasses(cls):
@@ -48,7 +55,7 @@ class Propensity(object):
 
     @staticmethod
     def get_available_propensities() -> Set:
-        return Propensity._all_subclasses(Propensity)
+        return set(Propensity._registry)
 
     def _create_sbml_parameter(self, parameter_name, sbml_model, ratelaw, rename_dict = None):
         """Creates an sbml parameter for a parameter of the given name.
@@ -152,6 +159,36 @@ class Propensity(object):
         if other.__class__ == self.__class__:
             return other.propensity_dict == self.propensity_dict
 
+    def canonical_key(self, include_rates: bool = True) -> tuple:
+        """A hashable key of the propensity: its type, species and parameter values.
+
+        :param include_rates: if False, the rate parameters (self._rate_parameters) are left out
+        :return: tuple
+        """
+        parameters = tuple(sorted((name, getattr(p, "value", p)) for name, p in self.propensity_dict['parameters'].items()
+                                  if include_rates or name not in self._rate_parameters))
+        species = tuple(sorted(self.propensity_dict['species'].items(), key=lambda item: item[0]))
+        return (type(self), parameters, species)
+
+    def merge_rates(self, other):
+        """Returns a new propensity whose rate parameters are the sums of the rate parameters of self and other.
+
+        The other parameters and species are taken from self. Rate parameters which are None in both are kept None.
+        Parameters are replaced by their values.
+
+        :param other: propensity with the same canonical_key(include_rates=False)
+        :return: Propensity
+        """
+        if len(self._rate_parameters) == 0:
+            raise NotImplementedError(f"Rates of {type(self).__name__} propensities cannot be merged.")
+        arguments = dict(self.propensity_dict['parameters'])
+        for name in self._rate_parameters:
+            rates = [getattr(p, "value", p) for p in [self.propensity_dict['parameters'].get(name),
+                                                      other.propensity_dict['parameters'].get(name)] if p is not None]
+            arguments[name] = sum(rates) if len(rates) > 0 else None
+        arguments.update(self.propensity_dict['species'])
+        return type(self)(**arguments)
+
     @property
     def species(self) -> List:
         """returns the instance variables that are species type."""
@@ -160,6 +197,23 @@ class Propensity(object):
     def create_kinetic_law(self, reaction, reverse_reaction, stochastic, **kwargs):
         raise NotImplementedError("class Propensity is meant to be subclassed!")
 
+    def rate_law(self, reaction=None, stochastic=False, reverse=False) -> RateLaw:
+        """Returns the RateLaw (expression IR) of this propensity.
+
+        The RateLaw is shared by SBML export, printing and simulation.
+
+        :param reaction: the Reaction using this propensity (needed for mass action)
+        :param stochastic: use the stochastic (falling factorial) form of the rate
+        :param reverse: the rate of the reverse direction of a reversible reaction
+        :return: RateLaw
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not have a RateLaw.")
+
+    def _set_rate_law_math(self, model, ratelaw, rate_law: RateLaw, parameter_ids):
+        """Sets the math of an SBML KineticLaw from a RateLaw."""
+        species_ids = [getSpeciesByName(model, str(s)).getId() for s in rate_law.species]
+        ratelaw.setMath(rate_law.to_mathml(species_ids, parameter_ids))
+
     @classmethod
     def from_dict(cls, propensity_dict):
         merged = propensity_dict['parameters']
@@ -258,26 +312,29 @@ class GeneralPropensity(Propensity):
     def pretty_print_rate(self, **kwargs):
         return self.propensity_function
 
+    def canonical_key(self, include_rates: bool = True) -> tuple:
+        return Propensity.canonical_key(self, include_rates) + (self.propensity_function,)
+
     def create_kinetic_law(self, model, sbml_reaction, **kwargs):
         """Creates KineticLaw object for SBML using the propensity_function string."""
         ratelaw = sbml_reaction.createKineticLaw()
 
         propensity_dict_in_sbml = self._translate_propensity_dict_to_sbml(model=model, ratelaw=ratelaw)
 
-        # replacing the species defined in CRN with valid SBML names
-        for species_in_crn, species_in_sbml in propensity_dict_in_sbml['species'].items():
-            self.propensity_function.replace(species_in_crn, species_in_sbml)
-
-        # replacing the parameters defined in CRN with valid SBML names
-        for parameter_in_crn, parameter_in_sbml in propensity_dict_in_sbml['parameters'].items():
-            self.propensity_function.replace(parameter_in_crn, parameter_in_sbml)
+        # the formula is parsed once; the species and parameters are renamed to their SBML ids in a copy
+        self._set_rate_law_math(model, ratelaw, self.rate_law(), propensity_dict_in_sbml['parameters'])
+        return ratelaw
 
-        math_ast = libsbml.parseL3Formula(self.propensity_function)
-        ratelaw.setMath(math_ast)
-        return ratelaw 
+    def rate_law(self, reaction=None, stochastic=False, reverse=False) -> RateLaw:
+        """The formula is used as given for deterministic and stochastic models."""
+        species = self.propensity_dict['species']
+        expression = FormulaExpression(self.propensity_function, list(species.keys()), list(self.propensity_dict['parameters'].keys()))
+        return RateLaw(expression, list(species.values()))
 
 
 class MassAction(Propensity):
+    _rate_parameters = ('k_forward', 'k_reverse')
+
     def __init__(self, k_forward: Union[float, ParameterEntry], k_reverse: Union[float, ParameterEntry] = None):
         super(MassAction, self).__init__()
         self.k_forward = k_forward
@@ -318,17 +375,26 @@ class MassAction(Propensity):
 
     def pretty_print_rate(self, **kwargs):
         crn_reaction = kwargs["reaction"]
-        reactant_species = {}
-        for w_species in crn_reaction.inputs:
-            reactant_species[str(w_species.species)] = w_species
-        txt = " Kf="+self._get_rate_formula("k_forward", kwargs["stochastic"], reactant_species)
+        txt = " Kf="+self.rate_law(crn_reaction, kwargs["stochastic"]).pretty_print()
         if self.is_reversible:
-            reactant_species = {}
-            for w_species in crn_reaction.outputs:
-                reactant_species[str(w_species.species)] = w_species
-            txt += "\n Kr="+self._get_rate_formula("k_reverse", kwargs["stochastic"], reactant_species)
+            txt += "\n Kr="+self.rate_law(crn_reaction, kwargs["stochastic"], reverse=True).pretty_print()
         return txt
 
+    def rate_law(self, reaction=None, stochastic=False, reverse=False) -> RateLaw:
+        if reaction is None:
+            raise ValueError("MassAction.rate_law requires the reaction.")
+        reactants = reaction.outputs if reverse else reaction.inputs
+        factors = [ParameterSlot('k_reverse' if reverse else 'k_forward')]
+        for slot, w_species in enumerate(reactants):
+            if stochastic:
+                factors.append(FallingFactorial(slot, w_species.stoichiometry))
+            elif w_species.stoichiometry > 1:
+                factors.append(Power(SpeciesSlot(slot), Number(w_species.stoichiometry)))
+            else:
+                factors.append(SpeciesSlot(slot))
+        expression = Product(*factors) if len(factors) > 1 else factors[0]
+        return RateLaw(expression, [w_species.species for w_species in reactants])
+
     def create_kinetic_law(self, model, sbml_reaction, stochastic, reverse_reaction=False, **kwargs):
 
         if 'crn_reaction' in kwargs:
@@ -343,52 +409,21 @@ class MassAction(Propensity):
         # translate the internal representation of a propensity to SBML format
         propensity_dict_in_sbml = self._translate_propensity_dict_to_sbml(model=model, ratelaw=ratelaw)
 
-        # set up the forward sbml_reaction
-        if not reverse_reaction:
-            reactant_species = {}
-            for w_species in crn_reaction.inputs:
-                species_id = getSpeciesByName(model, str(w_species.species)).getId()
-                reactant_species[species_id] = w_species
-            param = propensity_dict_in_sbml['parameters']['k_forward']
-            propensity_dict_in_sbml['parameters'].pop('k_reverse', None) #remove the other parameter from the propensities
-            ratelaw.removeLocalParameter("k_reverse") #if k_reverse is a local parameter, remove it
-        # set up a reverse reaction
-        elif reverse_reaction:
-            reactant_species = {}
-            for w_species in crn_reaction.outputs:
-                species_id = getSpeciesByName(model, str(w_species.species)).getId()
-                reactant_species[species_id] = w_species
-            param = propensity_dict_in_sbml['parameters']['k_reverse']
-            propensity_dict_in_sbml['parameters'].pop('k_forward', None) #remove the other parameter from the propensities
-            ratelaw.removeLocalParameter("k_forward") #if k_forward is a local parameter, remove it
-
-        rate_formula = self._get_rate_formula(param, stochastic, reactant_species)
-        # Set the ratelaw to the rateformula
-        math_ast = libsbml.parseL3Formula(rate_formula)
-        ratelaw.setMath(math_ast)
+        # remove the parameter of the other direction
+        unused = 'k_forward' if reverse_reaction else 'k_reverse'
+        propensity_dict_in_sbml['parameters'].pop(unused, None)
+        ratelaw.removeLocalParameter(unused) #if it is a local parameter, remove it
+
+        rate_law = self.rate_law(crn_reaction, stochastic=stochastic, reverse=reverse_reaction)
+        self._set_rate_law_math(model, ratelaw, rate_law, propensity_dict_in_sbml['parameters'])
         annotation_string = self._create_annotation(model, propensity_dict_in_sbml=propensity_dict_in_sbml, **kwargs)
         sbml_reaction.appendAnnotation(annotation_string)
         return ratelaw
 
-    def _get_rate_formula(self, rate_coeff_name, stochastic, reactant_species) -> str:
-
-        # Create Rate-strings for massaction propensities
-        ratestring = rate_coeff_name
-
-        for species_id, weighted_species in reactant_species.items():
-            if stochastic:
-                ratestring += '*'
-                ratestring += f"{species_id}"
-                ratestring += '*'
-                ratestring += '*'.join(f" ( {species_id} - {i} )" for i in range(1, weighted_species.stoichiometry))
-            else:
-                if weighted_species.stoichiometry > 1:
-                    ratestring += f" * {species_id}^{weighted_species.stoichiometry}"
-                else:
-                    ratestring += f" * {species_id}"
-        return ratestring
 
 class Hill(Propensity):
+    _rate_parameters = ('k',)
+
     def __init__(self, k: float, s1: Species, K: float, n: float, d: Species):
         Propensity.__init__(self)
         self.k = k
@@ -452,7 +487,8 @@ class Hill(Propensity):
         self.propensity_dict['species']['d'] = self._d
 
     def pretty_print_rate(self, show_parameters = True, **kwargs):
-        raise NotImplementedError("Propensity class Hill is meant to be subclassed: try HillPositive, HillNegative, ProportionalHillPositive, or ProportionalHillNegative.")
+        """Prints the rate law of the subclass (HillPositive, HillNegative, ProportionalHillPositive, or ProportionalHillNegative)."""
+        return " Kf="+self.rate_law().pretty_print()
 
     def create_kinetic_law(self, model, sbml_reaction, stochastic, **kwargs):
         """This code is reused in all Hill Propensity subclasses."""
@@ -464,18 +500,26 @@ class Hill(Propensity):
         # translate the internal representation of a propensity to SBML format
         propensity_dict_in_sbml = self._translate_propensity_dict_to_sbml(model=model, ratelaw=ratelaw)
 
-        rate_formula = self._get_rate_formula(propensity_dict=propensity_dict_in_sbml)
         # attach simulator specific annotations to the SBML model, if needed
         annotation_string = self._create_annotation(model, propensity_dict_in_sbml, **kwargs)
         sbml_reaction.appendAnnotation(annotation_string)
-        # Set the ratelaw to the rateformula
-        math_ast = libsbml.parseL3Formula(rate_formula)
-        ratelaw.setMath(math_ast)
+        self._set_rate_law_math(model, ratelaw, self.rate_law(), propensity_dict_in_sbml['parameters'])
 
         return ratelaw
 
-    def _get_rate_formula(self, propensity_dict):
-        raise NotImplementedError('Hill does not have a rate formula! Check out the subclasses.')
+    def _hill_ratio(self) -> Power:
+        """(s1/K)^n, with s1 in species slot 0."""
+        return Power(Quotient(SpeciesSlot(0, non_negative=True), ParameterSlot('K')), ParameterSlot('n'))
+
+    def _rate_law_species(self) -> List[Species]:
+        d = self.propensity_dict['species'].get('d')
+        return [self.s1] if d is None else [self.s1, d]
+
+    def _rate_law_numerator(self):
+        """k, or k*d for the proportional Hill functions (d in species slot 1)."""
+        if self.propensity_dict['species'].get('d') is None:
+            return ParameterSlot('k')
+        return Product(ParameterSlot('k'), SpeciesSlot(1))
 
 
 class HillPositive(Hill):
@@ -491,16 +535,10 @@ class HillPositive(Hill):
         Hill.__init__(self=self, k=k, s1=s1, K=K, n=n, d=None)
         self.name = 'hillpositive'
 
-    def pretty_print_rate(self, show_parameters = True, **kwargs):
-        return f' Kf = k ({self.s1.pretty_print(**kwargs)}/K)^n / (1+({self.s1.pretty_print(**kwargs)}/K)^n)'
-
-    def _get_rate_formula(self, propensity_dict):
-        k = propensity_dict['parameters']['k']
-        n = propensity_dict['parameters']['n']
-        K = propensity_dict['parameters']['K']
-        s1 = propensity_dict['species']['s1']
-        rate_formula = f"{k}*( {s1}/{K} )^{n} / ( 1 + ({s1}/{K})^{n} )"
-        return rate_formula
+    def rate_law(self, reaction=None, stochastic=False, reverse=False) -> RateLaw:
+        ratio = self._hill_ratio()
+        expression = Quotient(Product(self._rate_law_numerator(), ratio), Sum(Number(1), ratio))
+        return RateLaw(expression, self._rate_law_species())
 
 
 class HillNegative(Hill):
@@ -517,16 +555,9 @@ class HillNegative(Hill):
         Hill.__init__(self = self, k=k, s1=s1, K=K, n=n, d=None)
         self.name = 'hillnegative'
 
-    def pretty_print_rate(self, show_parameters = True, **kwargs):
-        return f' Kf = k / ((1+{self.s1.pretty_print(**kwargs)}/K)^n)'
-
-    def _get_rate_formula(self, propensity_dict):
-        k = propensity_dict['parameters']['k']
-        n = propensity_dict['parameters']['n']
-        K = propensity_dict['parameters']['K']
-        s1 = propensity_dict['species']['s1']
-        rate_formula = f"{k} / ( 1 + ({s1}/{K})^{n} )"
-        return rate_formula
+    def rate_law(self, reaction=None, stochastic=False, reverse=False) -> RateLaw:
+        expression = Quotient(self._rate_law_numerator(), Sum(Number(1), self._hill_ratio()))
+        return RateLaw(expression, self._rate_law_species())
 
 
 class ProportionalHillPositive(HillPositive):
@@ -544,17 +575,6 @@ class ProportionalHillPositive(HillPositive):
         Hill.__init__(self=self, k=k, s1=s1, K=K, n=n, d=d)
         self.name = 'proportionalhillpositive'
 
-    def pretty_print_rate(self, show_parameters = True,  **kwargs):
-        return f' Kf = k {self.d.pretty_print(**kwargs)} {self.s1.pretty_print(**kwargs)}^n/(1+({self.s1.pretty_print(**kwargs)}/K)^n)'
-
-    def _get_rate_formula(self, propensity_dict):
-        k = propensity_dict['parameters']['k']
-        n = propensity_dict['parameters']['n']
-        K = propensity_dict['parameters']['K']
-        s1 = propensity_dict['species']['s1']
-        d = propensity_dict['species']['d']
-        return f"{k}*{d}*( {s1}/{K} )^{n} / ( 1 + ({s1}/{K})^{n} )"
-
 
 class ProportionalHillNegative(HillNegative):
     def __init__(self, k: float, s1: Species, K: float, n: float, d: Species):
@@ -570,14 +590,3 @@ class ProportionalHillNegative(HillNegative):
         """
         Hill.__init__(self=self, k=k, s1=s1, K=K, n=n, d=d)
         self.name = 'proportionalhillnegative'
-
-    def pretty_print_rate(self, show_parameters=True, **kwargs):
-        return f' Kf = k {self.d.pretty_print(**kwargs)} / ( 1 + ({self.s1.pretty_print(**kwargs)}/K)^{self.n} )'
-
-    def _get_rate_formula(self, propensity_dict):
-        k = propensity_dict['parameters']['k']
-        n = propensity_dict['parameters']['n']
-        K = propensity_dict['parameters']['K']
-        s1 = propensity_dict['species']['s1']
-        d = propensity_dict['species']['d']
-        return f"{k}*{d} / ( 1 + ({s1}/{K})^{n} )"
@@ -0,0 +1,480 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+"""A small expression IR for propensities (rate laws).
+
+A RateLaw is an expression tree over species slots and parameter slots.
+It is the single source of a propensity's rate used by:
+    SBML export: RateLaw.to_mathml() clones a cached MathML template of the expression structure
+                 and fills in the SBML ids (instead of formatting and re-parsing a formula string)
+    printing: RateLaw.pretty_print()
+    simulation: RateLaw.numpy_evaluator() returns a function vectorized over states
+
+Propensity.rate_law(reaction, stochastic, reverse) creates the RateLaw of a reaction.
+
+Formula strings (GeneralPropensity) are compiled by CompiledFormula: the formula is parsed by libsbml,
+checked against a whitelist of AST node types and translated to a NumPy expression which is compiled once
+per formula.
+"""
+
+from typing import Dict, List
+
+import libsbml
+
+from .species import Species
+
+HAVE_NUMPY = False
+try:
+    import numpy as np
+
+    HAVE_NUMPY = True
+except ModuleNotFoundError:
+    pass
+
+
+class RateExpression(object):
+    """Base class of the nodes of the rate law IR."""
+    # libsbml AST type, printed operator and operator precedence (atoms bind tightest)
+    _ast_type = None
+    _operator = None
+    _precedence = 4
+
+    def __init__(self, *children):
+        self.children = list(children)
+
+    def signature(self) -> tuple:
+        """A hashable description of the structure of the expression (used to cache MathML templates)."""
+        return (type(self).__name__,) + tuple(c.signature() for c in self.children)
+
+    def to_ast(self) -> libsbml.ASTNode:
+        """Builds a MathML AST with the placeholder names of the species and parameter slots."""
+        node = libsbml.ASTNode(self._ast_type)
+        for c in self.children:
+            node.addChild(c.to_ast())
+        return node
+
+    def pretty_print(self, species_names: List[str], parameter_names: Dict[str, str]) -> str:
+        return self._operator.join(self._pretty_child(c, i, species_names, parameter_names)
+                                   for i, c in enumerate(self.children))
+
+    def _pretty_child(self, child, position, species_names, parameter_names) -> str:
+        """Prints a child, in parentheses if it binds less tightly than this operator.
+
+        Difference, Quotient and Power are not associative, so their right operand is also parenthesized at equal precedence.
+        """
+        txt = child.pretty_print(species_names, parameter_names)
+        if child._precedence < self._precedence or (position > 0 and child._precedence == self._precedence
+                                                    and isinstance(self, (Difference, Quotient, Power))):
+            txt = "("+txt+")"
+        return txt
+
+    def evaluator(self, species_indices: List[int], parameter_slots: Dict[str, int]):
+        """Returns a function f(x, p) of states x (..., n_species) and a parameter vector p."""
+        raise NotImplementedError(f"{type(self).__name__} must be subclassed.")
+
+
+class SpeciesSlot(RateExpression):
+    """The concentration (or count) of species slot of the RateLaw.
+
+    :param slot: the species slot
+    :param non_negative: the evaluator clamps the value at 0 (e.g. the regulator of a Hill function, which
+                         integrators may drive slightly negative); SBML export and printing are unchanged
+    """
+    def __init__(self, slot: int, non_negative: bool = False):
+        RateExpression.__init__(self)
+        self.slot = slot
+        self.non_negative = non_negative
+
+    def signature(self) -> tuple:
+        return ("species", self.slot)
+
+    def to_ast(self) -> libsbml.ASTNode:
+        node = libsbml.ASTNode(libsbml.AST_NAME)
+        node.setName(_species_placeholder(self.slot))
+        return node
+
+    def pretty_print(self, species_names, parameter_names) -> str:
+        return species_names[self.slot]
+
+    def evaluator(self, species_indices, parameter_slots):
+        i = species_indices[self.slot]
+        if self.non_negative:
+            return lambda x, p: np.maximum(x[..., i], 0)
+        return lambda x, p: x[..., i]
+
+
+class ParameterSlot(RateExpression):
+    """The parameter of the propensity with the given name (a key of propensity_dict['parameters'])."""
+    def __init__(self, name: str):
+        RateExpression.__init__(self)
+        self.name = name
+
+    def signature(self) -> tuple:
+        return ("parameter", self.name)
+
+    def to_ast(self) -> libsbml.ASTNode:
+        node = libsbml.ASTNode(libsbml.AST_NAME)
+        node.setName(_parameter_placeholder(self.name))
+        return node
+
+    def pretty_print(self, species_names, parameter_names) -> str:
+        return parameter_names.get(self.name, self.name)
+
+    def evaluator(self, species_indices, parameter_slots):
+        j = parameter_slots[self.name]
+        return lambda x, p: p[..., j]
+
+
+class Number(RateExpression):
+    def __init__(self, value):
+        RateExpression.__init__(self)
+        self.value = value
+
+    def signature(self) -> tuple:
+        return ("number", self.value)
+
+    def to_ast(self) -> libsbml.ASTNode:
+        node = libsbml.ASTNode(libsbml.AST_INTEGER if isinstance(self.value, int) else libsbml.AST_REAL)
+        node.setValue(self.value)
+        return node
+
+    def pretty_print(self, species_names, parameter_names) -> str:
+        return str(self.value)
+
+    def evaluator(self, species_indices, parameter_slots):
+        value = self.value
+        return lambda x, p: value
+
+
+class Sum(RateExpression):
+    _ast_type = libsbml.AST_PLUS
+    _operator = " + "
+    _precedence = 1
+
+    def evaluator(self, species_indices, parameter_slots):
+        terms = [c.evaluator(species_indices, parameter_slots) for c in self.children]
+        return lambda x, p: sum(f(x, p) for f in terms)
+
+
+class Difference(RateExpression):
+    _ast_type = libsbml.AST_MINUS
+    _operator = " - "
+    _precedence = 1
+
+    def __init__(self, left: RateExpression, right: RateExpression):
+        RateExpression.__init__(self, left, right)
+
+    def evaluator(self, species_indices, parameter_slots):
+        left, right = [c.evaluator(species_indices, parameter_slots) for c in self.children]
+        return lambda x, p: left(x, p) - right(x, p)
+
+
+class Product(RateExpression):
+    _ast_type = libsbml.AST_TIMES
+    _operator = "*"
+    _precedence = 2
+
+    def evaluator(self, species_indices, parameter_slots):
+        factors = [c.evaluator(species_indices, parameter_slots) for c in self.children]
+
+        def f(x, p):
+            result = 1.0
+            for factor in factors:
+                result = result*factor(x, p)
+            return result
+        return f
+
+
+class Quotient(RateExpression):
+    _ast_type = libsbml.AST_DIVIDE
+    _operator = "/"
+    _precedence = 2
+
+    def __init__(self, numerator: RateExpression, denominator: RateExpression):
+        RateExpression.__init__(self, numerator, denominator)
+
+    def evaluator(self, species_indices, parameter_slots):
+        numerator, denominator = [c.evaluator(species_indices, parameter_slots) for c in self.children]
+        return lambda x, p: numerator(x, p)/denominator(x, p)
+
+
+class Power(RateExpression):
+    _ast_type = libsbml.AST_POWER
+    _operator = "^"
+    _precedence = 3
+
+    def __init__(self, base: RateExpression, exponent: RateExpression):
+        RateExpression.__init__(self, base, exponent)
+
+    def evaluator(self, species_indices, parameter_slots):
+        base, exponent = [c.evaluator(species_indices, parameter_slots) for c in self.children]
+        return lambda x, p: base(x, p)**exponent(x, p)
+
+
+class FallingFactorial(RateExpression):
+    """The falling factorial S (S-1) ... (S-order+1) of a species slot, used by stochastic mass action."""
+    def __init__(self, slot: int, order: int):
+        RateExpression.__init__(self)
+        self.slot = slot
+        self.order = order
+        self._precedence = 4 if order == 1 else 2
+
+    def signature(self) -> tuple:
+        return ("falling_factorial", self.slot, self.order)
+
+    def _expanded(self) -> RateExpression:
+        species = SpeciesSlot(self.slot)
+        if self.order == 1:
+            return species
+        factors = [species]+[Difference(species, Number(i)) for i in range(1, self.order)]
+        return Product(*factors)
+
+    def to_ast(self) -> libsbml.ASTNode:
+        return self._expanded().to_ast()
+
+    def pretty_print(self, species_names, parameter_names) -> str:
+        return self._expanded().pretty_print(species_names, parameter_names)
+
+    def evaluator(self, species_indices, parameter_slots):
+        i = species_indices[self.slot]
+        order = self.order
+
+        def f(x, p):
+            s = x[..., i]
+            result = s
+            for offset in range(1, order):
+                result = result*(s - offset)
+            return result
+        return f
+
+
+class FormulaExpression(RateExpression):
+    """An SBML L3 formula string over named species slots and parameters (used by GeneralPropensity).
+
+    :param formula: the formula
+    :param species_names: the name in the formula of each species slot
+    :param parameter_names: the parameter names used in the formula
+    """
+    def __init__(self, formula: str, species_names: List[str], parameter_names: List[str]):
+        RateExpression.__init__(self)
+        self.formula = formula
+        self.species_names = list(species_names)
+        self.parameter_names = list(parameter_names)
+
+    def signature(self) -> tuple:
+        return ("formula", self.formula, tuple(self.species_names), tuple(self.parameter_names))
+
+    def _renamed_ast(self, species_names, parameter_names) -> libsbml.ASTNode:
+        names = dict(zip(self.species_names, species_names))
+        names.update({name: parameter_names[name] for name in self.parameter_names if name in parameter_names})
+        return rename_ast_names(CompiledFormula.compile(self.formula).parse(), names)
+
+    def to_ast(self) -> libsbml.ASTNode:
+        placeholders = {name: _parameter_placeholder(name) for name in self.parameter_names}
+        return self._renamed_ast([_species_placeholder(i) for i in range(len(self.species_names))], placeholders)
+
+    def pretty_print(self, species_names, parameter_names) -> str:
+        return libsbml.formulaToL3String(self._renamed_ast(species_names, parameter_names))
+
+    def evaluator(self, species_indices, parameter_slots):
+        compiled = CompiledFormula.compile(self.formula)
+        arguments = compiled.bind(dict(zip(self.species_names, species_indices)),
+                                  {name: parameter_slots[name] for name in self.parameter_names})
+        return lambda x, p: compiled(*[x[..., i] if is_species else p[..., i] for is_species, i in arguments])
+
+
+class CompiledFormula(object):
+    """An SBML L3 formula compiled to a NumPy function of the names used in the formula.
+
+    Only whitelisted libsbml AST node types (arithmetic, elementary functions, relations, logical operators
+    and piecewise) are accepted, so no user code is ever executed. Compiled formulas are cached by formula
+    string: many reactions sharing one formula compile it once.
+
+    :param formula: the formula, e.g. "k*A^2/(K + A)"
+    """
+    _cache = {}
+
+    _operators = {libsbml.AST_PLUS: " + ", libsbml.AST_TIMES: "*", libsbml.AST_DIVIDE: "/",
+                  libsbml.AST_RELATIONAL_LT: " < ", libsbml.AST_RELATIONAL_LEQ: " <= ",
+                  libsbml.AST_RELATIONAL_GT: " > ", libsbml.AST_RELATIONAL_GEQ: " >= ",
+                  libsbml.AST_RELATIONAL_EQ: " == ", libsbml.AST_RELATIONAL_NEQ: " != "}
+    _functions = {libsbml.AST_FUNCTION_EXP: "np.exp", libsbml.AST_FUNCTION_LN: "np.log",
+                  libsbml.AST_FUNCTION_ABS: "np.abs", libsbml.AST_FUNCTION_FLOOR: "np.floor",
+                  libsbml.AST_FUNCTION_CEILING: "np.ceil", libsbml.AST_FUNCTION_SIN: "np.sin",
+                  libsbml.AST_FUNCTION_COS: "np.cos", libsbml.AST_FUNCTION_TAN: "np.tan",
+                  libsbml.AST_FUNCTION_SINH: "np.sinh", libsbml.AST_FUNCTION_COSH: "np.cosh",
+                  libsbml.AST_FUNCTION_TANH: "np.tanh", libsbml.AST_FUNCTION_ARCSIN: "np.arcsin",
+                  libsbml.AST_FUNCTION_ARCCOS: "np.arccos", libsbml.AST_FUNCTION_ARCTAN: "np.arctan",
+                  libsbml.AST_LOGICAL_NOT: "np.logical_not"}
+    # n-ary functions, applied pairwise
+    _reductions = {libsbml.AST_FUNCTION_MAX: "np.maximum", libsbml.AST_FUNCTION_MIN: "np.minimum",
+                   libsbml.AST_LOGICAL_AND: "np.logical_and", libsbml.AST_LOGICAL_OR: "np.logical_or",
+                   libsbml.AST_LOGICAL_XOR: "np.logical_xor"}
+    _constants = {libsbml.AST_CONSTANT_E: "np.e", libsbml.AST_CONSTANT_PI: "np.pi",
+                  libsbml.AST_CONSTANT_TRUE: "True", libsbml.AST_CONSTANT_FALSE: "False"}
+
+    def __init__(self, formula: str):
+        if not HAVE_NUMPY:
+            raise ModuleNotFoundError("CompiledFormula requires numpy. Please install it (pip install biocrnpyler[all]).")
+        self.formula = formula
+        self.names = []  # the names used in the formula, in the order of the arguments of the compiled function
+        self.source = self._translate(self.parse())
+        arguments = ", ".join(f"_{i}" for i in range(len(self.names)))
+        self._function = eval(compile(f"lambda {arguments}: {self.source}", f"<formula {formula}>", "eval"),
+                              {"np": np, "__builtins__": {}})
+
+    @classmethod
+    def compile(cls, formula: str) -> "CompiledFormula":
+        """Returns the (cached) CompiledFormula of formula."""
+        if formula not in cls._cache:
+            cls._cache[formula] = cls(formula)
+        return cls._cache[formula]
+
+    def parse(self) -> libsbml.ASTNode:
+        """Returns a new libsbml AST of the formula."""
+        ast = libsbml.parseL3Formula(self.formula)
+        if ast is None:
+            raise ValueError(f"Could not parse the formula {self.formula}: {libsbml.getLastParseL3Error()}")
+        return ast
+
+    def __call__(self, *values):
+        """Evaluates the formula with the values of self.names (numbers or NumPy arrays, broadcast together)."""
+        return self._function(*values)
+
+    def bind(self, species: Dict[str, int], parameters: Dict[str, int]) -> List[tuple]:
+        """Binds every name of the formula to a species or parameter index.
+
+        :param species: {name: index in the state vector}
+        :param parameters: {name: index in the parameter vector}
+        :return: [(True, species index) or (False, parameter index)] for each name of self.names
+        """
+        arguments = []
+        for name in self.names:
+            if name in species:
+                arguments.append((True, species[name]))
+            elif name in parameters:
+                arguments.append((False, parameters[name]))
+            else:
+                raise ValueError(f"{name} in the formula {self.formula} is neither a species nor a parameter.")
+        return arguments
+
+    def _argument(self, name: str) -> str:
+        if name not in self.names:
+            self.names.append(name)
+        return f"_{self.names.index(name)}"
+
+    def _translate(self, ast: libsbml.ASTNode) -> str:
+        ast_type = ast.getType()
+        children = [self._translate(ast.getChild(i)) for i in range(ast.getNumChildren())]
+
+        if ast_type == libsbml.AST_NAME:
+            return self._argument(ast.getName())
+        elif ast.isNumber():
+            return repr(float(ast.getValue()))
+        elif ast_type in self._constants:
+            return self._constants[ast_type]
+        elif ast_type == libsbml.AST_MINUS:
+            if len(children) == 1:
+                return f"(-{children[0]})"
+            return f"({children[0]} - {children[1]})"
+        elif ast_type in self._operators and len(children) > 0:
+            return "("+self._operators[ast_type].join(children)+")"
+        elif ast_type in (libsbml.AST_POWER, libsbml.AST_FUNCTION_POWER):
+            return f"({children[0]}**{children[1]})"
+        elif ast_type == libsbml.AST_FUNCTION_ROOT:
+            return f"({children[1]}**(1.0/{children[0]}))"
+        elif ast_type == libsbml.AST_FUNCTION_LOG:
+            return f"(np.log({children[1]})/np.log({children[0]}))"
+        elif ast_type in self._functions and len(children) == 1:
+            return f"{self._functions[ast_type]}({children[0]})"
+        elif ast_type in self._reductions and len(children) > 0:
+            txt = children[0]
+            for child in children[1:]:
+                txt = f"{self._reductions[ast_type]}({txt}, {child})"
+            return txt
+        elif ast_type == libsbml.AST_FUNCTION_PIECEWISE and len(children) > 0:
+            # piecewise(value_1, condition_1, ..., [otherwise])
+            otherwise = children[-1] if len(children) % 2 == 1 else "np.nan"
+            conditions = ", ".join(children[1::2][:len(children)//2])
+            values = ", ".join(children[0::2][:len(children)//2])
+            return f"np.select([{conditions}], [{values}], {otherwise})"
+        raise ValueError(f"Unsupported expression {libsbml.formulaToL3String(ast)} in the formula {self.formula}.")
+
+
+def _species_placeholder(slot: int) -> str:
+    return f"__species_{slot}"
+
+
+def _parameter_placeholder(name: str) -> str:
+    return f"__parameter_{name}"
+
+
+def rename_ast_names(ast: libsbml.ASTNode, names: Dict[str, str]) -> libsbml.ASTNode:
+    """Renames (in place) every name node of ast which is a key of names. Returns ast."""
+    if ast.getType() == libsbml.AST_NAME and ast.getName() in names:
+        ast.setName(names[ast.getName()])
+    for i in range(ast.getNumChildren()):
+        rename_ast_names(ast.getChild(i), names)
+    return ast
+
+
+class RateLaw(object):
+    """A rate law: an expression over the species slots self.species and the parameters of a propensity.
+
+    MathML templates are cached per expression structure, so SBML export of many reactions of the
+    same kind builds one AST and clones it.
+    """
+    _mathml_templates = {}
+
+    def __init__(self, expression: RateExpression, species: List[Species]):
+        self.expression = expression
+        self.species = list(species)
+
+    def signature(self) -> tuple:
+        return self.expression.signature()
+
+    def _template(self) -> libsbml.ASTNode:
+        signature = self.signature()
+        if signature not in RateLaw._mathml_templates:
+            RateLaw._mathml_templates[signature] = self.expression.to_ast()
+        return RateLaw._mathml_templates[signature]
+
+    def to_mathml(self, species_ids: List[str], parameter_ids: Dict[str, str]) -> libsbml.ASTNode:
+        """Returns a MathML AST of the rate law.
+
+        :param species_ids: SBML id of each species slot
+        :param parameter_ids: {parameter name: SBML id} of the parameters
+        :return: libsbml.ASTNode
+        """
+        names = {_species_placeholder(i): species_id for i, species_id in enumerate(species_ids)}
+        names.update({_parameter_placeholder(name): parameter_id for name, parameter_id in parameter_ids.items()})
+        return rename_ast_names(self._template().deepCopy(), names)
+
+    def pretty_print(self, species_names: List[str] = None, parameter_names: Dict[str, str] = None) -> str:
+        """Returns the rate law as an infix formula.
+
+        :param species_names: name of each species slot (default: str(species))
+        :param parameter_names: {parameter name: printed name} (default: the parameter names)
+        """
+        if species_names is None:
+            species_names = [str(s) for s in self.species]
+        if parameter_names is None:
+            parameter_names = {}
+        return self.expression.pretty_print(species_names, parameter_names)
+
+    def numpy_evaluator(self, species_index: Dict[Species, int], parameter_slots: Dict[str, int]):
+        """Returns a function f(x, p) evaluating the rate law for states x of shape (..., n_species)
+        and parameter vectors p of shape (n_parameters,) or (..., n_parameters).
+
+        :param species_index: {Species: position in the state vector}
+        :param parameter_slots: {parameter name: position in the parameter vector p}
+        """
+        if not HAVE_NUMPY:
+            raise ModuleNotFoundError("RateLaw.numpy_evaluator requires numpy. Please install it (pip install biocrnpyler[all]).")
+        f = self.expression.evaluator([species_index[s] for s in self.species], parameter_slots)
+
+        def evaluate(x, p):
+            x = np.asarray(x, dtype=float)
+            p = np.asarray(p, dtype=float)
+            return np.broadcast_to(f(x, p), np.broadcast_shapes(x.shape[:-1], p.shape[:-1]))
+        return evaluate
@@ -112,6 +112,40 @@ class Reaction(object):
 
         return cls(inputs=inputs, outputs=outputs, propensity_type=mak)
 
+    @classmethod
+    def from_arrays(cls, inputs: List[Species], outputs: List[Species], propensity_type: Propensity,
+                    input_coefs: List[int] = None, output_coefs: List[int] = None):
+        """Fast constructor for trusted input, used when generating many reactions at once.
+
+        Unlike Reaction(...), the species lists are not flattened, bindloc parents are not removed,
+        duplicate species are not merged and the propensity type is not validated.
+        The caller guarantees that inputs and outputs are lists of distinct Species without parents
+        and that propensity_type is a valid Propensity.
+
+        :param inputs: list of distinct Species
+        :param outputs: list of distinct Species
+        :param propensity_type: Propensity
+        :param input_coefs: stoichiometry of each input (default 1)
+        :param output_coefs: stoichiometry of each output (default 1)
+        :return: Reaction object
+        """
+        if input_coefs is not None and len(input_coefs) != len(inputs):
+            raise ValueError(f"input_coefs has {len(input_coefs)} entries for {len(inputs)} inputs.")
+        if output_coefs is not None and len(output_coefs) != len(outputs):
+            raise ValueError(f"output_coefs has {len(output_coefs)} entries for {len(outputs)} outputs.")
+
+        r = cls.__new__(cls)
+        if input_coefs is None:
+            r._input_complexes = [WeightedSpecies(species=s) for s in inputs]
+        else:
+            r._input_complexes = [WeightedSpecies(species=s, stoichiometry=n) for s, n in zip(inputs, input_coefs)]
+        if output_coefs is None:
+            r._output_complexes = [WeightedSpecies(species=s) for s in outputs]
+        else:
+            r._output_complexes = [WeightedSpecies(species=s, stoichiometry=n) for s, n in zip(outputs, output_coefs)]
+        r._propensity_type = propensity_type
+        return r
+
     @property
     def is_reversible(self) -> bool:
         return self.propensity_type.is_reversible
@@ -179,13 +213,12 @@ class Reaction(object):
             new_s = s.replace_species(species, new_species)
             new_outputs.append(new_s)
 
-        # get a shallow copy of the parameters and species, so we can replace some of them
-        propensity_type_dict = copy.copy(self.propensity_type.propensity_dict)
-        for key, prop_species in propensity_type_dict['species'].items():
-            propensity_type_dict['species'][key] = prop_species.replace_species(species, new_species)
+        # copy the parameters and species dictionaries, so we can replace some of them without changing self
+        propensity_type_dict = {'parameters': dict(self.propensity_type.propensity_dict['parameters']),
+                                'species': {key: prop_species.replace_species(species, new_species)
+                                            for key, prop_species in self.propensity_type.propensity_dict['species'].items()}}
 
         new_propensity_type = self.propensity_type.from_dict(propensity_type_dict)
-        print(new_propensity_type.propensity_dict)
 
         new_r = Reaction(inputs=new_inputs, outputs=new_outputs, propensity_type=new_propensity_type)
         return new_r
@@ -230,6 +263,23 @@ class Reaction(object):
 
         return (set(self.inputs), set(self.outputs), self.propensity_type) == (set(other.inputs), set(other.outputs), other.propensity_type)
 
+    def canonical_key(self, include_rates: bool = True) -> tuple:
+        """A hashable key identifying the reaction independently of the order of its inputs and outputs.
+
+        The key holds the input and output multisets and the propensity type, species and parameter values.
+        Reactions which are equal (==) have the same key.
+
+        :param include_rates: if False, the rate parameters of the propensity (e.g. k_forward and k_reverse
+                              of MassAction) are left out, so reactions which only differ in their rates share a key
+        :return: tuple
+        """
+        return (frozenset((w.species, w.stoichiometry) for w in self.inputs),
+                frozenset((w.species, w.stoichiometry) for w in self.outputs),
+                self.propensity_type.canonical_key(include_rates))
+
+    def __hash__(self):
+        return hash(self.canonical_key())
+
     def __contains__(self, item: Species):
         """It checks whether a species is part of a reaction.
 
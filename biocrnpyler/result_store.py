@@ -0,0 +1,227 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+import json
+import os
+from typing import Dict, List, Union
+from warnings import warn
+
+from .compiled_crn import HAVE_NUMPY, CompiledCRN
+from .simulation_protocol import Protocol, ProtocolEvent
+from .species import Species
+
+if HAVE_NUMPY:
+    import numpy as np
+
+
+class ResultStore(object):
+    """A directory of simulation results stored as chunked, memory-mapped .npy files.
+
+    Every chunk holds the trajectories of a block of replicates as an array of shape
+    (timepoints x species x replicates), so a species column of a chunk is read without touching the
+    other species. The directory also holds the timepoints (timepoints.npy) and a metadata.json with
+    the species reprs (in the order of the species index of the CompiledCRN), the parameter vector and
+    names, the fingerprint of the CRN and the list of chunks. The metadata is rewritten after every
+    chunk, so a partially written store can be read.
+
+    Create a store with ResultStore.create and open an existing one with ResultStore(path).
+
+    :param path: directory of the store
+    :param mode: "r" to read the chunks, "r+" to also modify them
+    """
+    metadata_file = "metadata.json"
+    timepoints_file = "timepoints.npy"
+
+    def __init__(self, path: str, mode: str = "r"):
+        if not HAVE_NUMPY:
+            raise ModuleNotFoundError("ResultStore requires numpy. Please install it (pip install biocrnpyler[all]).")
+        if mode not in ("r", "r+"):
+            raise ValueError(f"mode must be 'r' or 'r+', not {mode}.")
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, self.metadata_file)) as f:
+            self.metadata = json.load(f)
+        self.timepoints = np.load(os.path.join(path, self.timepoints_file))
+        self._species_index = {s: i for i, s in enumerate(self.species)}
+
+    @classmethod
+    def create(cls, path: str, compiled: CompiledCRN, timepoints, **metadata) -> "ResultStore":
+        """Creates an empty store in the directory path (created if needed; it must not contain a store).
+
+        :param compiled: the CompiledCRN of the simulations
+        :param timepoints: the timepoints of the trajectories
+        :param metadata: additional JSON serializable metadata, e.g. the engine and seed
+        """
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, cls.metadata_file)):
+            raise ValueError(f"{path} already contains a ResultStore.")
+        np.save(os.path.join(path, cls.timepoints_file), np.asarray(timepoints, dtype=float))
+        metadata.update({"species": [repr(s) for s in compiled.species],
+                         "parameter_names": list(compiled.parameter_table.names),
+                         "parameters": [float(p) for p in compiled.parameters],
+                         "fingerprint": compiled.fingerprint,
+                         "chunks": []})
+        with open(os.path.join(path, cls.metadata_file), "w") as f:
+            json.dump(metadata, f)
+        return cls(path, mode="r+")
+
+    def _write_metadata(self):
+        with open(os.path.join(self.path, self.metadata_file), "w") as f:
+            json.dump(self.metadata, f)
+
+    @property
+    def species(self) -> List[str]:
+        return self.metadata["species"]
+
+    @property
+    def parameters(self):
+        return np.array(self.metadata["parameters"])
+
+    @property
+    def fingerprint(self) -> str:
+        return self.metadata["fingerprint"]
+
+    @property
+    def n_replicates(self) -> int:
+        return sum(chunk["n_replicates"] for chunk in self.metadata["chunks"])
+
+    @property
+    def n_chunks(self) -> int:
+        return len(self.metadata["chunks"])
+
+    def new_chunk(self, n_replicates: int):
+        """Adds a chunk for n_replicates trajectories and returns it as a writable memmap of shape
+        (timepoints x species x replicates), e.g. for an integrator which writes its states as it goes.
+
+        The transposed view chunk.transpose(0, 2, 1) has the (timepoints x replicates x species) shape
+        of the out argument of CLEIntegrator.run.
+        """
+        if self.mode == "r":
+            raise ValueError("The ResultStore was opened read-only.")
+        file = f"chunk_{self.n_chunks:05d}.npy"
+        shape = (len(self.timepoints), len(self.species), n_replicates)
+        chunk = np.lib.format.open_memmap(os.path.join(self.path, file), mode="w+", dtype=float, shape=shape)
+        self.metadata["chunks"].append({"file": file, "n_replicates": n_replicates})
+        self._write_metadata()
+        return chunk
+
+    def append(self, states):
+        """Writes the trajectories states (replicates x timepoints x species), e.g. the result of
+        TauLeapingStepper.run, as a new chunk."""
+        states = np.asarray(states)
+        expected = (len(self.timepoints), len(self.species))
+        if states.ndim != 3 or states.shape[1:] != expected:
+            raise ValueError(f"states must have the shape (replicates, timepoints, species) = (R, {expected[0]}, {expected[1]}), "
+                             f"not {states.shape}.")
+        chunk = self.new_chunk(len(states))
+        chunk[...] = np.transpose(states, (1, 2, 0))
+        chunk.flush()
+
+    def chunk(self, k: int):
+        """The k-th chunk as a memmap of shape (timepoints x species x replicates)."""
+        return np.load(os.path.join(self.path, self.metadata["chunks"][k]["file"]), mmap_mode=self.mode)
+
+    def _indices(self, species) -> List[int]:
+        indices = []
+        for s in species:
+            key = s if isinstance(s, str) else repr(s)
+            if key not in self._species_index:
+                raise ValueError(f"Species {s} is not part of the ResultStore.")
+            indices.append(self._species_index[key])
+        return indices
+
+    def iter_chunks(self, species: Union[List[Species], List[str], None] = None):
+        """Yields the chunks one at a time as arrays (timepoints x selected species x replicates of the chunk),
+        for out-of-core reductions. Only the selected species are read from disk.
+
+        :param species: list of Species or repr(Species) (default: all species)
+        """
+        indices = None if species is None else self._indices(species)
+        for k in range(self.n_chunks):
+            chunk = self.chunk(k)
+            yield np.array(chunk if indices is None else chunk[:, indices])
+
+    def column(self, species: Union[Species, str], replicates=None):
+        """The trajectories of one species: array (timepoints x replicates), read lazily from the chunks.
+
+        :param replicates: indices or slice of the replicates (default: all)
+        """
+        i = self._indices([species])[0]
+        if replicates is None:
+            return np.concatenate([self.chunk(k)[:, i] for k in range(self.n_chunks)], axis=1)
+        selected = np.arange(self.n_replicates)[replicates]
+        starts = np.cumsum([0] + [chunk["n_replicates"] for chunk in self.metadata["chunks"]])
+        chunk_of = np.searchsorted(starts, selected, side="right") - 1
+        column = np.empty((len(self.timepoints), len(selected)))
+        for k in np.unique(chunk_of):
+            rows = chunk_of == k
+            column[:, rows] = self.chunk(k)[:, i, selected[rows] - starts[k]]
+        return column
+
+    def mean(self, species: Union[List[Species], List[str], None] = None):
+        """The mean over the replicates, array (timepoints x selected species), computed one chunk at a time."""
+        if self.n_replicates == 0:
+            raise ValueError("The ResultStore has no trajectories to average.")
+        total = None
+        for chunk in self.iter_chunks(species):
+            total = chunk.sum(axis=2) if total is None else total + chunk.sum(axis=2)
+        return total / self.n_replicates
+
+    def to_dataframe(self, replicate: int = 0, species: Union[List[Species], List[str], None] = None,
+                     return_dataframe: bool = True):
+        """One trajectory, formatted like the result of the simulators (a "time" column and one column per repr(species)).
+
+        :param replicate: the index of the replicate
+        :param species: list of Species or repr(Species) (default: all species)
+        :param return_dataframe: return a pandas DataFrame (if pandas is installed) or a dictionary of arrays
+        """
+        names = self.species if species is None else [self.species[i] for i in self._indices(species)]
+        result = {"time": self.timepoints}
+        for name in names:
+            result[name] = self.column(name, replicates=[replicate])[:, 0]
+
+        if return_dataframe:
+            try:
+                import pandas
+                return pandas.DataFrame(result)
+            except ModuleNotFoundError:
+                warn("pandas was not found, returning a dictionary of arrays instead of a DataFrame.")
+        return result
+
+
+def simulate_ensemble(crn, path: str, timepoints, n_replicates: int, engine: str = "tau_leaping",
+                      protocol: Union[Protocol, List[ProtocolEvent], None] = None,
+                      initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                      chunk_size: int = 1000, seed=None, **engine_kwargs) -> ResultStore:
+    """Simulates a large stochastic ensemble chunk by chunk into a ResultStore, so that only one chunk
+    of replicates is held in memory at a time.
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param path: directory of the new ResultStore
+    :param timepoints: increasing array of times at which the states are stored
+    :param n_replicates: number of trajectories
+    :param engine: "tau_leaping", "hybrid" or "cle" (see Protocol.simulate)
+    :param protocol: optional Protocol or list of ProtocolEvents applied to every replicate
+    :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+    :param chunk_size: number of replicates simulated together and stored per chunk
+    :param seed: seed (or numpy.random.Generator) of the random numbers
+    :param engine_kwargs: passed on to the engine
+    :return: the ResultStore (opened read-only)
+    """
+    if not HAVE_NUMPY:
+        raise ModuleNotFoundError("simulate_ensemble requires numpy and scipy. Please install them (pip install biocrnpyler[all]).")
+    if engine == "deterministic":
+        raise ValueError("simulate_ensemble simulates stochastic engines; use simulate_deterministic for the ODE model.")
+    if not isinstance(protocol, Protocol):
+        protocol = Protocol(protocol)
+
+    compiled = crn if isinstance(crn, CompiledCRN) else CompiledCRN(crn)
+    timepoints = np.asarray(timepoints, dtype=float)
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    store = ResultStore.create(path, compiled, timepoints, engine=engine,
+                               seed=seed if isinstance(seed, int) else None, n_events=len(protocol.events))
+    for start in range(0, n_replicates, chunk_size):
+        states = protocol.run(compiled, timepoints, n_replicates=min(chunk_size, n_replicates - start),
+                              initial_condition_dict=initial_condition_dict, engine=engine, rng=rng, **engine_kwargs)
+        store.append(states)
+    return ResultStore(path)
@@ -0,0 +1,240 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+import logging
+from typing import Dict, Tuple, Union
+
+from .compiled_crn import HAVE_NUMPY, CompiledCRN, ConservationLawReduction
+from .species import Species
+
+if HAVE_NUMPY:
+    import numpy as np
+    import scipy.sparse
+    import scipy.sparse.linalg
+    from scipy.integrate import solve_ivp
+
+logger = logging.getLogger(__name__)
+
+
+def spectral_radius(matrix, tol: float = 1e-3) -> float:
+    """The largest absolute eigenvalue of a square (dense or sparse) matrix.
+
+    Small matrices use a dense eigenvalue solver. Large ones use a few Arnoldi iterations (ARPACK,
+    the non-symmetric counterpart of Lanczos) for the largest eigenvalue only. If ARPACK does not
+    converge, the Gershgorin bound (the largest absolute row sum) is returned instead.
+
+    :param matrix: square numpy array or scipy sparse matrix
+    :param tol: relative accuracy of the Arnoldi iterations
+    """
+    n = matrix.shape[0]
+    if n == 0:
+        return 0.0
+    if n < 50:
+        dense = matrix.toarray() if scipy.sparse.issparse(matrix) else np.asarray(matrix)
+        return float(np.max(np.abs(np.linalg.eigvals(dense))))
+    try:
+        eigenvalues = scipy.sparse.linalg.eigs(matrix, k=1, which="LM", tol=tol, maxiter=20*n, return_eigenvectors=False)
+        return float(np.abs(eigenvalues[0]))
+    except scipy.sparse.linalg.ArpackNoConvergence:
+        return float(np.max(np.asarray(abs(matrix).sum(axis=1))))
+
+
+def estimate_stiffness(crn, initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                       n_samples: int = 5, seed=0) -> float:
+    """Estimates the fastest time scale of the ODE model of a CRN: the largest spectral radius of the
+    Jacobian over a few sampled states.
+
+    The samples are the initial state and random perturbations of it in which every species has at least
+    a small fraction of the average concentration, so that the binding reactions of species which are
+    absent at t = 0 (e.g. complexes) are seen. An explicit solver needs about spectral radius * time span
+    steps for stability alone.
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+    :param n_samples: number of sampled states (including the initial state)
+    :param seed: seed or numpy.random.Generator of the perturbations
+    :return: the largest spectral radius (in 1/time)
+    """
+    if not HAVE_NUMPY:
+        raise ModuleNotFoundError("estimate_stiffness requires numpy and scipy. Please install them (pip install biocrnpyler[all]).")
+
+    compiled = crn if isinstance(crn, CompiledCRN) else CompiledCRN(crn)
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    x0 = compiled.initial_state(initial_condition_dict)
+    scale = max(np.mean(x0), 1e-12)
+    samples = [x0] + [x0 * rng.uniform(.5, 1.5, len(x0)) + scale * rng.uniform(.01, .1, len(x0))
+                      for _ in range(n_samples - 1)]
+    return max(spectral_radius(compiled.sparse_jacobian(x)) for x in samples)
+
+
+def select_method(crn, timepoints, initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                  stiffness_threshold: float = 500., sparse_threshold: int = 100) -> Tuple[str, bool]:
+    """Picks a solve_ivp method for the ODE model of a CRN with estimate_stiffness.
+
+    The problem is treated as stiff if spectral radius * time span exceeds stiffness_threshold: it is then
+    solved with the implicit "BDF" method and the analytic Jacobian, otherwise with the explicit "RK45" method.
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param timepoints: the timepoints of the simulation
+    :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+    :param stiffness_threshold: largest spectral radius * time span solved with an explicit method
+    :param sparse_threshold: the implicit method uses sparse linear algebra from this number of species on
+    :return: (method, whether the Jacobian should be passed as a sparse matrix)
+    """
+    compiled = crn if isinstance(crn, CompiledCRN) else CompiledCRN(crn)
+    timepoints = np.asarray(timepoints, dtype=float)
+    radius = estimate_stiffness(compiled, initial_condition_dict)
+    stiffness = radius * (timepoints[-1] - timepoints[0])
+    stiff = stiffness > stiffness_threshold
+    method = "BDF" if stiff else "RK45"
+    sparse = stiff and compiled.n_species >= sparse_threshold
+    logger.info(f"Spectral radius of the Jacobian {radius:.3g} (stiffness {stiffness:.3g}): "
+                f"using {method}" + (f" with {'sparse' if sparse else 'dense'} linear algebra" if stiff else ""))
+    return method, sparse
+
+
+class DeterministicIntegrator(object):
+    """Integrates the ODE model of a CompiledCRN with scipy.integrate.solve_ivp, from any initial state.
+
+    The conservation law basis, the solver method and the Jacobian are set up once and reused by
+    every call of run, e.g. for the phases of a Protocol. The totals of the conservation laws are
+    taken from the initial state of each run.
+
+    :param compiled: CompiledCRN
+    :param reduce_conservation_laws: if True, dependent species of conservation laws are eliminated
+                                     before integration and reconstructed afterwards
+    :param method: solve_ivp method (e.g. "LSODA", "BDF", "RK45") or "auto" (see select_method)
+    :param timepoints: the timepoints of the simulation, used by method = "auto" to estimate the stiffness
+    :param initial_condition_dict: the initial condition used by method = "auto" to estimate the stiffness
+    :param solver_kwargs: passed on to solve_ivp (e.g. rtol, atol)
+    """
+    def __init__(self, compiled: CompiledCRN, reduce_conservation_laws: bool = True, method: str = "auto",
+                 timepoints=None, initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                 **solver_kwargs):
+        self.compiled = compiled
+        self.sparse = False
+        if method == "auto":
+            if timepoints is None:
+                raise ValueError("method = 'auto' requires the timepoints of the simulation.")
+            method, self.sparse = select_method(compiled, timepoints, initial_condition_dict)
+        self.method = method
+
+        if reduce_conservation_laws:
+            self.reduction = ConservationLawReduction(compiled, compiled.initial_state(initial_condition_dict))
+        else:
+            self.reduction = None
+
+        self.solver_kwargs = dict(solver_kwargs)
+        if method in ("BDF", "Radau"):
+            self.solver_kwargs.setdefault("jac", self.jac)
+
+    def jac(self, t, y):
+        """The analytic Jacobian of the integrated (possibly reduced) system, assembled as a sparse matrix if self.sparse."""
+        if self.reduction is not None:
+            J = self.reduction.jacobian(y, sparse=self.sparse)
+        else:
+            J = self.compiled.sparse_jacobian(y) if self.sparse else self.compiled.jacobian(y)
+        return J.tocsc() if self.sparse else J
+
+    def run(self, x0, timepoints):
+        """Integrates from the state x0 (n_species,) at timepoints[0] and returns the states (timepoints x species)."""
+        x0 = np.asarray(x0, dtype=float)
+        timepoints = np.asarray(timepoints, dtype=float)
+        if self.reduction is not None:
+            self.reduction.totals = self.reduction.conserved_totals(x0)
+            f, y0 = self.reduction.rhs, self.reduction.reduce(x0)
+        else:
+            f, y0 = self.compiled.rhs, x0
+
+        if len(y0) == 0 or len(timepoints) == 1:
+            # every species is fixed by a conservation law, or there is nothing to integrate
+            return np.tile(x0, (len(timepoints), 1))
+        sol = solve_ivp(f, (timepoints[0], timepoints[-1]), y0, t_eval=timepoints, method=self.method, **self.solver_kwargs)
+        if not sol.success:
+            raise RuntimeError(f"Deterministic simulation failed: {sol.message}")
+        states = sol.y.T
+        return states if self.reduction is None else self.reduction.reconstruct(states)
+
+
+def simulate_deterministic(crn, timepoints, initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                           reduce_conservation_laws: bool = True, method: str = "auto",
+                           return_dataframe: bool = True, **solver_kwargs):
+    """Integrates the deterministic (ODE) model of a CRN in-process with scipy.integrate.solve_ivp.
+
+    With method = "auto", the method is picked by select_method: "RK45" for non-stiff models, and "BDF"
+    with the analytic Jacobian (sparse for large models) for stiff ones. The choice is logged at the
+    INFO level of the logger of this module. The implicit methods "BDF" and "Radau" always use the
+    analytic Jacobian unless a jac keyword is given.
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param timepoints: increasing array of times at which the state is returned
+    :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+    :param reduce_conservation_laws: if True, dependent species of conservation laws are eliminated
+                                     before integration and reconstructed afterwards
+    :param method: solve_ivp method (e.g. "LSODA", "BDF", "RK45") or "auto"
+    :param return_dataframe: return a pandas DataFrame (if pandas is installed) or a dictionary of arrays
+    :param solver_kwargs: passed on to solve_ivp (e.g. rtol, atol)
+    :return: trajectory with a "time" column and one column per repr(species)
+    """
+    if not HAVE_NUMPY:
+        raise ModuleNotFoundError("simulate_deterministic requires numpy and scipy. Please install them (pip install biocrnpyler[all]).")
+
+    compiled = crn if isinstance(crn, CompiledCRN) else CompiledCRN(crn)
+    timepoints = np.asarray(timepoints, dtype=float)
+    integrator = DeterministicIntegrator(compiled, reduce_conservation_laws=reduce_conservation_laws, method=method,
+                                         timepoints=timepoints, initial_condition_dict=initial_condition_dict,
+                                         **solver_kwargs)
+    states = integrator.run(compiled.initial_state(initial_condition_dict), timepoints)
+    return compiled.format_result(timepoints, states, return_dataframe=return_dataframe)
+
+
+def simulate_deterministic_batch(crn, timepoints, parameters, initial_conditions=None, method: str = "BDF",
+                                 sparse_threshold: int = 100, **solver_kwargs):
+    """Integrates the ODE model of a CRN for P parameter vectors with a single solver call.
+
+    The P states are stacked into one (P x n_species) state. All right hand sides are evaluated
+    with one vectorized call and the Jacobian is the block diagonal sparse matrix of the P analytic
+    Jacobians (used by the implicit methods "BDF" and "Radau"). From sparse_threshold species on, the
+    blocks are sparse themselves (see CompiledCRN.sparse_jacobian), otherwise they are dense.
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param timepoints: increasing array of times at which the states are returned
+    :param parameters: matrix (P x n_parameters) of parameter vectors, in the slots of the parameter table
+                       of the CRN (see CompiledCRN.parameter_matrix)
+    :param initial_conditions: initial state of shape (n_species,) or (P, n_species)
+                               (default: the initial concentrations of the species)
+    :param method: solve_ivp method
+    :param sparse_threshold: the Jacobian blocks are assembled as sparse matrices from this number of species on
+    :param solver_kwargs: passed on to solve_ivp (e.g. rtol, atol)
+    :return: numpy array of shape (P, len(timepoints), n_species), species in the order of compiled.species
+    """
+    if not HAVE_NUMPY:
+        raise ModuleNotFoundError("simulate_deterministic_batch requires numpy and scipy. Please install them (pip install biocrnpyler[all]).")
+
+    compiled = crn if isinstance(crn, CompiledCRN) else CompiledCRN(crn)
+    timepoints = np.asarray(timepoints, dtype=float)
+    parameters = np.atleast_2d(np.asarray(parameters, dtype=float))
+    if parameters.shape[1] != len(compiled.parameters):
+        raise ValueError(f"parameters must have {len(compiled.parameters)} columns (one per slot of the parameter table), "
+                         f"not {parameters.shape[1]}.")
+    n_sets, n = len(parameters), compiled.n_species
+    x0 = compiled.initial_state() if initial_conditions is None else np.asarray(initial_conditions, dtype=float)
+    x0 = np.broadcast_to(x0, (n_sets, n))
+
+    def rhs(t, y):
+        return compiled.species_rates(y.reshape(n_sets, n), parameters=parameters).ravel()
+
+    def jac(t, y):
+        states = y.reshape(n_sets, n)
+        if n >= sparse_threshold:
+            return scipy.sparse.block_diag([compiled.sparse_jacobian(states[p], parameters=parameters[p])
+                                            for p in range(n_sets)], format="csc")
+        blocks = compiled.jacobian(states, parameters=parameters)
+        return scipy.sparse.bsr_matrix((blocks, np.arange(n_sets), np.arange(n_sets + 1)), shape=(n_sets*n, n_sets*n))
+
+    if method in ("BDF", "Radau"):
+        solver_kwargs.setdefault("jac", jac)
+    sol = solve_ivp(rhs, (timepoints[0], timepoints[-1]), x0.ravel(), t_eval=timepoints, method=method, **solver_kwargs)
+    if not sol.success:
+        raise RuntimeError(f"Deterministic simulation failed: {sol.message}")
+    return sol.y.T.reshape(len(timepoints), n_sets, n).transpose(1, 0, 2)
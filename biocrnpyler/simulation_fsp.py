@@ -0,0 +1,184 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+from typing import Dict, Union
+
+from .compiled_crn import HAVE_NUMPY, CompiledCRN
+from .species import Species
+
+if HAVE_NUMPY:
+    import numpy as np
+    import scipy.sparse
+    from scipy.sparse.linalg import expm_multiply
+
+
+class FiniteStateProjection(object):
+    """Finite State Projection (FSP) of the chemical master equation of a small CRN.
+
+    The states reachable from the initial state without exceeding the copy number bounds are enumerated
+    (breadth first, one vectorized propensity evaluation per frontier). Transitions to states above the
+    bounds are redirected to a single absorbing sink state, so the probability in the sink is the
+    projection error: the exact distribution restricted to the projected states is bounded below by the
+    FSP distribution and the two differ by at most the sink probability (Munsky and Khammash, 2006).
+
+    Large CRNs can be reduced first, e.g. with ChemicalReactionNetwork.subnetwork.
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param bounds: {Species or repr(Species): largest copy number} of the projection
+    :param default_bound: largest copy number of the species without a bound
+    :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+    :param max_states: raise a ValueError if the projection has more states than this
+    """
+    def __init__(self, crn, bounds: Union[Dict[Species, int], Dict[str, int], None] = None, default_bound: int = 100,
+                 initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                 max_states: int = 1000000):
+        if not HAVE_NUMPY:
+            raise ModuleNotFoundError("FiniteStateProjection requires numpy and scipy. Please install them (pip install biocrnpyler[all]).")
+
+        self.compiled = crn if isinstance(crn, CompiledCRN) else CompiledCRN(crn)
+        self.bounds = np.full(self.compiled.n_species, default_bound, dtype=float)
+        for key, bound in (bounds or {}).items():
+            matches = [i for i, s in enumerate(self.compiled.species) if s == key or repr(s) == key]
+            if len(matches) == 0:
+                raise ValueError(f"Species {key} in bounds is not part of the CRN.")
+            self.bounds[matches] = bound
+
+        self.initial_state = np.round(self.compiled.initial_state(initial_condition_dict))
+        if np.any(self.initial_state > self.bounds):
+            raise ValueError("The initial state exceeds the copy number bounds of the projection.")
+
+        self.states, self.generator = self._enumerate(max_states)
+
+    @property
+    def n_states(self) -> int:
+        """The number of projected states (the sink is not counted)."""
+        return len(self.states)
+
+    def _enumerate(self, max_states):
+        """Enumerates the reachable states and assembles the sparse generator matrix (states + sink).
+
+        :return: (states array of shape (n_states, n_species), generator in CSC format)
+        """
+        stoichiometry = self.compiled.stoichiometric_matrix.T.tocsr()  # channels x species, sparse
+        index = {self.initial_state.tobytes(): 0}
+        states = [self.initial_state]
+        sources, targets, rates = [], [], []
+        out_of_bounds = []  # (source, rate) pairs of the transitions to the sink
+
+        frontier = np.arange(1)
+        while len(frontier) > 0:
+            x = np.array([states[i] for i in frontier])
+            a = np.maximum(self.compiled.propensities(x, stochastic=True), 0)
+            new_frontier = []
+            rows, channels = np.nonzero(a > 0)
+            # the next states of the transitions with a positive propensity only
+            next_states = x[rows] + stoichiometry[channels].toarray()
+            # transitions to negative copy numbers are infeasible (a propensity which does not vanish with
+            # its reactants) and are dropped; only truncation above the bounds flows into the sink
+            feasible = np.all(next_states >= 0, axis=1)
+            rows, channels, next_states = rows[feasible], channels[feasible], next_states[feasible]
+            inside = np.all(next_states <= self.bounds, axis=1)
+            for row, channel, next_state, is_inside in zip(rows, channels, next_states, inside):
+                source, rate = frontier[row], a[row, channel]
+                if not is_inside:
+                    out_of_bounds.append((source, rate))
+                    continue
+                key = next_state.tobytes()
+                if key not in index:
+                    index[key] = len(states)
+                    states.append(next_state)
+                    new_frontier.append(index[key])
+                    if len(states) > max_states:
+                        raise ValueError(f"The projection has more than max_states = {max_states} states. "
+                                         "Use smaller bounds or a smaller CRN.")
+                sources.append(source)
+                targets.append(index[key])
+                rates.append(rate)
+            frontier = np.array(new_frontier, dtype=int)
+
+        n = len(states)
+        sink = n
+        sources += [source for source, _ in out_of_bounds]
+        targets += [sink] * len(out_of_bounds)
+        rates += [rate for _, rate in out_of_bounds]
+        sources, targets, rates = np.array(sources, dtype=int), np.array(targets, dtype=int), np.array(rates)
+        # dp/dt = A p with A[target, source] = rate and A[source, source] = -total outflow of source
+        outflow = np.bincount(sources, weights=rates, minlength=n+1)
+        generator = scipy.sparse.csc_matrix((np.concatenate([rates, -outflow]),
+                                             (np.concatenate([targets, np.arange(n+1)]),
+                                              np.concatenate([sources, np.arange(n+1)]))), shape=(n+1, n+1))
+        return np.array(states), generator
+
+    def solve(self, timepoints, p0=None) -> "FSPSolution":
+        """Propagates the distribution to every timepoint with scipy.sparse.linalg.expm_multiply.
+
+        :param timepoints: increasing array of times; the distribution at timepoints[0] is p0
+        :param p0: initial distribution over self.states (default: all mass on the initial state)
+        :return: FSPSolution
+        """
+        timepoints = np.asarray(timepoints, dtype=float)
+        p = np.zeros(self.n_states + 1)
+        if p0 is None:
+            p[0] = 1.0
+        else:
+            p[:-1] = p0
+
+        probabilities = np.zeros((len(timepoints), self.n_states + 1))
+        probabilities[0] = p
+        for i in range(1, len(timepoints)):
+            p = expm_multiply(self.generator * (timepoints[i] - timepoints[i-1]), p)
+            probabilities[i] = p
+        probabilities = np.maximum(probabilities, 0)
+        return FSPSolution(self, timepoints, probabilities[:, :-1], probabilities[:, -1])
+
+
+class FSPSolution(object):
+    """Distributions computed by FiniteStateProjection.solve.
+
+    :param fsp: the FiniteStateProjection
+    :param timepoints: times of the distributions
+    :param probabilities: array (timepoints x states) of the probabilities of fsp.states
+    :param error: projection error at every timepoint (the probability that left the projection)
+    """
+    def __init__(self, fsp: FiniteStateProjection, timepoints, probabilities, error):
+        self.fsp = fsp
+        self.timepoints = timepoints
+        self.probabilities = probabilities
+        self.error = error
+
+    def _species_index(self, species: Union[Species, str]) -> int:
+        for i, s in enumerate(self.fsp.compiled.species):
+            if s == species or repr(s) == species:
+                return i
+        raise ValueError(f"Species {species} is not part of the CRN.")
+
+    def marginal(self, species: Union[Species, str]):
+        """The distribution of the copy number of species: array (timepoints x (bound + 1))."""
+        i = self._species_index(species)
+        counts = self.fsp.states[:, i].astype(int)
+        marginal = np.zeros((len(self.timepoints), int(self.fsp.bounds[i]) + 1))
+        for t in range(len(self.timepoints)):
+            marginal[t] = np.bincount(counts, weights=self.probabilities[t], minlength=marginal.shape[1])
+        return marginal
+
+    def mean(self, species: Union[Species, str]):
+        """The mean copy number of species at every timepoint (within the projection)."""
+        return self.probabilities.dot(self.fsp.states[:, self._species_index(species)])
+
+
+def simulate_fsp(crn, timepoints, bounds: Union[Dict[Species, int], Dict[str, int], None] = None, default_bound: int = 100,
+                 initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                 max_states: int = 1000000) -> FSPSolution:
+    """Computes the distribution of a small CRN with the Finite State Projection (see FiniteStateProjection).
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param timepoints: increasing array of times at which the distribution is returned
+    :param bounds: {Species or repr(Species): largest copy number} of the projection
+    :param default_bound: largest copy number of the species without a bound
+    :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+    :param max_states: raise a ValueError if the projection has more states than this
+    :return: FSPSolution with the probabilities of the states, marginals and the projection error
+    """
+    fsp = FiniteStateProjection(crn, bounds=bounds, default_bound=default_bound,
+                                initial_condition_dict=initial_condition_dict, max_states=max_states)
+    return fsp.solve(timepoints)
@@ -0,0 +1,136 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+from typing import Dict, Union
+
+from .compiled_crn import HAVE_NUMPY, CompiledCRN
+from .species import Species
+
+if HAVE_NUMPY:
+    import numpy as np
+    from scipy.integrate import solve_ivp
+
+
+class LinearNoiseApproximation(object):
+    """Mean and covariance equations of a CompiledCRN (species in copy numbers).
+
+    Linear noise approximation (LNA): the mean follows the deterministic ODE dmu/dt = S v(mu) and the
+    covariance the Lyapunov equation dC/dt = J C + C J^T + D with the Jacobian J = S dv/dx(mu) and
+    the diffusion matrix D = S diag(v(mu)) S^T.
+
+    With moment_closure = True, the second order (zero third cumulant) moment closure of a mass action
+    network is used instead: the propensities are the stochastic (falling factorial) ones and their
+    expectations include the covariance terms, E[v_j] = v_j(mu) + 1/2 sum_ik d2v_j/dx_i dx_k C_ik. The
+    third cumulants are neglected, so the moments are exact for zeroth and first order reactions and
+    approximate (usually better than the LNA) for higher order reactions.
+
+    :param compiled: CompiledCRN
+    :param moment_closure: use the second order moment closure (mass action networks only)
+    """
+    def __init__(self, compiled: CompiledCRN, moment_closure: bool = False):
+        if moment_closure and (len(compiled._hill_channels) > 0 or len(compiled._general_groups) > 0
+                               or len(compiled._rate_law_channels) > 0):
+            raise ValueError("moment_closure requires a CRN with mass action propensities only.")
+        self.compiled = compiled
+        self.moment_closure = moment_closure
+        self.n = compiled.n_species
+        self.stoichiometry = compiled.stoichiometric_matrix.toarray()  # species x channels
+
+    def _mean_propensities(self, mean, covariance):
+        """The (expected) propensities of every channel at the mean state."""
+        v = self.compiled.propensities(mean, stochastic=self.moment_closure)
+        if not self.moment_closure or len(self.compiled._ma_channels) == 0:
+            return v
+
+        # E[prod_s t_s] = prod_s E[t_s] + sum_{s < s'} C[i_s, i_s'] prod_{others} E[t]
+        compiled = self.compiled
+        extended = np.zeros((self.n + 1, self.n + 1))  # the constant slot (index n) has no covariance
+        extended[:self.n, :self.n] = covariance
+        terms = np.append(mean, 1.0)[compiled._ma_index] - compiled._ma_offset
+        n_slots = terms.shape[1]
+        correction = np.zeros(len(compiled._ma_channels))
+        for s in range(n_slots):
+            for s2 in range(s + 1, n_slots):
+                others = terms.copy()
+                others[:, [s, s2]] = 1
+                correction += extended[compiled._ma_index[:, s], compiled._ma_index[:, s2]] * np.prod(others, axis=1)
+        v = v.copy()
+        v[compiled._ma_channels] += compiled._ma_k * correction
+        return v
+
+    def rhs(self, t, y):
+        """Right hand side of the combined state y = [mean, covariance.flatten()]."""
+        mean, covariance = y[:self.n], y[self.n:].reshape(self.n, self.n)
+        v = self._mean_propensities(mean, covariance)
+        J = self.stoichiometry.dot(self.compiled.propensity_jacobian(mean, stochastic=self.moment_closure))
+        D = (self.stoichiometry * v).dot(self.stoichiometry.T)
+        dcovariance = J.dot(covariance) + covariance.dot(J.T) + D
+        return np.concatenate([self.stoichiometry.dot(v), dcovariance.flatten()])
+
+    def solve(self, timepoints, x0, covariance0=None, method: str = "LSODA", **solver_kwargs) -> "LNASolution":
+        """Integrates the mean and covariance from x0 (and covariance0, default 0).
+
+        :param solver_kwargs: passed on to scipy.integrate.solve_ivp
+        :return: LNASolution
+        """
+        timepoints = np.asarray(timepoints, dtype=float)
+        covariance0 = np.zeros((self.n, self.n)) if covariance0 is None else np.asarray(covariance0, dtype=float)
+        y0 = np.concatenate([np.asarray(x0, dtype=float), covariance0.flatten()])
+        sol = solve_ivp(self.rhs, (timepoints[0], timepoints[-1]), y0, t_eval=timepoints, method=method, **solver_kwargs)
+        if not sol.success:
+            raise RuntimeError(f"Linear noise approximation failed: {sol.message}")
+        mean = sol.y[:self.n].T
+        covariance = sol.y[self.n:].T.reshape(len(timepoints), self.n, self.n)
+        # remove the asymmetry accumulated by the integrator
+        covariance = (covariance + np.transpose(covariance, (0, 2, 1))) / 2
+        return LNASolution(self.compiled, timepoints, mean, covariance)
+
+
+class LNASolution(object):
+    """Means (timepoints x species) and covariances (timepoints x species x species) computed by LinearNoiseApproximation."""
+    def __init__(self, compiled: CompiledCRN, timepoints, mean, covariance):
+        self.compiled = compiled
+        self.timepoints = timepoints
+        self.mean = mean
+        self.covariance = covariance
+
+    def _species_index(self, species: Union[Species, str]) -> int:
+        for i, s in enumerate(self.compiled.species):
+            if s == species or repr(s) == species:
+                return i
+        raise ValueError(f"Species {species} is not part of the CRN.")
+
+    def variance(self, species: Union[Species, str]):
+        """The variance of species at every timepoint."""
+        i = self._species_index(species)
+        return self.covariance[:, i, i]
+
+    def format_result(self, return_dataframe: bool = True):
+        """The mean trajectory, formatted like the result of simulate_deterministic."""
+        return self.compiled.format_result(self.timepoints, self.mean, return_dataframe=return_dataframe)
+
+
+def simulate_lna(crn, timepoints, initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                 initial_covariance=None, moment_closure: bool = False, method: str = "LSODA",
+                 **solver_kwargs) -> LNASolution:
+    """Computes the mean and covariance of the species of a CRN with the linear noise approximation
+    (see LinearNoiseApproximation), at about the cost of an ODE simulation.
+
+    For parameter sweeps, pass a CompiledCRN and change its rates with CompiledCRN.set_parameters.
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param timepoints: increasing array of times at which the moments are returned
+    :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+    :param initial_covariance: covariance matrix of the initial state (default: 0)
+    :param moment_closure: use the second order moment closure (mass action networks only)
+    :param method: solve_ivp method
+    :param solver_kwargs: passed on to solve_ivp (e.g. rtol, atol)
+    :return: LNASolution
+    """
+    if not HAVE_NUMPY:
+        raise ModuleNotFoundError("simulate_lna requires numpy and scipy. Please install them (pip install biocrnpyler[all]).")
+
+    compiled = crn if isinstance(crn, CompiledCRN) else CompiledCRN(crn)
+    lna = LinearNoiseApproximation(compiled, moment_closure=moment_closure)
+    return lna.solve(timepoints, compiled.initial_state(initial_condition_dict), covariance0=initial_covariance,
+                     method=method, **solver_kwargs)
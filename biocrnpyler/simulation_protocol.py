@@ -0,0 +1,263 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+from typing import Dict, List, Union
+
+from .compiled_crn import HAVE_NUMPY, CompiledCRN
+from .simulation_deterministic import DeterministicIntegrator
+from .simulation_stochastic import CLEIntegrator, HybridStepper, TauLeapingStepper
+from .species import Species
+
+if HAVE_NUMPY:
+    import numpy as np
+
+
+def _species_indices(compiled: CompiledCRN, key: Union[Species, str]) -> List[int]:
+    """The indices of the species matching a Species or repr(Species)."""
+    matches = [i for i, s in enumerate(compiled.species) if s == key or repr(s) == key]
+    if len(matches) == 0:
+        raise ValueError(f"Species {key} in a protocol event is not part of the CRN.")
+    return matches
+
+
+class ProtocolEvent(object):
+    """A change of the state or the parameters of a simulation at a scheduled time.
+
+    Subclasses implement apply, which returns the states (replicates x species) after the event.
+    Stochastic simulations of copy numbers pass their numpy.random.Generator as rng, so that events
+    can keep the states integer.
+
+    :param time: the time of the event
+    """
+    def __init__(self, time: float):
+        self.time = float(time)
+
+    def apply(self, compiled: CompiledCRN, x, rng=None):
+        raise NotImplementedError(f"{self.__class__.__name__} does not implement apply.")
+
+
+class SetState(ProtocolEvent):
+    """Resets the concentrations (or copy numbers) of some species, e.g. a medium exchange.
+
+    :param time: the time of the event
+    :param values: {Species or repr(Species): new value}
+    """
+    def __init__(self, time: float, values: Union[Dict[Species, float], Dict[str, float]]):
+        ProtocolEvent.__init__(self, time)
+        self.values = dict(values)
+
+    def apply(self, compiled: CompiledCRN, x, rng=None):
+        x = x.copy()
+        for key, value in self.values.items():
+            x[..., _species_indices(compiled, key)] = value
+        return x
+
+
+class AddSpecies(ProtocolEvent):
+    """Adds an amount of some species, e.g. an inducer.
+
+    :param time: the time of the event
+    :param amounts: {Species or repr(Species): added amount}
+    """
+    def __init__(self, time: float, amounts: Union[Dict[Species, float], Dict[str, float]]):
+        ProtocolEvent.__init__(self, time)
+        self.amounts = dict(amounts)
+
+    def apply(self, compiled: CompiledCRN, x, rng=None):
+        x = x.copy()
+        for key, amount in self.amounts.items():
+            x[..., _species_indices(compiled, key)] += amount
+        return x
+
+
+class Dilute(ProtocolEvent):
+    """Multiplies the concentrations of all (or some) species by a factor, e.g. a dilution of the extract.
+
+    With copy numbers (rng given), every molecule is kept with probability factor (binomial sampling).
+
+    :param time: the time of the event
+    :param factor: the dilution factor, between 0 and 1
+    :param species: the diluted species (default: all species)
+    """
+    def __init__(self, time: float, factor: float, species: Union[List[Species], List[str], None] = None):
+        ProtocolEvent.__init__(self, time)
+        if not 0 <= factor <= 1:
+            raise ValueError(f"The dilution factor must be between 0 and 1, not {factor}.")
+        self.factor = factor
+        self.species = species
+
+    def apply(self, compiled: CompiledCRN, x, rng=None):
+        if self.species is None:
+            indices = list(range(compiled.n_species))
+        else:
+            indices = [i for key in self.species for i in _species_indices(compiled, key)]
+        x = x.copy()
+        if rng is None:
+            x[..., indices] *= self.factor
+        else:
+            x[..., indices] = rng.binomial(np.round(x[..., indices]).astype(int), self.factor)
+        return x
+
+
+class SetParameters(ProtocolEvent):
+    """Changes parameter values of the compiled CRN (without recompiling), e.g. a temperature shift.
+
+    :param time: the time of the event
+    :param parameters: {slot, parameter name or ParameterKey: value} (see ParameterTable.resolve)
+    """
+    def __init__(self, time: float, parameters: Dict):
+        ProtocolEvent.__init__(self, time)
+        self.parameters = dict(parameters)
+
+    def apply(self, compiled: CompiledCRN, x, rng=None):
+        compiled.set_parameters(self.parameters)
+        return x
+
+
+class Protocol(object):
+    """A schedule of ProtocolEvents for multi-phase experiments (induction, dilution, parameter shifts).
+
+    Protocol.simulate compiles the CRN once and integrates the phases between events with the same
+    compiled CRN and integrator, applying the events in between. Events at the same time are applied
+    in the order in which they were added. The state returned at a timepoint which coincides with an
+    event includes the event.
+
+    :param events: list of ProtocolEvents
+    """
+    engines = ("deterministic", "tau_leaping", "hybrid", "cle")
+
+    def __init__(self, events: List[ProtocolEvent] = None):
+        self.events = []
+        for event in events or []:
+            self.add_event(event)
+
+    def add_event(self, event: ProtocolEvent) -> "Protocol":
+        if not isinstance(event, ProtocolEvent):
+            raise TypeError(f"Protocol events must be ProtocolEvents, not {type(event)}.")
+        self.events.append(event)
+        # stable sort: simultaneous events keep their order
+        self.events.sort(key=lambda e: e.time)
+        return self
+
+    def set_state(self, time: float, values) -> "Protocol":
+        return self.add_event(SetState(time, values))
+
+    def add_species(self, time: float, amounts) -> "Protocol":
+        return self.add_event(AddSpecies(time, amounts))
+
+    def dilute(self, time: float, factor: float, species=None) -> "Protocol":
+        return self.add_event(Dilute(time, factor, species))
+
+    def set_parameters(self, time: float, parameters) -> "Protocol":
+        return self.add_event(SetParameters(time, parameters))
+
+    def _runner(self, compiled: CompiledCRN, engine: str, timepoints, initial_condition_dict, rng, engine_kwargs):
+        """The engine as a function run(x (replicates x species), times) -> states (replicates x times x species)."""
+        if engine == "deterministic":
+            integrator = DeterministicIntegrator(compiled, timepoints=timepoints,
+                                                 initial_condition_dict=initial_condition_dict, **engine_kwargs)
+            return lambda x, times: integrator.run(x[0], times)[None]
+        elif engine == "tau_leaping":
+            return TauLeapingStepper(compiled, rng=rng, **engine_kwargs).run
+        elif engine == "hybrid":
+            return HybridStepper(compiled, rng=rng, **engine_kwargs).run
+        else:
+            integrator = CLEIntegrator(compiled, rng=rng, **engine_kwargs)
+            return lambda x, times: np.transpose(integrator.run(x, times), (1, 0, 2))
+
+    def run(self, compiled: CompiledCRN, timepoints, n_replicates: int = 1,
+            initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+            engine: str = "deterministic", rng=None, **engine_kwargs):
+        """Runs the protocol like simulate and returns the raw states.
+
+        :return: array of shape (replicates, timepoints, species), species in the order of compiled.species
+                 (a single replicate for the deterministic engine)
+        """
+        if engine not in self.engines:
+            raise ValueError(f"Unknown simulation engine {engine}, use one of {self.engines}.")
+        timepoints = np.asarray(timepoints, dtype=float)
+        if len(self.events) > 0 and self.events[0].time < timepoints[0]:
+            raise ValueError(f"The protocol has an event at time {self.events[0].time}, before the first timepoint {timepoints[0]}.")
+        rng = np.random.default_rng() if rng is None else rng
+        discrete = engine in ("tau_leaping", "hybrid")
+        if engine == "deterministic":
+            n_replicates = 1
+
+        x0 = compiled.initial_state(initial_condition_dict)
+        x = np.tile(np.round(x0) if discrete else x0, (n_replicates, 1))
+        events = [e for e in self.events if e.time <= timepoints[-1]]
+        boundaries = sorted(set([timepoints[0]] + [e.time for e in events] + [timepoints[-1]]))
+        states = np.zeros((n_replicates, len(timepoints), compiled.n_species))
+
+        parameters = compiled.parameters.copy()
+        try:
+            run = None
+            for k, start in enumerate(boundaries):
+                for event in events:
+                    if event.time == start:
+                        x = event.apply(compiled, x, rng=rng if discrete else None)
+                if k == 0:
+                    # the engine is set up once, after the events at the first timepoint
+                    run = self._runner(compiled, engine, timepoints, initial_condition_dict, rng, engine_kwargs)
+                recorded = timepoints == start
+                states[:, recorded] = x[:, None, :]
+                if k == len(boundaries) - 1:
+                    break
+
+                end = boundaries[k+1]
+                inside = (timepoints > start) & (timepoints < end)
+                phase = run(x, np.concatenate([[start], timepoints[inside], [end]]))
+                states[:, inside] = phase[:, 1:-1]
+                x = phase[:, -1]
+        finally:
+            compiled.set_parameters(parameters)
+
+        return states
+
+    def simulate(self, crn, timepoints, initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                 engine: str = "deterministic", n_replicates: int = 1, seed=None, return_dataframe: bool = True,
+                 **engine_kwargs):
+        """Simulates the CRN through the protocol with an in-process engine.
+
+        The parameters of a CompiledCRN changed by SetParameters events are restored afterwards.
+
+        :param crn: ChemicalReactionNetwork or CompiledCRN
+        :param timepoints: increasing array of times at which the state is returned
+        :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+        :param engine: "deterministic" (DeterministicIntegrator), "tau_leaping" (TauLeapingStepper),
+                       "hybrid" (HybridStepper) or "cle" (CLEIntegrator)
+        :param n_replicates: number of independent trajectories of the stochastic engines
+        :param seed: seed (or numpy.random.Generator) of the random numbers of the stochastic engines
+        :param return_dataframe: return pandas DataFrames (if pandas is installed) or dictionaries of arrays
+        :param engine_kwargs: passed on to the engine (e.g. rtol and atol, or dt of the CLE)
+        :return: trajectory with a "time" column and one column per repr(species);
+                 a list of n_replicates trajectories if n_replicates > 1
+        """
+        if not HAVE_NUMPY:
+            raise ModuleNotFoundError("Protocol.simulate requires numpy and scipy. Please install them (pip install biocrnpyler[all]).")
+
+        compiled = crn if isinstance(crn, CompiledCRN) else CompiledCRN(crn)
+        timepoints = np.asarray(timepoints, dtype=float)
+        rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+        states = self.run(compiled, timepoints, n_replicates=n_replicates, initial_condition_dict=initial_condition_dict,
+                          engine=engine, rng=rng, **engine_kwargs)
+
+        results = [compiled.format_result(timepoints, s, return_dataframe=return_dataframe) for s in states]
+        return results[0] if len(results) == 1 else results
+
+
+def simulate_protocol(crn, protocol: Union[Protocol, List[ProtocolEvent]], timepoints,
+                      initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                      engine: str = "deterministic", **kwargs):
+    """Simulates a multi-phase experiment with one compiled CRN (see Protocol.simulate).
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param protocol: Protocol or list of ProtocolEvents
+    :param timepoints: increasing array of times at which the state is returned
+    :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+    :param engine: "deterministic", "tau_leaping", "hybrid" or "cle"
+    :param kwargs: passed on to Protocol.simulate
+    """
+    if not isinstance(protocol, Protocol):
+        protocol = Protocol(protocol)
+    return protocol.simulate(crn, timepoints, initial_condition_dict=initial_condition_dict, engine=engine, **kwargs)
@@ -0,0 +1,134 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+from typing import Callable, Dict, List, Union
+
+from .compiled_crn import HAVE_NUMPY, CompiledCRN
+from .species import Species
+
+if HAVE_NUMPY:
+    import numpy as np
+    from scipy.integrate import solve_ivp
+
+
+def _parameter_slots(compiled: CompiledCRN, parameters) -> List[int]:
+    """Slots of the parameter table for a list of slots, parameter names or ParameterKeys (default: all)."""
+    if parameters is None:
+        return list(range(len(compiled.parameters)))
+    return [compiled.parameter_table.slot(p) for p in parameters]
+
+
+class SensitivitySolution(object):
+    """Trajectory and forward sensitivities computed by forward_sensitivities.
+
+    :param compiled: the CompiledCRN
+    :param timepoints: times of the solution
+    :param states: array (timepoints x species)
+    :param sensitivities: array (timepoints x species x parameters) of dx_i/dp_k
+    :param slots: the parameter table slots of the parameters
+    """
+    def __init__(self, compiled: CompiledCRN, timepoints, states, sensitivities, slots):
+        self.compiled = compiled
+        self.timepoints = timepoints
+        self.states = states
+        self.sensitivities = sensitivities
+        self.slots = slots
+
+    @property
+    def parameter_names(self) -> List[str]:
+        return [self.compiled.parameter_table.names[k] for k in self.slots]
+
+    def format_result(self, return_dataframe: bool = True):
+        """The trajectory, formatted like the result of simulate_deterministic."""
+        return self.compiled.format_result(self.timepoints, self.states, return_dataframe=return_dataframe)
+
+
+def forward_sensitivities(crn, timepoints, parameters=None,
+                          initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                          method: str = "LSODA", **solver_kwargs) -> SensitivitySolution:
+    """Integrates the ODE model of a CRN together with its forward sensitivity equations.
+
+    The sensitivities s_k = dx/dp_k follow ds_k/dt = J s_k + S dv/dp_k with the analytic Jacobians of the
+    compiled CRN. The cost grows with the number of parameters: use adjoint_gradient for many parameters.
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param timepoints: increasing array of times at which the solution is returned
+    :param parameters: slots, parameter names or ParameterKeys of the parameter table (default: all parameters)
+    :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+    :param method: solve_ivp method
+    :param solver_kwargs: passed on to solve_ivp (e.g. rtol, atol)
+    :return: SensitivitySolution
+    """
+    if not HAVE_NUMPY:
+        raise ModuleNotFoundError("forward_sensitivities requires numpy and scipy. Please install them (pip install biocrnpyler[all]).")
+
+    compiled = crn if isinstance(crn, CompiledCRN) else CompiledCRN(crn)
+    timepoints = np.asarray(timepoints, dtype=float)
+    slots = _parameter_slots(compiled, parameters)
+    n, q = compiled.n_species, len(slots)
+    stoichiometry = compiled.stoichiometric_matrix.toarray()
+
+    def rhs(t, y):
+        x, sensitivities = y[:n], y[n:].reshape(n, q)
+        J = stoichiometry.dot(compiled.propensity_jacobian(x))
+        F = stoichiometry.dot(compiled.propensity_parameter_jacobian(x)[:, slots])
+        return np.concatenate([compiled.species_rates(x), (J.dot(sensitivities) + F).ravel()])
+
+    y0 = np.concatenate([compiled.initial_state(initial_condition_dict), np.zeros(n * q)])
+    sol = solve_ivp(rhs, (timepoints[0], timepoints[-1]), y0, t_eval=timepoints, method=method, **solver_kwargs)
+    if not sol.success:
+        raise RuntimeError(f"Sensitivity analysis failed: {sol.message}")
+    return SensitivitySolution(compiled, timepoints, sol.y[:n].T, sol.y[n:].T.reshape(len(timepoints), n, q), slots)
+
+
+def adjoint_gradient(crn, timepoints, loss_gradient: Callable, parameters=None,
+                     initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                     method: str = "LSODA", **solver_kwargs):
+    """Gradient of a loss of the trajectory with respect to the parameters, with one forward and one backward solve.
+
+    The loss is L = sum_t g_t(x(t)) over the timepoints (e.g. a sum of squared errors to data). The adjoint
+    lambda solves dlambda/dt = -J^T lambda backwards in time, jumping by dg_t/dx at every timepoint, and
+    dL/dp = integral of lambda^T S dv/dp dt. The cost does not grow with the number of parameters.
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param timepoints: increasing array of the times of the loss terms (the first one is the initial time)
+    :param loss_gradient: function of the trajectory states (timepoints x species) returning dL/dx(t),
+                          an array (timepoints x species)
+    :param parameters: slots, parameter names or ParameterKeys of the parameter table (default: all parameters)
+    :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+    :param method: solve_ivp method
+    :param solver_kwargs: passed on to solve_ivp (e.g. rtol, atol)
+    :return: (gradient with one entry per parameter, trajectory states (timepoints x species))
+    """
+    if not HAVE_NUMPY:
+        raise ModuleNotFoundError("adjoint_gradient requires numpy and scipy. Please install them (pip install biocrnpyler[all]).")
+
+    compiled = crn if isinstance(crn, CompiledCRN) else CompiledCRN(crn)
+    timepoints = np.asarray(timepoints, dtype=float)
+    slots = _parameter_slots(compiled, parameters)
+    n, q = compiled.n_species, len(slots)
+    stoichiometry = compiled.stoichiometric_matrix.toarray()
+
+    forward = solve_ivp(compiled.rhs, (timepoints[0], timepoints[-1]), compiled.initial_state(initial_condition_dict),
+                        t_eval=timepoints, dense_output=True, method=method, **solver_kwargs)
+    if not forward.success:
+        raise RuntimeError(f"Deterministic simulation failed: {forward.message}")
+    states = forward.y.T
+    dg = np.asarray(loss_gradient(states), dtype=float)
+
+    def rhs(t, y):
+        x, adjoint = forward.sol(t), y[:n]
+        J = stoichiometry.dot(compiled.propensity_jacobian(x))
+        F = stoichiometry.dot(compiled.propensity_parameter_jacobian(x)[:, slots])
+        # integrated backwards in time: d(gradient)/dt = -lambda^T F
+        return np.concatenate([-J.T.dot(adjoint), -F.T.dot(adjoint)])
+
+    y = np.concatenate([dg[-1], np.zeros(q)])
+    for i in range(len(timepoints) - 1, 0, -1):
+        if timepoints[i] > timepoints[i-1]:
+            backward = solve_ivp(rhs, (timepoints[i], timepoints[i-1]), y, method=method, **solver_kwargs)
+            if not backward.success:
+                raise RuntimeError(f"Adjoint integration failed: {backward.message}")
+            y = backward.y[:, -1]
+        y[:n] += dg[i-1]
+    return y[n:], states
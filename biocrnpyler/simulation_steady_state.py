@@ -0,0 +1,225 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+import warnings
+from typing import Dict, Union
+
+from .compiled_crn import HAVE_NUMPY, CompiledCRN, ConservationLawReduction
+from .species import Species
+
+if HAVE_NUMPY:
+    import numpy as np
+    import scipy.sparse
+    from scipy.sparse.linalg import spsolve
+
+
+class SteadyStateSolver(object):
+    """Finds steady states of the ODE model of a CompiledCRN without integrating to long times.
+
+    The dependent species of the conservation laws are eliminated (see ConservationLawReduction), so
+    the Jacobian of the reduced system is non-singular at isolated steady states. Each solve first runs
+    damped Newton iterations with the analytic Jacobian and a sparse linear solver; the steps are
+    shortened to keep the concentrations non-negative and to decrease the residual. If Newton stalls,
+    the solver falls back to pseudo-transient continuation: backward Euler steps (I/dt - J) dy = f(y)
+    whose step size dt grows as the residual shrinks (switched evolution relaxation), which follows the
+    dynamics towards a stable steady state and becomes a Newton iteration close to it.
+
+    The conservation law basis is computed once and reused by every solve.
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param reduce_conservation_laws: eliminate the dependent species of the conservation laws
+    :param rtol: relative tolerance: converged when max|dx/dt| <= atol + rtol * max(x)
+    :param atol: absolute tolerance of the rates
+    :param max_newton_iterations: Newton iterations before falling back to pseudo-transient continuation
+    :param max_continuation_steps: pseudo-transient continuation steps before raising a RuntimeError
+    """
+    def __init__(self, crn, reduce_conservation_laws: bool = True, rtol: float = 1e-8, atol: float = 1e-12,
+                 max_newton_iterations: int = 50, max_continuation_steps: int = 2000):
+        if not HAVE_NUMPY:
+            raise ModuleNotFoundError("SteadyStateSolver requires numpy and scipy. Please install them (pip install biocrnpyler[all]).")
+
+        self.compiled = crn if isinstance(crn, CompiledCRN) else CompiledCRN(crn)
+        n = self.compiled.n_species
+        if reduce_conservation_laws:
+            self.reduction = ConservationLawReduction(self.compiled, np.zeros(n))
+        else:
+            self.reduction = None
+        self.rtol = rtol
+        self.atol = atol
+        self.max_newton_iterations = max_newton_iterations
+        self.max_continuation_steps = max_continuation_steps
+        # the number of solves which converged with Newton iterations and with continuation
+        self.statistics = {"newton": 0, "continuation": 0}
+
+    def _reconstruct(self, y):
+        return y if self.reduction is None else self.reduction.reconstruct(y)
+
+    def _reduce(self, x):
+        return x if self.reduction is None else self.reduction.reduce(x)
+
+    def _residual(self, y, parameters):
+        x = self._reconstruct(y)
+        return self._reduce(self.compiled.species_rates(x, parameters=parameters)), x
+
+    def _jacobian(self, y, parameters):
+        """The sparse Jacobian of the (reduced) system."""
+        if self.reduction is None:
+            return self.compiled.sparse_jacobian(y, parameters=parameters)
+        return self.reduction.jacobian(y, parameters=parameters, sparse=True)
+
+    def _converged(self, f, x) -> bool:
+        return np.max(np.abs(f)) <= self.atol + self.rtol * np.max(np.abs(x))
+
+    @staticmethod
+    def _solve_linear(A, b):
+        """Solves A z = b (A sparse) with a sparse LU factorization, returning None if A is singular."""
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            z = spsolve(A.tocsc(), b)
+        return z if np.all(np.isfinite(z)) else None
+
+    @staticmethod
+    def _step_to_boundary(x, dx) -> float:
+        """The largest step s <= 1 which keeps x + s dx non-negative (with a margin)."""
+        decreasing = dx < 0
+        if not np.any(decreasing):
+            return 1.0
+        return min(1.0, 0.99 * np.min(x[decreasing] / -dx[decreasing]))
+
+    def _newton(self, y, parameters):
+        f, x = self._residual(y, parameters)
+        for _ in range(self.max_newton_iterations):
+            if self._converged(f, x):
+                return y
+            dy = self._solve_linear(self._jacobian(y, parameters), -f)
+            if dy is None:
+                return None
+            dx = self._reconstruct(y + dy) - x
+            step = self._step_to_boundary(x, dx)
+            norm = np.linalg.norm(f)
+            while step > 1e-10:
+                f_new, x_new = self._residual(y + step * dy, parameters)
+                if np.linalg.norm(f_new) <= (1 - 1e-4 * step) * norm:
+                    break
+                step /= 2
+            else:
+                return None
+            y, f, x = y + step * dy, f_new, x_new
+        return y if self._converged(f, x) else None
+
+    def _continuation(self, y, parameters):
+        f, x = self._residual(y, parameters)
+        identity = scipy.sparse.identity(len(y), format="csr")
+        dt = 1e-3 / max(1.0, np.max(np.abs(f)))
+        for _ in range(self.max_continuation_steps):
+            if self._converged(f, x):
+                return y
+            dy = self._solve_linear(identity / dt - self._jacobian(y, parameters), f)
+            if dy is None:
+                dt /= 10
+                continue
+            f_new, x_new = self._residual(y + dy, parameters)
+            if np.any(x_new < 0):
+                # the step overshoots below zero: shorten the pseudo time step
+                dt /= 10
+                continue
+            # switched evolution relaxation, with at least doubling while the residual decreases
+            ratio = np.linalg.norm(f) / max(np.linalg.norm(f_new), 1e-300)
+            dt = min(dt * (ratio if ratio < 1 else max(ratio, 2.0)), 1e12)
+            y, f, x = y + dy, f_new, x_new
+        return None
+
+    def solve(self, x0, parameters=None, guess=None):
+        """The steady state reached from the initial state x0.
+
+        :param x0: initial state (n_species,), which sets the totals of the conservation laws
+        :param parameters: parameter vector (n_parameters,) (default: self.compiled.parameters)
+        :param guess: starting point of the iterations, e.g. a nearby steady state (default: x0).
+                      Ignored if it violates the conservation laws of x0 with negative concentrations.
+        :return: steady state (n_species,), species in the order of compiled.species
+        """
+        x0 = np.asarray(x0, dtype=float)
+        if self.reduction is not None:
+            self.reduction.totals = self.reduction.conserved_totals(x0)
+            if self.reduction.n_reduced == 0:
+                return x0.copy()
+
+        starts = [x0]
+        if guess is not None:
+            start = self._reconstruct(self._reduce(np.asarray(guess, dtype=float)))
+            if np.all(start >= 0):
+                starts.insert(0, start)
+        for start in starts:
+            y = self._newton(self._reduce(start), parameters)
+            if y is not None:
+                self.statistics["newton"] += 1
+                return self._reconstruct(y)
+
+        y = self._continuation(self._reduce(starts[0]), parameters)
+        if y is None:
+            raise RuntimeError("The steady state solver did not converge. Increase max_continuation_steps "
+                               "or check that the CRN has a bounded steady state.")
+        self.statistics["continuation"] += 1
+        return self._reconstruct(y)
+
+    def sweep(self, parameters=None, initial_conditions=None):
+        """Steady states for a sequence of parameter vectors and/or initial conditions.
+
+        Each point is warm-started from the steady state of the previous point, so sweeps along a smooth
+        path (e.g. a dose-response curve) take a few Newton iterations per point.
+
+        :param parameters: matrix (P x n_parameters) of parameter vectors (see CompiledCRN.parameter_matrix)
+        :param initial_conditions: initial state of shape (n_species,) or (P, n_species)
+                                   (default: the initial concentrations of the species)
+        :return: numpy array of shape (P, n_species), species in the order of compiled.species
+        """
+        n = self.compiled.n_species
+        x0 = self.compiled.initial_state() if initial_conditions is None else np.asarray(initial_conditions, dtype=float)
+        if parameters is None:
+            n_points = 1 if x0.ndim == 1 else len(x0)
+            parameters = np.tile(self.compiled.parameters, (n_points, 1))
+        parameters = np.atleast_2d(np.asarray(parameters, dtype=float))
+        if parameters.shape[1] != len(self.compiled.parameters):
+            raise ValueError(f"parameters must have {len(self.compiled.parameters)} columns (one per slot of the parameter table), "
+                             f"not {parameters.shape[1]}.")
+        x0 = np.broadcast_to(x0, (len(parameters), n))
+
+        states = np.zeros((len(parameters), n))
+        guess = None
+        for i in range(len(parameters)):
+            states[i] = self.solve(x0[i], parameters=parameters[i], guess=guess)
+            guess = states[i]
+        return states
+
+
+def find_steady_state(crn, initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                      parameters=None, **solver_kwargs) -> Dict[str, float]:
+    """Finds the steady state of the ODE model of a CRN reached from its initial condition (see SteadyStateSolver).
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+    :param parameters: a vector with a value for every slot of the parameter table, or a dictionary
+                       {slot, parameter name or ParameterKey: value} (default: the parameters of the CRN)
+    :param solver_kwargs: passed on to SteadyStateSolver (e.g. rtol, atol)
+    :return: dictionary {repr(species): steady state concentration}
+    """
+    solver = SteadyStateSolver(crn, **solver_kwargs)
+    compiled = solver.compiled
+    if parameters is not None:
+        parameters = np.array(compiled.parameter_table.resolve(parameters, compiled.parameters), dtype=float)
+    x = solver.solve(compiled.initial_state(initial_condition_dict), parameters=parameters)
+    return {repr(s): x[i] for i, s in enumerate(compiled.species)}
+
+
+def steady_state_sweep(crn, parameters=None, initial_conditions=None, **solver_kwargs):
+    """Steady states of a CRN along a sweep of parameter vectors and/or initial conditions, warm-starting
+    every point from the previous one (see SteadyStateSolver.sweep).
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param parameters: matrix (P x n_parameters) of parameter vectors (see CompiledCRN.parameter_matrix)
+    :param initial_conditions: initial state of shape (n_species,) or (P, n_species)
+                               (default: the initial concentrations of the species)
+    :param solver_kwargs: passed on to SteadyStateSolver (e.g. rtol, atol)
+    :return: numpy array of shape (P, n_species), species in the order of compiled.species
+    """
+    return SteadyStateSolver(crn, **solver_kwargs).sweep(parameters=parameters, initial_conditions=initial_conditions)
@@ -0,0 +1,583 @@
+#  Copyright (c) 2020, Build-A-Cell. All rights reserved.
+#  See LICENSE file in the project root directory for details.
+
+from typing import Dict, Union
+
+from .compiled_crn import HAVE_NUMPY, CompiledCRN
+from .species import Species
+
+if HAVE_NUMPY:
+    import numpy as np
+
+
+def _record_states(states, timepoints, next_time, replicates, x, t):
+    """Stores x as the state of every unrecorded timepoint up to t (replicates are rows of x and t).
+
+    next_time[r] is the index of the next timepoint to record for replicate r.
+    """
+    last = np.searchsorted(timepoints, t, side='right')
+    for row in np.nonzero(last > next_time[replicates])[0]:
+        r = replicates[row]
+        states[r, next_time[r]:last[row]] = x[row]
+        next_time[r] = last[row]
+
+
+def _state_changes(stoichiometry, firings):
+    """The state changes (rows x species) of the channel firings (rows x channels), for the sparse
+    (species x channels) stoichiometric matrix. The stoichiometry is never densified."""
+    return stoichiometry.dot(firings.T).T
+
+
+def _single_firings(stoichiometry, channels):
+    """The state changes (rows x species) of one firing of channels[r] in every row r."""
+    firings = np.zeros((len(channels), stoichiometry.shape[1]))
+    firings[np.arange(len(channels)), channels] = 1
+    return _state_changes(stoichiometry, firings)
+
+
+def _choose_channels(rng, a):
+    """Samples one channel per row of the propensities a (rows x channels), with probability a_j / sum(a)."""
+    cumulative = np.cumsum(a, axis=1)
+    u = rng.random(len(a)) * cumulative[:, -1]
+    return np.minimum((cumulative < u[:, None]).sum(axis=1), a.shape[1]-1)
+
+
+class TauLeapingStepper(object):
+    """Adaptive explicit tau-leaping (Cao, Gillespie and Petzold, J. Chem. Phys. 124, 044109, 2006) for a CompiledCRN.
+
+    All replicates are advanced together: propensities, step sizes and Poisson samples are
+    computed with one NumPy call for the whole (replicates x channels) array.
+
+    Every step, a channel is critical if it is within n_critical firings of exhausting one of the species it
+    consumes. Non-critical channels fire Poisson(a_j tau) times, with tau chosen such that the propensities
+    change by at most (about) a factor epsilon. At most one critical channel fires per leap. When the leap
+    would be shorter than ssa_threshold / a_0, the replicate takes n_ssa_steps exact SSA steps instead.
+
+    The highest order of reaction used for the step selection is computed from the reactant stoichiometry
+    of each channel; propensities which are not mass action (e.g. Hill functions) count as first order.
+
+    :param compiled: CompiledCRN
+    :param epsilon: error control parameter of the step selection
+    :param n_critical: channels that can fire fewer times than this before exhausting a reactant are critical
+    :param ssa_threshold: use SSA steps when the leap is shorter than ssa_threshold / a_0
+    :param n_ssa_steps: number of SSA steps taken before trying to leap again
+    :param rng: numpy.random.Generator
+    """
+    def __init__(self, compiled: CompiledCRN, epsilon: float = 0.03, n_critical: int = 10,
+                 ssa_threshold: float = 10.0, n_ssa_steps: int = 100, rng=None):
+        self.compiled = compiled
+        self.epsilon = epsilon
+        self.n_critical = n_critical
+        self.ssa_threshold = ssa_threshold
+        self.n_ssa_steps = n_ssa_steps
+        self.rng = np.random.default_rng() if rng is None else rng
+
+        self.stoichiometry = compiled.stoichiometric_matrix  # species x channels, sparse
+        self._squared_stoichiometry = self.stoichiometry.power(2)
+        n_species, n_channels = self.stoichiometry.shape
+
+        # reactant coefficients of every channel: {(channel, species): coefficient}
+        reactants = {}
+        for channel, (reaction_ind, reverse) in enumerate(compiled.channels):
+            if reaction_ind is None:
+                reactants[(channel, compiled._sink_species[channel - compiled.n_reaction_channels])] = 1
+                continue
+            r = compiled.crn.reactions[reaction_ind]
+            for w in (r.outputs if reverse else r.inputs):
+                key = (channel, compiled.species_index[w.species])
+                reactants[key] = reactants.get(key, 0) + w.stoichiometry
+
+        # highest order of reaction of every reactant species and its coefficient in that reaction
+        order = np.zeros(n_channels)
+        for (channel, _), coefficient in reactants.items():
+            order[channel] += coefficient
+        self._hor = np.zeros(n_species)
+        self._hor_coefficient = np.zeros(n_species)
+        for (channel, i), coefficient in sorted(reactants.items()):
+            if (order[channel], coefficient) > (self._hor[i], self._hor_coefficient[i]):
+                self._hor[i] = order[channel]
+                self._hor_coefficient[i] = coefficient
+        self._reactant_species = self._hor > 0
+
+        # consumed species of every channel: _consumed_amount[m] molecules of _consumed_species[m] by _consumed_channel[m]
+        entries = self.stoichiometry.tocoo()
+        consumed = entries.data < 0
+        self._consumed_channel, self._consumed_species = entries.col[consumed], entries.row[consumed]
+        self._consumed_amount = -entries.data[consumed]
+
+    def propensities(self, x):
+        return np.maximum(self.compiled.propensities(x, stochastic=True), 0)
+
+    def _g(self, x):
+        """The factor g_i of the step selection for states x (replicates x species)."""
+        n, c = self._hor, self._hor_coefficient
+        x1 = np.maximum(x - 1, 1)
+        x2 = np.maximum(x - 2, 1)
+        g = np.where(n >= 1, n, 1.0)
+        g = np.where((n == 2) & (c == 2), 2 + 1/x1, g)
+        g = np.where((n == 3) & (c == 2), 1.5*(2 + 1/x1), g)
+        g = np.where((n == 3) & (c == 3), 3 + 1/x1 + 2/x2, g)
+        return g
+
+    def critical(self, x, a):
+        """Boolean array (replicates x channels) of the critical channels."""
+        firings = np.full(a.shape, np.inf)
+        if len(self._consumed_channel) > 0:
+            np.minimum.at(firings.T, self._consumed_channel,
+                          np.floor(x[:, self._consumed_species] / self._consumed_amount).T)
+        return (a > 0) & (firings < self.n_critical)
+
+    def leap_size(self, x, a, critical):
+        """The largest leap tau' for which the non-critical propensities change by about epsilon."""
+        a_noncritical = np.where(critical, 0, a)
+        mu = _state_changes(self.stoichiometry, a_noncritical)
+        sigma2 = _state_changes(self._squared_stoichiometry, a_noncritical)
+        bound = np.maximum(self.epsilon * x / self._g(x), 1.0)
+        with np.errstate(divide='ignore'):
+            tau = np.minimum(bound/np.abs(mu), bound**2/sigma2)
+        tau = np.where(self._reactant_species, tau, np.inf)
+        return tau.min(axis=1) if tau.shape[1] > 0 else np.full(len(x), np.inf)
+
+    def ssa_step(self, x, a, t_max):
+        """One exact SSA step for each replicate. Replicates whose next event is after t_max do not change.
+
+        :return: new states and times of the steps (t_max when no event happens before it)
+        """
+        a0 = a.sum(axis=1)
+        with np.errstate(divide='ignore'):
+            dt = self.rng.exponential(1.0, size=len(x)) / a0
+        fires = dt <= t_max
+        x = x.copy()
+        if np.any(fires):
+            x[fires] += _single_firings(self.stoichiometry, _choose_channels(self.rng, a[fires]))
+        return x, np.where(fires, dt, t_max)
+
+    def leap(self, x, a, critical, tau_prime, t_max):
+        """One tau-leap for each replicate, halving tau' until no species becomes negative.
+
+        :return: new states and the leap sizes
+        """
+        x_new = np.empty_like(x)
+        tau = np.empty(len(x))
+        todo = np.arange(len(x))
+        while len(todo) > 0:
+            a_todo, critical_todo = a[todo], critical[todo]
+            a0_critical = np.where(critical_todo, a_todo, 0).sum(axis=1)
+            with np.errstate(divide='ignore'):
+                tau_critical = self.rng.exponential(1.0, size=len(todo)) / a0_critical
+            step = np.minimum(np.minimum(tau_prime[todo], tau_critical), t_max[todo])
+            firings = self.rng.poisson(np.where(critical_todo, 0, a_todo) * step[:, None]).astype(float)
+
+            # one critical channel fires when the leap reaches the critical event
+            critical_fires = np.nonzero(tau_critical <= step)[0]
+            if len(critical_fires) > 0:
+                a_critical = np.where(critical_todo[critical_fires], a_todo[critical_fires], 0)
+                firings[critical_fires, _choose_channels(self.rng, a_critical)] += 1
+
+            proposal = x[todo] + _state_changes(self.stoichiometry, firings)
+            accepted = np.all(proposal >= 0, axis=1)
+            x_new[todo[accepted]] = proposal[accepted]
+            tau[todo[accepted]] = step[accepted]
+            tau_prime[todo[~accepted]] = tau_prime[todo[~accepted]] / 2
+            todo = todo[~accepted]
+        return x_new, tau
+
+    def run(self, x0, timepoints):
+        """Simulates every initial state of x0 (replicates x species) and returns states (replicates x timepoints x species)."""
+        x = np.array(x0, dtype=float)
+        n_replicates = len(x)
+        states = np.zeros((n_replicates, len(timepoints), x.shape[1]))
+        t = np.full(n_replicates, timepoints[0])
+        next_time = np.zeros(n_replicates, dtype=int)  # index of the next timepoint to record
+        ssa_steps_left = np.zeros(n_replicates, dtype=int)
+
+        _record_states(states, timepoints, next_time, np.arange(n_replicates), x, t)
+        active = np.nonzero(next_time < len(timepoints))[0]
+        while len(active) > 0:
+            xa, ta = x[active], t[active]
+            a = self.propensities(xa)
+            t_max = timepoints[next_time[active]] - ta
+
+            critical = self.critical(xa, a)
+            tau_prime = self.leap_size(xa, a, critical)
+            with np.errstate(divide='ignore'):
+                use_ssa = (ssa_steps_left[active] > 0) | (tau_prime < self.ssa_threshold / a.sum(axis=1))
+
+            x_new, dt = np.empty_like(xa), np.empty(len(active))
+            if np.any(use_ssa):
+                x_new[use_ssa], dt[use_ssa] = self.ssa_step(xa[use_ssa], a[use_ssa], t_max[use_ssa])
+                restart = use_ssa & (ssa_steps_left[active] == 0)
+                ssa_steps_left[active[restart]] = self.n_ssa_steps
+                ssa_steps_left[active[use_ssa]] -= 1
+            leap = ~use_ssa
+            if np.any(leap):
+                x_new[leap], dt[leap] = self.leap(xa[leap], a[leap], critical[leap], tau_prime[leap], t_max[leap])
+
+            # the state at a timepoint includes every event up to (and at) that time
+            x[active], t[active] = x_new, ta + dt
+            _record_states(states, timepoints, next_time, active, x_new, t[active])
+            active = active[next_time[active] < len(timepoints)]
+        return states
+
+
+def simulate_tau_leaping(crn, timepoints, initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                         n_replicates: int = 1, epsilon: float = 0.03, n_critical: int = 10,
+                         ssa_threshold: float = 10.0, n_ssa_steps: int = 100, seed=None,
+                         return_dataframe: bool = True):
+    """Simulates the stochastic model of a CRN with adaptive explicit tau-leaping (see TauLeapingStepper).
+
+    Species are copy numbers: the initial state is rounded to integers. Leaps never cross a timepoint,
+    so the state returned at every timepoint includes all events up to that time.
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param timepoints: increasing array of times at which the state is returned
+    :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+    :param n_replicates: number of independent trajectories, simulated together
+    :param epsilon: error control parameter of the step selection
+    :param n_critical: channels that can fire fewer times than this before exhausting a reactant are critical
+    :param ssa_threshold: use exact SSA steps when the leap is shorter than ssa_threshold / total propensity
+    :param n_ssa_steps: number of SSA steps taken before trying to leap again
+    :param seed: seed (or numpy.random.Generator) of the random numbers
+    :param return_dataframe: return pandas DataFrames (if pandas is installed) or dictionaries of arrays
+    :return: trajectory with a "time" column and one column per repr(species);
+             a list of n_replicates trajectories if n_replicates > 1
+    """
+    if not HAVE_NUMPY:
+        raise ModuleNotFoundError("simulate_tau_leaping requires numpy and scipy. Please install them (pip install biocrnpyler[all]).")
+
+    compiled = crn if isinstance(crn, CompiledCRN) else CompiledCRN(crn)
+    timepoints = np.asarray(timepoints, dtype=float)
+    x0 = np.round(compiled.initial_state(initial_condition_dict))
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+
+    stepper = TauLeapingStepper(compiled, epsilon=epsilon, n_critical=n_critical, ssa_threshold=ssa_threshold,
+                                n_ssa_steps=n_ssa_steps, rng=rng)
+    states = stepper.run(np.tile(x0, (n_replicates, 1)), timepoints)
+
+    results = [compiled.format_result(timepoints, s, return_dataframe=return_dataframe) for s in states]
+    return results[0] if n_replicates == 1 else results
+
+
+class HybridStepper(object):
+    """Partitioned hybrid simulation: fast channels are integrated as ODEs and slow channels fire as discrete events.
+
+    The partition is recomputed for every replicate at every step. A channel is fast when it is expected to
+    fire at least fast_firings times during max_step and every species it changes has at least
+    fast_copy_number molecules; all other channels (e.g. promoter binding and unbinding) are slow.
+
+    During a step, the fast channels are integrated with the explicit midpoint rule and the slow
+    propensities are frozen at their value at the start of the step. The step size of every replicate is
+    adapted so that the fast propensities change by at most a fraction epsilon between the start and the
+    midpoint of the step: steps which change them more are rejected and retried with a smaller step,
+    which keeps fast, stiff subsystems (e.g. fast binding and unbinding) stable. The integrated slow
+    propensity of every replicate is accumulated until it reaches an Exp(1) threshold, at which point a
+    single slow event fires (chosen with probability proportional to its propensity) and the step ends.
+    Slow events are therefore exact SSA events when no channel is fast.
+
+    :param compiled: CompiledCRN
+    :param max_step: largest time step of the ODE integration
+    :param fast_firings: minimum expected number of firings per max_step of a fast channel
+    :param fast_copy_number: minimum copy number of every species changed by a fast channel
+    :param epsilon: largest relative change of the fast propensities over half a step
+    :param rng: numpy.random.Generator
+    """
+    def __init__(self, compiled: CompiledCRN, max_step: float = 0.01, fast_firings: float = 10.0,
+                 fast_copy_number: float = 100.0, epsilon: float = 0.03, rng=None):
+        self.compiled = compiled
+        self.max_step = max_step
+        self.epsilon = epsilon
+        self.fast_firings = fast_firings
+        self.fast_copy_number = fast_copy_number
+        self.rng = np.random.default_rng() if rng is None else rng
+
+        self.stoichiometry = compiled.stoichiometric_matrix  # species x channels, sparse
+        # channels x species: 1 where a channel changes a species
+        self._changes = (self.stoichiometry.T != 0).astype(float).tocsr()
+
+    def propensities(self, x):
+        return np.maximum(self.compiled.propensities(x, stochastic=True), 0)
+
+    def partition(self, x, a):
+        """Boolean array (replicates x channels) of the fast channels."""
+        low_copy = self._changes.dot((x < self.fast_copy_number).astype(float).T).T > 0
+        return (a * self.max_step >= self.fast_firings) & ~low_copy
+
+    def fast_step(self, x, a, fast, step):
+        """Integrates the fast channels of the states x (replicates x species) with the explicit midpoint rule,
+        shortening the step of the replicates whose fast propensities change by more than epsilon.
+
+        :param a: propensities at x (replicates x channels)
+        :param fast: boolean array (replicates x channels) of the fast channels
+        :param step: proposed steps (replicates,)
+        :return: new states, the steps taken and the largest relative change of the fast propensities
+        """
+        a_fast = np.where(fast, a, 0)
+        drift = _state_changes(self.stoichiometry, a_fast)
+        x_new, step, change = np.empty_like(x), step.copy(), np.zeros(len(x))
+        todo = np.nonzero(np.any(fast, axis=1))[0]
+        x_new[~np.any(fast, axis=1)] = x[~np.any(fast, axis=1)]
+        while len(todo) > 0:
+            h = step[todo]
+            midpoint = np.maximum(x[todo] + 0.5 * h[:, None] * drift[todo], 0)
+            a_midpoint = np.where(fast[todo], self.propensities(midpoint), 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                relative = np.where(fast[todo], np.abs(a_midpoint - a_fast[todo]) / a_fast[todo], 0).max(axis=1)
+            relative = np.where(np.isfinite(relative), relative, np.inf)
+            accepted = relative <= self.epsilon
+            x_new[todo[accepted]] = np.maximum(x[todo[accepted]] + h[accepted, None] * _state_changes(self.stoichiometry, a_midpoint[accepted]), 0)
+            change[todo[accepted]] = relative[accepted]
+
+            # the change of the propensities is about proportional to the step
+            rejected = todo[~accepted]
+            step[rejected] = h[~accepted] * np.maximum(0.9 * self.epsilon / relative[~accepted], 0.1)
+            if np.any(step[rejected] < 1e-12 * self.max_step):
+                raise RuntimeError("The step size of the hybrid simulation underflowed. Check the propensities "
+                                   "of the fast reactions, or decrease max_step.")
+            todo = rejected
+
+        if not np.all(np.isfinite(x_new)):
+            raise RuntimeError("The hybrid simulation produced non-finite states. Decrease epsilon or max_step.")
+        return x_new, step, change
+
+    def run(self, x0, timepoints):
+        """Simulates every initial state of x0 (replicates x species) and returns states (replicates x timepoints x species)."""
+        x = np.array(x0, dtype=float)
+        n_replicates = len(x)
+        states = np.zeros((n_replicates, len(timepoints), x.shape[1]))
+        t = np.full(n_replicates, timepoints[0])
+        next_time = np.zeros(n_replicates, dtype=int)
+        integrated = np.zeros(n_replicates)  # integrated slow propensity since the last slow event
+        threshold = self.rng.exponential(1.0, size=n_replicates)
+        proposed = np.full(n_replicates, self.max_step)  # the next step of the fast integration
+
+        _record_states(states, timepoints, next_time, np.arange(n_replicates), x, t)
+        active = np.nonzero(next_time < len(timepoints))[0]
+        while len(active) > 0:
+            xa = x[active]
+            a = self.propensities(xa)
+            fast = self.partition(xa, a)
+            a_slow = np.where(fast, 0, a)
+            a0_slow = a_slow.sum(axis=1)
+
+            # the step ends at the next timepoint, after the proposed step or at the next slow event
+            to_timepoint = timepoints[next_time[active]] - t[active]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                to_event = np.where(a0_slow > 0, (threshold[active] - integrated[active]) / a0_slow, np.inf)
+            step = np.minimum(np.minimum(to_timepoint, proposed[active]), to_event)
+
+            if np.any(fast):
+                xa, step, change = self.fast_step(xa, a, fast, step)
+                # the next proposed step changes the fast propensities by about 0.9 epsilon (growing at most 2 times);
+                # steps truncated by a timepoint or a slow event do not shrink it
+                with np.errstate(divide='ignore'):
+                    adapted = np.where(change > 0, 0.9 * self.epsilon * step / change, np.inf)
+                proposed[active] = np.minimum(np.minimum(2 * proposed[active], adapted), self.max_step)
+            event = to_event <= step
+
+            integrated[active] += a0_slow * step
+            if np.any(event):
+                xa[event] = np.maximum(xa[event] + _single_firings(self.stoichiometry, _choose_channels(self.rng, a_slow[event])), 0)
+                integrated[active[event]] = 0
+                threshold[active[event]] = self.rng.exponential(1.0, size=np.count_nonzero(event))
+
+            x[active], t[active] = xa, t[active] + step
+            _record_states(states, timepoints, next_time, active, xa, t[active])
+            active = active[next_time[active] < len(timepoints)]
+        return states
+
+
+def simulate_hybrid(crn, timepoints, initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                    n_replicates: int = 1, max_step: float = 0.01, fast_firings: float = 10.0,
+                    fast_copy_number: float = 100.0, epsilon: float = 0.03, seed=None, return_dataframe: bool = True):
+    """Simulates a CRN with the hybrid stochastic/deterministic partitioned method (see HybridStepper).
+
+    Low copy, slow reactions (e.g. promoter states of DNAassembly and DNA_construct models) are simulated
+    as discrete events and fast, high copy reactions (e.g. protein production and degradation) as ODEs.
+    The partition is updated every step. Species are copy numbers: the initial state is rounded to integers.
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param timepoints: increasing array of times at which the state is returned
+    :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+    :param n_replicates: number of independent trajectories, simulated together
+    :param max_step: largest time step of the ODE integration
+    :param fast_firings: minimum expected number of firings per max_step of a fast reaction channel
+    :param fast_copy_number: minimum copy number of every species changed by a fast reaction channel
+    :param epsilon: largest relative change of the fast propensities over half an ODE step
+    :param seed: seed (or numpy.random.Generator) of the random numbers
+    :param return_dataframe: return pandas DataFrames (if pandas is installed) or dictionaries of arrays
+    :return: trajectory with a "time" column and one column per repr(species);
+             a list of n_replicates trajectories if n_replicates > 1
+    """
+    if not HAVE_NUMPY:
+        raise ModuleNotFoundError("simulate_hybrid requires numpy and scipy. Please install them (pip install biocrnpyler[all]).")
+
+    compiled = crn if isinstance(crn, CompiledCRN) else CompiledCRN(crn)
+    timepoints = np.asarray(timepoints, dtype=float)
+    x0 = np.round(compiled.initial_state(initial_condition_dict))
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+
+    stepper = HybridStepper(compiled, max_step=max_step, fast_firings=fast_firings,
+                            fast_copy_number=fast_copy_number, epsilon=epsilon, rng=rng)
+    states = stepper.run(np.tile(x0, (n_replicates, 1)), timepoints)
+
+    results = [compiled.format_result(timepoints, s, return_dataframe=return_dataframe) for s in states]
+    return results[0] if n_replicates == 1 else results
+
+
+class CLEIntegrator(object):
+    """Integrates the chemical Langevin equation dX = S a(X) dt + S diag(sqrt(a(X))) dW for many replicates at once.
+
+    The state is a (replicates x species) matrix which is advanced with one NumPy operation per step.
+    Propensities are clipped at zero before taking square roots and states are clipped at zero after every step.
+
+    Every step is at most dt long, and short enough that the propensities of every replicate change by
+    about a fraction epsilon at most (the step selection of tau-leaping, see TauLeapingStepper.leap_size).
+    Fast, stiff reactions therefore shorten the steps instead of making the integration unstable.
+
+    method "euler_maruyama" is the Euler-Maruyama scheme. method "milstein" adds the diagonal Milstein
+    correction sum_j S_j (S_j . grad a_j) / 4 (dW_j^2 - dt) (the cross terms between channels are neglected),
+    with the directional derivatives computed by finite differences. Channels whose state changes do not
+    affect each other's propensities are shifted together, so a few propensity evaluations give all
+    directional derivatives.
+
+    :param compiled: CompiledCRN
+    :param dt: largest time step
+    :param method: "euler_maruyama" or "milstein"
+    :param epsilon: error control parameter of the step selection
+    :param rng: numpy.random.Generator
+    """
+    methods = ("euler_maruyama", "milstein")
+
+    def __init__(self, compiled: CompiledCRN, dt: float = 0.01, method: str = "euler_maruyama", epsilon: float = 0.03,
+                 rng=None):
+        if method not in self.methods:
+            raise ValueError(f"Unknown CLE method {method}, use one of {self.methods}.")
+        self.compiled = compiled
+        self.dt = dt
+        self.method = method
+        self.epsilon = epsilon
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.stoichiometry = compiled.stoichiometric_matrix  # species x channels, sparse
+        # the step selection of tau-leaping, without critical channels
+        self._step_selection = TauLeapingStepper(compiled, epsilon=epsilon, rng=self.rng)
+        if method == "milstein":
+            self._shift_groups = self._independent_channel_groups()
+
+    def _independent_channel_groups(self):
+        """Groups of channels which can be shifted together for the directional derivatives: no channel of a group
+        changes a species that another channel of the group depends on.
+
+        :return: list of (channels, summed state change of the channels)
+        """
+        changes = (self.stoichiometry.T != 0).astype(float)
+        # affects[j, k] != 0 if channel j changes a species the propensity of channel k depends on
+        affects = (changes @ self.compiled.propensity_dependencies.T.astype(float)).tocsr()
+        conflicts = (affects + affects.T).tocsr()
+        groups = []  # [channels, set of the channels conflicting with the group]
+        for j in range(self.stoichiometry.shape[1]):
+            conflicting = set(conflicts.indices[conflicts.indptr[j]:conflicts.indptr[j+1]].tolist()) - {j}
+            for group in groups:
+                if j not in group[1]:
+                    group[0].append(j)
+                    group[1] |= conflicting
+                    break
+            else:
+                groups.append([[j], conflicting])
+        return [(np.array(channels), np.asarray(self.stoichiometry[:, channels].sum(axis=1)).ravel()) for channels, _ in groups]
+
+    def propensities(self, x):
+        return np.maximum(self.compiled.propensities(x, stochastic=True), 0)
+
+    def _directional_derivatives(self, x, a, h=1e-4):
+        """(S_j . grad a_j)(x) for every replicate and channel j."""
+        derivatives = np.empty_like(a)
+        for channels, shift in self._shift_groups:
+            derivatives[:, channels] = (self.propensities(x + h * shift)[:, channels] - a[:, channels]) / h
+        return derivatives
+
+    def step_size(self, x, a) -> float:
+        """The step for all replicates: at most dt, and at most the tau-leaping step of every replicate."""
+        tau = self._step_selection.leap_size(x, a, np.zeros(a.shape, dtype=bool))
+        return min(self.dt, np.min(tau)) if len(tau) > 0 else self.dt
+
+    def step(self, x, dt: float, a=None):
+        """Advances the states x (replicates x species) by dt and returns the new states.
+
+        :param a: the propensities at x (computed if None)
+        """
+        # overflows become non-finite states, reported by the RuntimeError below
+        with np.errstate(over='ignore', invalid='ignore'):
+            a = self.propensities(x) if a is None else a
+            dW = self.rng.normal(0.0, np.sqrt(dt), size=a.shape)
+            increments = a * dt + np.sqrt(a) * dW
+            if self.method == "milstein":
+                increments += self._directional_derivatives(x, a) / 4 * (dW**2 - dt)
+            x_new = np.maximum(x + _state_changes(self.stoichiometry, increments), 0)
+        if not np.all(np.isfinite(x_new)):
+            raise RuntimeError(f"The CLE integration produced non-finite states with a step of {dt}. "
+                               "Use a smaller dt or epsilon.")
+        return x_new
+
+    def run(self, x0, timepoints, out=None):
+        """Integrates the initial states x0 (replicates x species) and writes the state at every timepoint to out.
+
+        :param out: array of shape (timepoints, replicates, species) receiving the snapshots, e.g. a numpy.memmap
+                    (allocated if None). Each snapshot is written as soon as it is reached.
+        :return: out
+        """
+        x = np.array(x0, dtype=float)
+        shape = (len(timepoints),) + x.shape
+        if out is None:
+            out = np.zeros(shape)
+        elif out.shape != shape:
+            raise ValueError(f"out must have the shape (timepoints, replicates, species) = {shape}, not {out.shape}.")
+
+        out[0] = x
+        for i in range(1, len(timepoints)):
+            t, t_next = timepoints[i-1], timepoints[i]
+            while t < t_next:
+                a = self.propensities(x)
+                dt = self.step_size(x, a)
+                last = t + dt >= t_next - 1e-9 * dt
+                x = self.step(x, t_next - t if last else dt, a)
+                t = t_next if last else t + dt
+            out[i] = x
+        return out
+
+
+def simulate_cle(crn, timepoints, initial_condition_dict: Union[Dict[str, float], Dict[Species, float], None] = None,
+                 n_replicates: int = 1, dt: float = 0.01, method: str = "euler_maruyama", epsilon: float = 0.03,
+                 seed=None, out=None, return_dataframe: bool = True):
+    """Simulates the chemical Langevin equation of a CRN for many replicates at once (see CLEIntegrator).
+
+    Species are copy numbers. The CLE is accurate for intermediate to large copy numbers.
+
+    :param crn: ChemicalReactionNetwork or CompiledCRN
+    :param timepoints: increasing array of times at which the state is returned
+    :param initial_condition_dict: overrides Species.initial_concentration, keyed by Species or repr(Species)
+    :param n_replicates: number of independent trajectories, simulated together
+    :param dt: largest time step
+    :param method: "euler_maruyama" or "milstein"
+    :param epsilon: error control parameter of the step selection (see CLEIntegrator)
+    :param seed: seed (or numpy.random.Generator) of the random numbers
+    :param out: array of shape (timepoints, replicates, species) receiving the snapshots as they are computed,
+                e.g. a numpy.memmap. If given, out is returned instead of formatted trajectories.
+    :param return_dataframe: return pandas DataFrames (if pandas is installed) or dictionaries of arrays
+    :return: out if it is given; otherwise a trajectory with a "time" column and one column per repr(species),
+             or a list of n_replicates trajectories if n_replicates > 1
+    """
+    if not HAVE_NUMPY:
+        raise ModuleNotFoundError("simulate_cle requires numpy and scipy. Please install them (pip install biocrnpyler[all]).")
+
+    compiled = crn if isinstance(crn, CompiledCRN) else CompiledCRN(crn)
+    timepoints = np.asarray(timepoints, dtype=float)
+    x0 = compiled.initial_state(initial_condition_dict)
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+
+    integrator = CLEIntegrator(compiled, dt=dt, method=method, epsilon=epsilon, rng=rng)
+    states = integrator.run(np.tile(x0, (n_replicates, 1)), timepoints, out=out)
+    if out is not None:
+        return out
+
+    results = [compiled.format_result(timepoints, states[:, r], return_dataframe=return_dataframe) for r in range(n_replicates)]
+    return results[0] if n_replicates == 1 else results
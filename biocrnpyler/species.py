@@ -289,19 +289,18 @@ class WeightedSpecies:
         :param weighted_species: list of weighted_species
         :return: unique list of weighted_species, i.e. set(weighted_species)
         """
-        # convert to set doesn't work because we need only species equality
-        unique_species = []
+        # convert to set doesn't work because we need only species equality,
+        # so the first WeightedSpecies of every species is looked up by its species
+        first_weighted_species = {}
+        counts = {}
         for w_species in weighted_species:
-            if not any(w_species.species == u_s.species for u_s in unique_species):
-                unique_species.append(w_species)
-
-        freq_dict = dict(zip(unique_species, [0]*len(unique_species)))
-        for w_species in weighted_species:
-            for key in freq_dict:
-                if key.species == w_species.species:
-                    freq_dict[key] += w_species.stoichiometry
+            if w_species.species in counts:
+                counts[w_species.species] += w_species.stoichiometry
+            else:
+                first_weighted_species[w_species.species] = w_species
+                counts[w_species.species] = w_species.stoichiometry
 
-        return freq_dict
+        return {first_weighted_species[s]: count for s, count in counts.items()}
 
     def __eq__(self, other):
         if other.__class__ is self.__class__:
@@ -27,6 +27,7 @@ setup(
     extras_require = { 
         "all": [
             "numpy",
+            "scipy",
             "matplotlib",
             "networkx",
             "bokeh>=1.4.0",